@@ -8,6 +8,8 @@ from django.utils import timezone
 
 from accounts.models import User
 from projects.models import Project
+from projects.render_cache import render_cache_stats
+from projects.scheduling import render_queue_stats
 from billing.models import StripeCustomer, Payment, Subscription
 
 
@@ -32,6 +34,8 @@ def dashboard_stats(request):
             'ready': Project.objects.filter(status=Project.Status.READY).count(),
             'published': Project.objects.filter(is_published=True).count(),
         },
+        'render_lanes': render_queue_stats(),
+        'render_cache': render_cache_stats(),
         'billing': {
             'total_payments': Payment.objects.filter(status=Payment.Status.COMPLETED).count(),
             'active_subscriptions': Subscription.objects.filter(status=Subscription.Status.ACTIVE).count(),
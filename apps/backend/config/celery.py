@@ -20,6 +20,26 @@ app.conf.beat_schedule = {
         'task': 'billing.tasks.check_expired_subscriptions',
         'schedule': crontab(hour='*/6', minute=0),  # Every 6 hours
     },
+    'dispatch-waiting-renders': {
+        'task': 'projects.tasks.dispatch_renders_task',
+        'schedule': crontab(),  # Every minute
+    },
+    'collect-unused-page-blobs': {
+        'task': 'projects.tasks.collect_page_blobs_task',
+        'schedule': crontab(minute=30),  # Every hour
+    },
+    'recover-stuck-renders': {
+        'task': 'projects.tasks.recover_stuck_renders_task',
+        'schedule': crontab(minute='*/5'),  # Every 5 minutes
+    },
+    'expire-direct-uploads': {
+        'task': 'projects.tasks.expire_direct_uploads_task',
+        'schedule': crontab(minute=45),  # Every hour
+    },
+    'expire-upload-sessions': {
+        'task': 'projects.tasks.expire_upload_sessions_task',
+        'schedule': crontab(minute=50),  # Every hour
+    },
 }
 
 @app.task(bind=True, ignore_result=True)
@@ -229,6 +229,7 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'upload-offset',  # Resumable uploads (projects/resumable_uploads.py)
 ]
 
 # Email
@@ -270,9 +271,138 @@ CELERY_ACCEPT_CONTENT = ['json']
 CELERY_TASK_SERIALIZER = 'json'
 CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
+# Each workload has its own queue and worker service (docker-compose.yml), so emails and
+# publishing never wait behind long renders. Tasks without a route use the default 'celery' queue.
+CELERY_TASK_ROUTES = {
+    'projects.tasks.process_pdf_task': {'queue': 'render'},
+    'projects.tasks.render_pdf_chunk_task': {'queue': 'render'},
+    'projects.tasks.dispatch_renders_task': {'queue': 'publish'},
+    # Chord callbacks only write rows and delete objects; they must not wait for a free render slot
+    'projects.tasks.finalize_pdf_task': {'queue': 'publish'},
+    'projects.tasks.pdf_chunk_failed_task': {'queue': 'publish'},
+    'projects.tasks.publish_flipbook_task': {'queue': 'publish'},
+    'projects.tasks.collect_page_blobs_task': {'queue': 'publish'},
+    'projects.tasks.expire_direct_uploads_task': {'queue': 'publish'},
+    'projects.tasks.expire_upload_sessions_task': {'queue': 'publish'},
+    'projects.tasks.recover_stuck_renders_task': {'queue': 'publish'},
+    'accounts.tasks.*': {'queue': 'email'},
+    'billing.tasks.*': {'queue': 'billing'},
+}
+# Render and publish tasks are acknowledged late (re-queued if a worker dies); unacknowledged tasks
+# are redelivered after this many seconds, so it must be longer than the longest render
+CELERY_BROKER_TRANSPORT_OPTIONS = {'visibility_timeout': env.int('CELERY_VISIBILITY_TIMEOUT', default=6 * 3600)}
+
+# Cache (shared by web and worker processes)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': env('REDIS_URL', default='redis://redis:6379/0'),
+        'KEY_PREFIX': 'flipread',
+    }
+}
+
+# PDF Processing
+PDF_RENDER_DPI = env.int('PDF_RENDER_DPI', default=150)
+# Renderer backend: pdftoppm, pdftocairo or pdfium (needs pypdfium2); compare them with `manage.py benchmark_renderers`
+PDF_RENDERER = env('PDF_RENDERER', default='pdftoppm')
+# Per-page resolution from a pixel budget per flipbook page (0 = off; both set = the smaller result wins),
+# clamped to the min/max DPI. Without a budget every page is rendered at PDF_RENDER_DPI
+PDF_RENDER_TARGET_WIDTH = env.int('PDF_RENDER_TARGET_WIDTH', default=0)
+PDF_RENDER_TARGET_PIXELS = env.int('PDF_RENDER_TARGET_PIXELS', default=0)
+PDF_RENDER_MIN_DPI = env.int('PDF_RENDER_MIN_DPI', default=72)
+PDF_RENDER_MAX_DPI = env.int('PDF_RENDER_MAX_DPI', default=300)
+# Direct uploads (see projects/direct_uploads.py): with S3 the browser uploads PDFs straight to the bucket
+# in DIRECT_UPLOAD_PART_MB parts (at least 5) through presigned URLs valid for DIRECT_UPLOAD_URL_EXPIRY seconds
+PDF_MAX_UPLOAD_MB = env.int('PDF_MAX_UPLOAD_MB', default=100)
+DIRECT_UPLOADS = env.bool('DIRECT_UPLOADS', default=True)
+DIRECT_UPLOAD_PART_MB = env.int('DIRECT_UPLOAD_PART_MB', default=16)
+DIRECT_UPLOAD_URL_EXPIRY = env.int('DIRECT_UPLOAD_URL_EXPIRY', default=3600)
+# Resumable chunked uploads through the API (see projects/resumable_uploads.py): chunks are assembled
+# in UPLOAD_SESSION_DIR (shared by the app server processes); sessions without a chunk for
+# UPLOAD_SESSION_EXPIRY_HOURS are deleted
+UPLOAD_SESSION_DIR = env('UPLOAD_SESSION_DIR', default=str(BASE_DIR / 'media' / 'upload-sessions'))
+UPLOAD_CHUNK_MAX_MB = env.int('UPLOAD_CHUNK_MAX_MB', default=8)
+UPLOAD_SESSION_EXPIRY_HOURS = env.int('UPLOAD_SESSION_EXPIRY_HOURS', default=24)
+# Pre-flight limits, checked with pdfinfo before a PDF is accepted or rendered
+PDF_MAX_PAGES = env.int('PDF_MAX_PAGES', default=2000)
+PDF_MAX_PAGE_SIZE_PTS = env.int('PDF_MAX_PAGE_SIZE_PTS', default=14400)  # 200 inches, the PDF limit
+PDF_MAX_RENDER_MEGAPIXELS = env.int('PDF_MAX_RENDER_MEGAPIXELS', default=10000)  # All flipbook pages together
+PDF_PREFLIGHT_TIMEOUT = env.int('PDF_PREFLIGHT_TIMEOUT', default=30)  # Seconds
+# Renderer limits: wall-clock seconds per page and address space per poppler process (0 = unlimited)
+PDF_RENDER_TIMEOUT = env.int('PDF_RENDER_TIMEOUT', default=60)
+PDF_RENDER_MEMORY_LIMIT_MB = env.int('PDF_RENDER_MEMORY_LIMIT_MB', default=2048)
+# Retry failed ranges page by page and replace pages that still fail with a blank placeholder
+PDF_RENDER_PAGE_FALLBACK = env.bool('PDF_RENDER_PAGE_FALLBACK', default=True)
+PDF_RENDER_WORKERS = env.int('PDF_RENDER_WORKERS', default=0)  # 0 = use all CPU cores
+PDF_RENDER_CHUNK_PAGES = env.int('PDF_RENDER_CHUNK_PAGES', default=10)  # Max pages per pdftoppm process
+# Fan documents with more pages than this out into per-chunk Celery tasks (0 = always render on one worker)
+PDF_DISTRIBUTED_CHUNK_PAGES = env.int('PDF_DISTRIBUTED_CHUNK_PAGES', default=0)
+# Make the first pages (cover and first spreads) viewable while the rest of a longer document is processed,
+# then add pages every PDF_PARTIAL_UPDATE_PAGES (0 = only show a project when it is complete)
+PDF_PARTIAL_PAGES = env.int('PDF_PARTIAL_PAGES', default=4)
+PDF_PARTIAL_UPDATE_PAGES = env.int('PDF_PARTIAL_UPDATE_PAGES', default=20)
+# Render scheduling (see projects/scheduling.py): documents up to these limits go to the fast lane
+# (render_fast queue with its own worker); each user has at most RENDER_MAX_PER_USER renders in flight (0 = no cap)
+RENDER_FAST_LANE_MAX_PAGES = env.int('RENDER_FAST_LANE_MAX_PAGES', default=40)
+RENDER_FAST_LANE_MAX_MB = env.int('RENDER_FAST_LANE_MAX_MB', default=20)
+RENDER_MAX_PER_USER = env.int('RENDER_MAX_PER_USER', default=2)
+# Renders without progress for PDF_STUCK_AFTER_MINUTES (worker crashed or was redeployed) are re-queued and
+# continue from their checkpointed pages; after PDF_MAX_PROCESSING_ATTEMPTS runs the project fails
+PDF_STUCK_AFTER_MINUTES = env.int('PDF_STUCK_AFTER_MINUTES', default=30)
+PDF_MAX_PROCESSING_ATTEMPTS = env.int('PDF_MAX_PROCESSING_ATTEMPTS', default=3)
+# Write the progress counters (pages rendered/uploaded) at most every N pages or N seconds
+PDF_PROGRESS_UPDATE_PAGES = env.int('PDF_PROGRESS_UPDATE_PAGES', default=10)
+PDF_PROGRESS_UPDATE_SECONDS = env.int('PDF_PROGRESS_UPDATE_SECONDS', default=2)
+# Overlap rendering and uploading instead of rendering the whole document first
+PDF_RENDER_PIPELINE = env.bool('PDF_RENDER_PIPELINE', default=True)
+PDF_PIPELINE_CHUNK_PAGES = env.int('PDF_PIPELINE_CHUNK_PAGES', default=2)  # Pages per pdftoppm process in pipeline mode
+PDF_PIPELINE_QUEUE_DEPTH = env.int('PDF_PIPELINE_QUEUE_DEPTH', default=8)  # Max pages waiting for upload
+PAGE_UPLOAD_WORKERS = env.int('PAGE_UPLOAD_WORKERS', default=8)  # Concurrent page uploads (shared S3 connection pool)
+PAGE_UPLOAD_MAX_ATTEMPTS = env.int('PAGE_UPLOAD_MAX_ATTEMPTS', default=5)  # Per upload, including retries
+# Storage operations still failing with a transient error (5xx, throttling, dropped connection) are retried
+# this many more times, waiting PAGE_UPLOAD_RETRY_DELAY seconds doubled per retry, before the job fails
+PAGE_UPLOAD_RETRIES = env.int('PAGE_UPLOAD_RETRIES', default=3)
+PAGE_UPLOAD_RETRY_DELAY = env.float('PAGE_UPLOAD_RETRY_DELAY', default=2.0)
+# Extra page sizes as name:width in pixels (empty = only the full page image)
+PAGE_RENDITIONS = {
+    name: int(width)
+    for name, width in (
+        item.split(':') for item in env.list('PAGE_RENDITIONS', default=['thumb:200', 'screen:1000', 'retina:2000'])
+    )
+}
+PAGE_RENDITION_QUALITY = env.int('PAGE_RENDITION_QUALITY', default=85)  # JPEG quality of downscaled renditions
+# Render renditions wider than the page image again at a higher resolution (hi-DPI screens); off, they are left
+# out and clients use the page image itself. Costs a second rasterization of every page
+PAGE_RENDITIONS_HIRES = env.bool('PAGE_RENDITIONS_HIRES', default=False)
+# Candidate formats tried besides the JPEG fallback: webp, avif (needs pillow-avif-plugin), png.
+# Empty (default) = JPEG only; each candidate costs a lossless render, an encode and a quality check per page
+PAGE_FORMATS = env.list('PAGE_FORMATS', default=[])
+PAGE_FORMAT_MIN_PSNR = env.float('PAGE_FORMAT_MIN_PSNR', default=38.0)  # Minimum quality (dB) a candidate must reach
+PAGE_JPEG_QUALITY = env.int('PAGE_JPEG_QUALITY', default=85)
+PAGE_WEBP_QUALITY = env.int('PAGE_WEBP_QUALITY', default=80)
+PAGE_AVIF_QUALITY = env.int('PAGE_AVIF_QUALITY', default=60)
+# Deep-zoom tile pyramid per page (rendered separately at PAGE_TILES_DPI)
+PAGE_TILES_ENABLED = env.bool('PAGE_TILES_ENABLED', default=False)
+PAGE_TILES_DPI = env.int('PAGE_TILES_DPI', default=300)
+PAGE_TILE_SIZE = env.int('PAGE_TILE_SIZE', default=256)
+PAGE_TILE_OVERLAP = env.int('PAGE_TILE_OVERLAP', default=1)
+PAGE_TILE_FORMAT = env('PAGE_TILE_FORMAT', default='jpg')  # jpg, png or webp
+# Content-addressed page storage: identical page objects are stored once across all projects
+PAGE_STORAGE_DEDUP = env.bool('PAGE_STORAGE_DEDUP', default=False)
+PAGE_BLOB_GRACE_HOURS = env.int('PAGE_BLOB_GRACE_HOURS', default=24)
+# Reuse finished renders when the same PDF (same SHA-256) is processed again with the same settings
+RENDER_CACHE_ENABLED = env.bool('RENDER_CACHE_ENABLED', default=True)
+RENDER_CACHE_MAX_ENTRIES = env.int('RENDER_CACHE_MAX_ENTRIES', default=1000)  # Least recently used entries are evicted
+# Worker-local cache of source PDFs (see projects/source_cache.py), least recently used evicted above
+# PDF_SOURCE_CACHE_MB (0 = download for every task); misses on S3 are fetched in parallel ranges
+PDF_SOURCE_CACHE_DIR = env('PDF_SOURCE_CACHE_DIR', default='/tmp/flipread/source-pdfs')
+PDF_SOURCE_CACHE_MB = env.int('PDF_SOURCE_CACHE_MB', default=2048)
+PDF_SOURCE_FETCH_PART_MB = env.int('PDF_SOURCE_FETCH_PART_MB', default=8)
+PDF_SOURCE_FETCH_WORKERS = env.int('PDF_SOURCE_FETCH_WORKERS', default=4)
 
 # File Upload
-FILE_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
+# Larger uploads through the API (without direct uploads) are spooled to a temporary file instead of RAM
+FILE_UPLOAD_MAX_MEMORY_SIZE = env.int('FILE_UPLOAD_MAX_MEMORY_SIZE', default=10485760)  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 104857600  # 100MB
 
 # Logging Configuration
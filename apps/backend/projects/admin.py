@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Project, ProjectPage
+from .models import Project, ProjectPage, PageBlob, RenderCacheEntry, UploadSession
 
 
 class ProjectPageInline(admin.TabularInline):
@@ -39,3 +39,22 @@ class ProjectPageAdmin(admin.ModelAdmin):
     search_fields = ('project__title',)
 
 
+@admin.register(PageBlob)
+class PageBlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'refcount', 'last_used_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'size', 'refcount', 'created_at', 'last_used_at')
+
+
+@admin.register(RenderCacheEntry)
+class RenderCacheEntryAdmin(admin.ModelAdmin):
+    list_display = ('key', 'project', 'hits', 'created_at', 'last_used_at')
+    search_fields = ('key', 'project__title')
+    readonly_fields = ('key', 'project', 'pages', 'hits', 'created_at', 'last_used_at')
+
+
+@admin.register(UploadSession)
+class UploadSessionAdmin(admin.ModelAdmin):
+    list_display = ('filename', 'user', 'project', 'received', 'size', 'updated_at')
+    search_fields = ('filename', 'user__email')
+    readonly_fields = ('user', 'project', 'filename', 'size', 'received', 'created_at', 'updated_at')
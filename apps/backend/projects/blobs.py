@@ -0,0 +1,110 @@
+"""
+Content-addressed page image storage shared across projects (PAGE_STORAGE_DEDUP)
+
+Page objects are stored under a hash of their bytes, so identical pages
+(the same brochure in several projects, recurring back covers, blank
+pages) are uploaded once. PageBlob.refcount counts the ProjectPage
+references; unreferenced blobs are removed by collect_page_blobs_task.
+"""
+import hashlib
+import logging
+import os
+from collections import Counter
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+BLOB_PREFIX = 'blobs/pages/'
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def blob_name(sha256, extension):
+    """Storage name of a blob, e.g. blobs/pages/ab/ab12...ef.jpg"""
+    return f'{BLOB_PREFIX}{sha256[:2]}/{sha256}{extension}'
+
+
+def is_blob_name(name):
+    return name.startswith(BLOB_PREFIX)
+
+
+def store_blob(path, filename, content_type='image/jpeg'):
+    """
+    Store a local file content-addressed and return (name, uploaded_bytes).
+
+    If a blob with the same bytes exists already the upload is skipped
+    (uploaded_bytes is 0); touching last_used_at keeps the garbage
+    collector from removing it before the page referencing it is saved.
+    """
+    from .models import PageBlob
+    from .uploads import upload_file
+
+    _, extension = os.path.splitext(filename)
+    name = blob_name(file_sha256(path), extension.lower())
+    if PageBlob.objects.filter(name=name).update(last_used_at=timezone.now()):
+        return name, 0
+
+    name, size = upload_file(name, path, content_type=content_type)
+    PageBlob.objects.get_or_create(name=name, defaults={'size': size})
+    return name, size
+
+
+def update_blob_refs(old_names, new_names):
+    """
+    Adjust refcounts for page rows referencing `old_names` being replaced by rows referencing `new_names`.
+
+    Both are lists of storage names (as returned by ProjectPage.storage_names);
+    names outside the blob store are ignored.
+    """
+    from .models import PageBlob
+
+    changes = Counter(name for name in new_names if is_blob_name(name))
+    changes.subtract(name for name in old_names if is_blob_name(name))
+    by_change = {}
+    for name, change in changes.items():
+        if change:
+            by_change.setdefault(change, []).append(name)
+    # One UPDATE per distinct change instead of one per blob
+    for change, names in by_change.items():
+        PageBlob.objects.filter(name__in=names).update(refcount=F('refcount') + change)
+
+
+def collect_unused_blobs():
+    """
+    Delete blobs that no page references and that were not used within PAGE_BLOB_GRACE_HOURS.
+
+    The grace period covers pages that are still being processed: their
+    blobs are stored before the ProjectPage rows referencing them exist.
+    Returns the number of deleted blobs.
+    """
+    from .models import PageBlob, ProjectPage
+
+    cutoff = timezone.now() - timedelta(hours=settings.PAGE_BLOB_GRACE_HOURS)
+    candidates = PageBlob.objects.filter(refcount__lte=0, last_used_at__lt=cutoff).values_list('pk', flat=True)
+    storage = ProjectPage._meta.get_field('image_file').storage
+    deleted = 0
+    for pk in list(candidates):
+        with transaction.atomic():
+            blob = PageBlob.objects.select_for_update().filter(
+                pk=pk, refcount__lte=0, last_used_at__lt=cutoff
+            ).first()
+            if not blob:
+                continue
+            try:
+                storage.delete(blob.name)
+            except Exception as e:
+                logger.warning(f"Could not delete page blob {blob.name}: {e}")
+                continue
+            blob.delete()
+            deleted += 1
+    return deleted
@@ -0,0 +1,141 @@
+"""
+Cooperative cancellation of a project's background work (processing and publishing)
+
+request_cancel() sets a flag in the shared cache (when a project is deleted
+or its processing is cancelled). Tasks run inside watch(project_id): a
+thread polls the flag every POLL_SECONDS and, once it is set, kills the
+renderer processes of this worker and makes check() raise Cancelled, which
+the tasks call between pages. Prefork workers run one task per process at a
+time, so the processes and state here always belong to the running task.
+"""
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+POLL_SECONDS = 0.5
+FLAG_TIMEOUT = 3600  # Seconds; tasks starting later go by the project status (see tasks._is_current_run)
+
+_cancelled = threading.Event()
+_processes = set()
+_lock = threading.Lock()
+_watching = [0]
+
+
+class Cancelled(Exception):
+    """The project's processing was cancelled or the project deleted"""
+
+    def __init__(self, message="Processing was cancelled."):
+        super().__init__(message)
+
+
+def _key(project_id):
+    return f'project_cancel:{project_id}'
+
+
+def request_cancel(project_id):
+    """Ask running tasks of a project to stop"""
+    try:
+        cache.set(_key(project_id), True, timeout=FLAG_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Could not request cancellation of project {project_id}: {e}")
+
+
+def clear_cancel(project_id):
+    """Forget an earlier cancellation, the project is processed again"""
+    try:
+        cache.delete(_key(project_id))
+    except Exception as e:
+        logger.warning(f"Could not clear cancellation of project {project_id}: {e}")
+
+
+def cancel_requested(project_id):
+    try:
+        return bool(cache.get(_key(project_id)))
+    except Exception:
+        # Without the cache the work is finished rather than cancelled
+        return False
+
+
+def is_cancelled():
+    """Whether the task running in this worker process was cancelled"""
+    return _cancelled.is_set()
+
+
+def check():
+    """Raise Cancelled if the task running in this worker process was cancelled"""
+    if _cancelled.is_set():
+        raise Cancelled()
+
+
+def register_process(process):
+    """Track a renderer process so cancellation can kill it (see renderers.run_limited)"""
+    with _lock:
+        _processes.add(process)
+    if _cancelled.is_set():
+        _kill(process)
+
+
+def unregister_process(process):
+    with _lock:
+        _processes.discard(process)
+
+
+def _kill(process):
+    try:
+        process.kill()
+    except OSError:
+        pass  # Already exited
+
+
+def _cancel(stop=None):
+    with _lock:
+        # A poll that returns after its task ended must not cancel the next one
+        if stop is not None and stop.is_set():
+            return
+        _cancelled.set()
+        processes = list(_processes)
+    for process in processes:
+        _kill(process)
+
+
+@contextmanager
+def watch(project_id):
+    """Cancel the work inside the block when request_cancel(project_id) is called"""
+    stop = threading.Event()
+
+    def poll():
+        while not stop.wait(POLL_SECONDS):
+            if cancel_requested(project_id):
+                logger.info(f"Project {project_id}: cancellation requested, stopping")
+                _cancel(stop)
+                return
+
+    if cancel_requested(project_id):
+        _cancel()
+    thread = threading.Thread(target=poll, daemon=True)
+    thread.start()
+    _watching[0] += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            stop.set()
+        # Not waiting longer: a cache that does not answer must not hold up the task
+        thread.join(POLL_SECONDS)
+        _watching[0] -= 1
+        # Tasks run eagerly inside another task (tests, local setups) leave the outer state alone
+        if not _watching[0]:
+            _cancelled.clear()
+
+
+def cancellable(task):
+    """Run a task function whose first argument is the project id inside watch()"""
+    @functools.wraps(task)
+    def run(project_id, *args, **kwargs):
+        with watch(project_id):
+            return task(project_id, *args, **kwargs)
+    return run
@@ -0,0 +1,209 @@
+"""
+Direct PDF uploads: the browser sends the file to the bucket with presigned multipart URLs
+
+start_upload() opens an S3 multipart upload and signs one PUT URL per part,
+complete_upload() assembles the parts and checks the result with a HEAD
+request. The content itself is checked by the pre-flight scan in
+process_pdf_task, so the app servers never receive the PDF bytes.
+"""
+import logging
+import math
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+
+from .uploads import get_s3_client
+
+logger = logging.getLogger(__name__)
+
+S3_MIN_PART_BYTES = 5 * 1024 * 1024  # Every part except the last must be at least this large
+S3_MAX_PARTS = 10000
+
+
+class DirectUploadError(Exception):
+    """The upload cannot be started or completed; the message is shown to the customer"""
+
+
+def direct_uploads_enabled():
+    return bool(settings.USE_S3 and settings.DIRECT_UPLOADS)
+
+
+def max_upload_bytes():
+    return settings.PDF_MAX_UPLOAD_MB * 1024 * 1024
+
+
+def _bucket():
+    return settings.AWS_STORAGE_BUCKET_NAME.strip()
+
+
+def _part_size(size):
+    part_size = max(settings.DIRECT_UPLOAD_PART_MB * 1024 * 1024, S3_MIN_PART_BYTES)
+    return max(part_size, math.ceil(size / S3_MAX_PARTS))
+
+
+def clean_filename(filename):
+    """
+    The client's file name reduced to a plain base name that is safe in a storage key
+
+    Keys of direct uploads are set on pdf_file.name as they are, so FileField
+    never gets to clean the name. Raises DirectUploadError.
+    """
+    name = os.path.basename(filename.replace('\\', '/'))
+    try:
+        return get_valid_filename(name)
+    except SuspiciousFileOperation:
+        raise DirectUploadError("Invalid file name.")
+
+
+def validate_upload(filename, size):
+    """Check name and announced size before any URL is signed"""
+    if not filename.lower().endswith('.pdf'):
+        raise DirectUploadError("File must be a PDF.")
+    if size <= 0:
+        raise DirectUploadError("PDF file is empty.")
+    if size > max_upload_bytes():
+        raise DirectUploadError(f"PDF file too large. Maximum size is {settings.PDF_MAX_UPLOAD_MB}MB.")
+
+
+def start_upload(project, filename, size):
+    """
+    Open a multipart upload for a new PDF of `project` and return the upload instructions.
+
+    Returns {'part_size', 'parts': [{'part_number', 'url'}], 'expires_in'};
+    the client PUTs bytes [(n-1)*part_size, n*part_size) to the URL of part n
+    and keeps the ETag response header of each part for complete_upload().
+    A running upload of the project is aborted first.
+    """
+    from .models import project_upload_path
+
+    filename = clean_filename(filename)
+    validate_upload(filename, size)
+    if project.upload_id:
+        abort_upload(project)
+
+    client = get_s3_client()
+    key = project_upload_path(project, filename)
+    response = client.create_multipart_upload(
+        Bucket=_bucket(),
+        Key=key,
+        ContentType='application/pdf',
+        ACL='private',  # Same as MediaStorage.default_acl
+        **settings.AWS_S3_OBJECT_PARAMETERS
+    )
+    project.upload_key = key
+    project.upload_id = response['UploadId']
+    project.upload_started_at = timezone.now()
+    project.save(update_fields=['upload_key', 'upload_id', 'upload_started_at'])
+
+    part_size = _part_size(size)
+    expires_in = settings.DIRECT_UPLOAD_URL_EXPIRY
+    parts = [
+        {
+            'part_number': number,
+            'url': client.generate_presigned_url(
+                'upload_part',
+                Params={'Bucket': _bucket(), 'Key': key, 'UploadId': project.upload_id, 'PartNumber': number},
+                ExpiresIn=expires_in
+            ),
+        }
+        for number in range(1, math.ceil(size / part_size) + 1)
+    ]
+    logger.info(f"Project {project.id}: direct upload of {size} bytes in {len(parts)} parts started")
+    return {'part_size': part_size, 'parts': parts, 'expires_in': expires_in}
+
+
+def complete_upload(project, parts):
+    """
+    Assemble the uploaded parts and make the new object the project's PDF (saved).
+
+    `parts` is [{'part_number', 'etag'}] as reported by the client. The old
+    PDF (when replacing) is deleted; hash and pre-flight scan are left to
+    process_pdf_task, which runs them when pdf_sha256 and pdf_info are empty.
+    Raises DirectUploadError.
+    """
+    from botocore.exceptions import ClientError
+    from .models import Project
+
+    if not project.upload_id:
+        raise DirectUploadError("No upload in progress.")
+    try:
+        parts = sorted(
+            ({'PartNumber': int(part['part_number']), 'ETag': str(part['etag'])} for part in parts),
+            key=lambda part: part['PartNumber']
+        )
+    except (KeyError, TypeError, ValueError):
+        raise DirectUploadError("Invalid part list.")
+    if not parts:
+        raise DirectUploadError("Invalid part list.")
+
+    client = get_s3_client()
+    key = project.upload_key
+    try:
+        client.complete_multipart_upload(
+            Bucket=_bucket(), Key=key, UploadId=project.upload_id, MultipartUpload={'Parts': parts}
+        )
+        size = client.head_object(Bucket=_bucket(), Key=key)['ContentLength']
+    except ClientError as e:
+        logger.warning(f"Project {project.id}: completing direct upload failed: {e}")
+        raise DirectUploadError("Upload is incomplete, please upload the file again.")
+
+    if size > max_upload_bytes():
+        client.delete_object(Bucket=_bucket(), Key=key)
+        _clear(project)
+        raise DirectUploadError(f"PDF file too large. Maximum size is {settings.PDF_MAX_UPLOAD_MB}MB.")
+
+    old_pdf_name = project.pdf_file.name
+    project.pdf_file.name = key
+    project.pdf_sha256 = ''
+    project.pdf_info = None
+    project.render_cost = 0
+    project.status = Project.Status.UPLOADING
+    project.error_message = ''
+    project.upload_key = project.upload_id = ''
+    project.upload_started_at = None
+    project.save()
+    logger.info(f"Project {project.id}: direct upload of {size} bytes completed")
+
+    if old_pdf_name and old_pdf_name != key:
+        try:
+            project.pdf_file.storage.delete(old_pdf_name)
+        except Exception as e:
+            logger.warning(f"Could not delete replaced PDF {old_pdf_name}: {e}")
+
+
+def _clear(project):
+    project.upload_key = project.upload_id = ''
+    project.upload_started_at = None
+    project.save(update_fields=['upload_key', 'upload_id', 'upload_started_at'])
+
+
+def abort_upload(project):
+    """Abort the running upload of a project; the parts uploaded so far are deleted by S3"""
+    try:
+        get_s3_client().abort_multipart_upload(Bucket=_bucket(), Key=project.upload_key, UploadId=project.upload_id)
+    except Exception as e:
+        logger.warning(f"Could not abort direct upload of project {project.id}: {e}")
+    _clear(project)
+
+
+def expire_uploads():
+    """
+    Abort direct uploads that were not completed within twice the URL expiry.
+
+    Projects created for such an upload have no PDF and are deleted.
+    Returns the number of aborted uploads.
+    """
+    from .models import Project
+
+    cutoff = timezone.now() - timedelta(seconds=2 * settings.DIRECT_UPLOAD_URL_EXPIRY)
+    expired = Project.objects.exclude(upload_id='').filter(upload_started_at__lt=cutoff)
+    count = 0
+    for project in expired:
+        abort_upload(project)
+        if not project.pdf_file.name:
+            project.delete()
+        count += 1
+    return count
@@ -0,0 +1,133 @@
+"""
+Per-page content fingerprints of PDFs, used to reprocess only changed pages
+"""
+import hashlib
+import json
+import logging
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Page attributes that affect rendering (inherited ones are copied onto the page by pypdf)
+PAGE_KEYS = ('/MediaBox', '/CropBox', '/Rotate', '/UserUnit', '/Contents', '/Resources', '/Annots', '/Group')
+
+# Back references that would pull the whole page tree into every fingerprint
+SKIPPED_KEYS = {'/Parent', '/P'}
+
+
+def render_settings_signature():
+    """Settings that change the rendered output, so a config change re-renders every page"""
+    return json.dumps([
+        settings.PDF_RENDERER,
+        settings.PDF_RENDER_DPI,
+        settings.PDF_RENDER_TARGET_WIDTH,
+        settings.PDF_RENDER_TARGET_PIXELS,
+        settings.PDF_RENDER_MIN_DPI,
+        settings.PDF_RENDER_MAX_DPI,
+        sorted(settings.PAGE_RENDITIONS.items()),
+        settings.PAGE_RENDITION_QUALITY,
+        settings.PAGE_RENDITIONS_HIRES,
+        list(settings.PAGE_FORMATS),
+        settings.PAGE_FORMAT_MIN_PSNR,
+        settings.PAGE_JPEG_QUALITY,
+        settings.PAGE_WEBP_QUALITY,
+        settings.PAGE_AVIF_QUALITY,
+        settings.PAGE_TILES_ENABLED,
+        settings.PAGE_TILES_DPI,
+        settings.PAGE_TILE_SIZE,
+        settings.PAGE_TILE_OVERLAP,
+        settings.PAGE_TILE_FORMAT,
+    ])
+
+
+def _object_digest(obj, cache, in_progress):
+    """
+    Digest of a PDF object including everything it references.
+
+    Indirect objects are hashed once and cached by object number, so fonts
+    and images shared by many pages are only read once per document.
+    Object numbers themselves are not hashed; they change when a PDF is re-saved.
+    """
+    from pypdf.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+
+    if isinstance(obj, IndirectObject):
+        key = (obj.idnum, obj.generation)
+        if key in cache:
+            return cache[key]
+        if key in in_progress:
+            return b'cycle'
+        in_progress.add(key)
+        digest = _object_digest(obj.get_object(), cache, in_progress)
+        in_progress.discard(key)
+        cache[key] = digest
+        return digest
+
+    digest = hashlib.sha256()
+    if isinstance(obj, DictionaryObject):
+        digest.update(b'dict')
+        for key in sorted(obj.keys()):
+            if key in SKIPPED_KEYS:
+                continue
+            digest.update(key.encode('utf-8', 'replace'))
+            digest.update(_object_digest(obj.raw_get(key), cache, in_progress))
+        if isinstance(obj, StreamObject):
+            digest.update(b'stream')
+            digest.update(obj.get_data())
+    elif isinstance(obj, ArrayObject):
+        digest.update(b'array')
+        for item in obj:
+            digest.update(_object_digest(item, cache, in_progress))
+    else:
+        digest.update(type(obj).__name__.encode())
+        digest.update(repr(obj).encode('utf-8', 'replace'))
+    return digest.digest()
+
+
+def _page_role(number):
+    """The cover is never split, any other landscape page is (see rendering.plan_flipbook_pages)"""
+    return b'cover' if number == 1 else b'page'
+
+
+def page_fingerprints(pdf_path):
+    """
+    Fingerprint every page of a PDF as {pdf_page_number: sha256 hex digest}.
+
+    A fingerprint covers what decides how a page renders: its boxes and
+    rotation, content streams, the resources (fonts, images, forms) and
+    annotations they use, whether it is the cover, and the render settings.
+    Returns {} if the PDF cannot be parsed, which simply turns reuse off.
+    """
+    try:
+        from pypdf import PdfReader
+
+        reader = PdfReader(pdf_path)
+        signature = render_settings_signature().encode()
+        cache = {}
+        fingerprints = {}
+        for number, page in enumerate(reader.pages, start=1):
+            digest = hashlib.sha256(signature)
+            digest.update(_page_role(number))
+            for key in PAGE_KEYS:
+                if key in page:
+                    digest.update(key.encode())
+                    digest.update(_object_digest(page.raw_get(key), cache, set()))
+            fingerprints[number] = digest.hexdigest()
+        return fingerprints
+    except Exception as e:
+        logger.warning(f"Could not fingerprint pages of {pdf_path}, reprocessing all pages: {e}")
+        return {}
+
+
+def document_page_keys(pdf_sha256, page_count):
+    """
+    Stand-ins for page fingerprints that identify a page by the PDF's hash and its position.
+
+    Used for pages page_fingerprints cannot cover: they only match pages of
+    the same PDF rendered with the same settings (checkpoints of an
+    interrupted run, render cache copies), never pages of another PDF.
+    """
+    signature = render_settings_signature()
+    return {
+        number: hashlib.sha256(f'{pdf_sha256}:{number}:{signature}'.encode()).hexdigest()
+        for number in range(1, page_count + 1)
+    }
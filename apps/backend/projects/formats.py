@@ -0,0 +1,97 @@
+"""
+Page image encoding with automatic output format selection
+"""
+import math
+import os
+from django.conf import settings
+from PIL import Image, ImageChops, ImageStat
+
+# Supported output formats: PIL format name, file extension and encoder options
+FORMATS = {
+    'jpeg': {'pil': 'JPEG', 'ext': 'jpg', 'mime': 'image/jpeg'},
+    'webp': {'pil': 'WEBP', 'ext': 'webp', 'mime': 'image/webp'},
+    'avif': {'pil': 'AVIF', 'ext': 'avif', 'mime': 'image/avif'},
+    'png': {'pil': 'PNG', 'ext': 'png', 'mime': 'image/png'},
+}
+
+
+def format_filename(filename, format_name):
+    """Filename of a page image in another format, e.g. page-001.jpg -> page-001.webp"""
+    base, _ = os.path.splitext(filename)
+    return f"{base}.{FORMATS[format_name]['ext']}"
+
+
+def available_formats():
+    """Formats the installed Pillow can encode (AVIF needs the optional pillow-avif-plugin)"""
+    try:
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    return {name for name, fmt in FORMATS.items() if fmt['pil'] in Image.SAVE}
+
+
+def _encoder_options(format_name):
+    if format_name == 'jpeg':
+        return {'quality': settings.PAGE_JPEG_QUALITY, 'optimize': True}
+    if format_name == 'webp':
+        return {'quality': settings.PAGE_WEBP_QUALITY, 'method': 4}
+    if format_name == 'avif':
+        return {'quality': settings.PAGE_AVIF_QUALITY}
+    return {'optimize': True}
+
+
+def psnr(reference, candidate):
+    """Peak signal-to-noise ratio in dB between two RGB images (inf if identical)"""
+    diff = ImageChops.difference(reference, candidate)
+    mse = sum(rms ** 2 for rms in ImageStat.Stat(diff).rms) / len(diff.getbands())
+    if mse == 0:
+        return math.inf
+    return 20 * math.log10(255 / math.sqrt(mse))
+
+
+def encode_page(source_path, candidates=None):
+    """
+    Encode a losslessly rendered page as JPEG plus the configured candidate formats.
+
+    The JPEG is always written (it is the fallback every browser and the
+    standalone ZIP can show). Each candidate is compared against the
+    lossless source; the smallest encoding whose PSNR meets
+    PAGE_FORMAT_MIN_PSNR wins.
+
+    Returns (jpeg_path, best) where best is {'path', 'format', 'bytes', 'psnr'}
+    for the winning encoding, or None when the JPEG itself is the best choice.
+    Losing encodings are deleted.
+    """
+    candidates = settings.PAGE_FORMATS if candidates is None else candidates
+    base_path, _ = os.path.splitext(source_path)
+    supported = available_formats()
+
+    with Image.open(source_path) as img:
+        reference = img.convert('RGB')
+
+    encodings = []
+    for format_name in ['jpeg'] + [name for name in candidates if name != 'jpeg']:
+        if format_name not in supported:
+            continue
+        fmt = FORMATS[format_name]
+        path = f"{base_path}.{fmt['ext']}"
+        if path == source_path:
+            path = f"{base_path}-encoded.{fmt['ext']}"
+        reference.save(path, fmt['pil'], **_encoder_options(format_name))
+        with Image.open(path) as encoded:
+            quality = psnr(reference, encoded.convert('RGB'))
+        encodings.append({'path': path, 'format': format_name, 'bytes': os.path.getsize(path), 'psnr': quality})
+
+    jpeg = encodings[0]
+    acceptable = [
+        encoding for encoding in encodings
+        if encoding['psnr'] >= settings.PAGE_FORMAT_MIN_PSNR
+    ]
+    best = min(acceptable, key=lambda encoding: encoding['bytes']) if acceptable else jpeg
+
+    for encoding in encodings[1:]:
+        if encoding is not best and os.path.exists(encoding['path']):
+            os.unlink(encoding['path'])
+
+    return jpeg['path'], (None if best is jpeg else best)
@@ -0,0 +1,138 @@
+"""
+Compare the renderer backends on sample PDFs: pages/sec, peak RSS and output bytes
+"""
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from projects.renderers import RENDER_FORMATS, RENDERERS, RenderError, available_renderers
+from projects.rendering import get_pdf_page_count, get_render_format
+
+
+def _benchmark(renderer_name, documents, dpi, image_format, chunk_pages):
+    """
+    Render every document with one backend, in a fresh process so peak RSS is not shared with other backends.
+
+    Returns {'pages', 'errors', 'seconds', 'peak_rss', 'output_bytes'}.
+    """
+    renderer = RENDERERS[renderer_name]
+    result = {'pages': 0, 'errors': 0, 'seconds': 0.0, 'output_bytes': 0}
+    for pdf_path, page_count in documents:
+        output_dir = tempfile.mkdtemp(prefix='renderer-benchmark-')
+        try:
+            for first_page in range(1, page_count + 1, chunk_pages):
+                last_page = min(first_page + chunk_pages - 1, page_count)
+                started = time.monotonic()
+                try:
+                    renderer.render_range(
+                        pdf_path, os.path.join(output_dir, 'pdf-page'), first_page, last_page, dpi, image_format
+                    )
+                    result['pages'] += last_page - first_page + 1
+                except RenderError:
+                    result['errors'] += last_page - first_page + 1
+                result['seconds'] += time.monotonic() - started
+            result['output_bytes'] += sum(
+                os.path.getsize(os.path.join(output_dir, name)) for name in os.listdir(output_dir)
+            )
+        finally:
+            shutil.rmtree(output_dir, ignore_errors=True)
+
+    # ru_maxrss is in KB on Linux; subprocess backends are measured by their largest child process
+    who = resource.RUSAGE_SELF if renderer.in_process else resource.RUSAGE_CHILDREN
+    result['peak_rss'] = resource.getrusage(who).ru_maxrss * 1024
+    return result
+
+
+class Command(BaseCommand):
+    help = (
+        "Render sample PDFs with each installed renderer backend and report pages/sec, peak RSS "
+        "and output bytes, to choose PDF_RENDERER for this hardware. Peak RSS of pdfium includes "
+        "the Python process it runs in."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="PDF files or directories containing PDF files")
+        parser.add_argument(
+            '--renderer', action='append', choices=sorted(RENDERERS), dest='renderers',
+            help="Backend to benchmark (repeatable, default: all installed)"
+        )
+        parser.add_argument('--dpi', type=int, default=settings.PDF_RENDER_DPI)
+        parser.add_argument('--format', choices=sorted(RENDER_FORMATS), default=None, dest='image_format')
+        parser.add_argument(
+            '--chunk-pages', type=int, default=settings.PDF_RENDER_CHUNK_PAGES,
+            help="Pages per render call, like the render pipeline"
+        )
+
+    def _find_pdfs(self, paths):
+        pdfs = []
+        for path in paths:
+            if os.path.isdir(path):
+                for root, _, filenames in os.walk(path):
+                    pdfs.extend(
+                        os.path.join(root, filename) for filename in sorted(filenames)
+                        if filename.lower().endswith('.pdf')
+                    )
+            elif os.path.isfile(path):
+                pdfs.append(path)
+            else:
+                raise CommandError(f"{path} does not exist")
+        return pdfs
+
+    def handle(self, *args, **options):
+        if options['renderers']:
+            renderers = [RENDERERS[name] for name in options['renderers']]
+            missing = [renderer.name for renderer in renderers if not renderer.is_available()]
+            if missing:
+                raise CommandError(f"Not installed: {', '.join(missing)}")
+        else:
+            renderers = available_renderers()
+
+        documents = []
+        for pdf_path in self._find_pdfs(options['paths']):
+            try:
+                documents.append((pdf_path, get_pdf_page_count(pdf_path)))
+            except Exception as e:
+                self.stderr.write(f"Skipping {pdf_path}: {e}")
+        if not documents:
+            raise CommandError("No readable PDF files found")
+
+        image_format = options['image_format'] or get_render_format()
+        total_pages = sum(page_count for _, page_count in documents)
+        self.stdout.write(
+            f"{len(documents)} documents, {total_pages} pages at {options['dpi']} dpi as {image_format}, "
+            f"{max(options['chunk_pages'], 1)} pages per call\n"
+        )
+
+        results = {}
+        context = multiprocessing.get_context('fork')
+        for renderer in renderers:
+            self.stdout.write(f"Rendering with {renderer.name}...")
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                results[renderer.name] = executor.submit(
+                    _benchmark, renderer.name, documents, options['dpi'], image_format,
+                    max(options['chunk_pages'], 1)
+                ).result()
+
+        self.stdout.write('')
+        self.stdout.write(f"{'Renderer':<12} {'Pages':>7} {'Errors':>7} {'Pages/s':>9} {'Peak RSS MB':>12} {'Output MB':>10}")
+        for name, result in results.items():
+            pages_per_second = result['pages'] / result['seconds'] if result['seconds'] else 0
+            self.stdout.write(
+                f"{name:<12} {result['pages']:>7} {result['errors']:>7} {pages_per_second:>9.2f} "
+                f"{result['peak_rss'] / 1024 / 1024:>12.1f} {result['output_bytes'] / 1024 / 1024:>10.1f}"
+            )
+
+        complete = {name: result for name, result in results.items() if not result['errors'] and result['seconds']}
+        if complete:
+            fastest = max(complete, key=lambda name: complete[name]['pages'] / complete[name]['seconds'])
+            self.stdout.write(self.style.SUCCESS(
+                f"\nFastest without errors: {fastest} (PDF_RENDERER={fastest}, currently {settings.PDF_RENDERER})"
+            ))
+        else:
+            self.stdout.write(self.style.WARNING("\nNo backend rendered every page"))
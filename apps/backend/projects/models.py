@@ -4,10 +4,12 @@ Flipbook Project Models
 import os
 import secrets
 import tempfile
+import uuid
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
 from accounts.models import User
+from .tiles import iter_tile_paths
 
 
 def project_upload_path(instance, filename):
@@ -34,6 +36,7 @@ class Project(models.Model):
     class Status(models.TextChoices):
         UPLOADING = 'uploading', 'Uploading'
         PROCESSING = 'processing', 'Processing'
+        PARTIAL = 'partial', 'Partially ready'  # Still processing, the leading pages can be viewed
         READY = 'ready', 'Ready'
         ERROR = 'error', 'Error'
     
@@ -50,11 +53,33 @@ class Project(models.Model):
     # Status
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.UPLOADING)
     error_message = models.TextField(blank=True)
+    # SHA-256 of the uploaded PDF, key of the render cache (see render_cache.py)
+    pdf_sha256 = models.CharField(max_length=64, blank=True)
+    # Pre-flight scan (see preflight.py): page count, page sizes, encryption, estimated render cost
+    pdf_info = models.JSONField(null=True, blank=True)
+    render_cost = models.FloatField(default=0)  # Estimated megapixels to render
+    # Direct upload in progress (see direct_uploads.py): S3 key and multipart upload id of the new PDF
+    upload_key = models.CharField(max_length=500, blank=True)
+    upload_id = models.CharField(max_length=255, blank=True)
+    upload_started_at = models.DateTimeField(null=True, blank=True)
     
     # Processing
     total_pages = models.IntegerField(default=0)
     processing_started_at = models.DateTimeField(null=True, blank=True)
     processing_completed_at = models.DateTimeField(null=True, blank=True)
+    # Render scheduling (see scheduling.py): lane by estimated cost, queued until the user has a free slot
+    render_lane = models.CharField(max_length=20, blank=True)
+    render_queued_at = models.DateTimeField(null=True, blank=True)
+    render_dispatched_at = models.DateTimeField(null=True, blank=True)
+    # Processing runs started since the project was scheduled (retries after crashes, see recover_stuck_renders)
+    processing_attempts = models.IntegerField(default=0)
+    # Chunk tasks of a distributed render that have not started yet; waiting for a worker is not being stuck
+    render_chunks_waiting = models.IntegerField(default=0)
+    # Progress of the running processing, written throttled (see progress.py)
+    progress_stage = models.CharField(max_length=20, blank=True)
+    pages_rendered = models.IntegerField(default=0)
+    pages_uploaded = models.IntegerField(default=0)
+    progress_updated_at = models.DateTimeField(null=True, blank=True)
     
     # Download (one-time payment)
     download_enabled = models.BooleanField(default=False)
@@ -78,6 +103,7 @@ class Project(models.Model):
             models.Index(fields=['user', '-created_at']),
             models.Index(fields=['slug']),
             models.Index(fields=['published_slug']),
+            models.Index(fields=['render_dispatched_at', 'render_queued_at']),
         ]
     
     def __str__(self):
@@ -138,6 +164,12 @@ def project_page_upload_path(instance, filename):
     return f'customer-{instance.project.user.id}-projekt-{instance.project.id}/pages/{filename}'
 
 
+def rendition_filename(filename, rendition):
+    """Filename of a page rendition, e.g. page-001.jpg -> page-001-thumb.jpg"""
+    base, ext = os.path.splitext(filename)
+    return f'{base}-{rendition}{ext}'
+
+
 class ProjectPage(models.Model):
     """Individual page of a flipbook"""
     project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='pages')
@@ -145,6 +177,19 @@ class ProjectPage(models.Model):
     image_file = models.ImageField(upload_to=project_page_upload_path)
     width = models.IntegerField(default=0)
     height = models.IntegerField(default=0)
+    # Additional sizes of the page image: {name: {'name': storage name, 'width', 'height'}}
+    renditions = models.JSONField(default=dict, blank=True)
+    # Smaller encoding picked by format selection: {'name', 'format', 'bytes'} (image_file stays JPEG)
+    optimized_image = models.JSONField(null=True, blank=True)
+    # Deep-zoom tile pyramid: {'base', 'width', 'height', 'tile_size', 'overlap', 'format', 'levels'}
+    tiles = models.JSONField(null=True, blank=True)
+    # Content fingerprint of the PDF page this image was rendered from (see fingerprints.py),
+    # the part of a split landscape page, and the fingerprint last copied to the published flipbook
+    fingerprint = models.CharField(max_length=64, blank=True, db_index=True)
+    pdf_part = models.PositiveSmallIntegerField(default=0)
+    published_fingerprint = models.CharField(max_length=64, blank=True)
+    # Why the page is a blank placeholder (rendering failed or hit a limit), empty if rendered
+    render_error = models.CharField(max_length=255, blank=True)
     
     class Meta:
         db_table = 'project_pages'
@@ -153,4 +198,115 @@ class ProjectPage(models.Model):
     
     def __str__(self):
         return f"{self.project.title} - Page {self.page_number}"
+    
+    def as_piece(self):
+        """This page in the form _finish_project stores, so it can be kept across reprocessing"""
+        return {
+            'part': self.pdf_part,
+            'name': self.image_file.name,
+            'width': self.width,
+            'height': self.height,
+            'renditions': self.renditions,
+            'optimized': self.optimized_image,
+            'tiles': self.tiles,
+            'fingerprint': self.fingerprint,
+        }
+    
+    def storage_names(self):
+        """All media storage objects of this page (image, renditions, optimized encoding and tiles)"""
+        names = [self.image_file.name] if self.image_file else []
+        names.extend(rendition['name'] for rendition in self.renditions.values())
+        if self.optimized_image:
+            names.append(self.optimized_image['name'])
+        if self.tiles:
+            names.extend(iter_tile_paths(self.tiles))
+        return names
+
 
+class PageBlob(models.Model):
+    """Content-addressed page image object, shared by all pages with the same bytes (see blobs.py)"""
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField(default=0)
+    # Number of ProjectPage references (image, renditions, optimized encoding)
+    refcount = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        db_table = 'page_blobs'
+        indexes = [
+            models.Index(fields=['refcount', 'last_used_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount} refs)"
+
+
+class RenderCacheEntry(models.Model):
+    """Finished render result of a PDF, reused when the same PDF is processed again (see render_cache.py)"""
+    # Hash of the PDF and the render settings
+    key = models.CharField(max_length=64, db_index=True)
+    # Project whose page objects the entry points to; the entry goes away with them
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='render_cache_entries')
+    # Pages as stored by _finish_project (ProjectPage.as_piece)
+    pages = models.JSONField(default=list)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now, db_index=True)
+    
+    class Meta:
+        db_table = 'render_cache_entries'
+    
+    def __str__(self):
+        return f"{self.key[:12]} ({self.project_id}, {self.hits} hits)"
+
+
+class UploadSession(models.Model):
+    """Resumable chunked PDF upload, assembled on disk (see resumable_uploads.py)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='upload_sessions')
+    # Project whose PDF is replaced; a new project is created when empty
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, null=True, blank=True, related_name='upload_sessions')
+    title = models.CharField(max_length=255, blank=True)
+    description = models.TextField(blank=True)
+    filename = models.CharField(max_length=200)
+    size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)  # Bytes on disk, the offset of the next chunk
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        db_table = 'upload_sessions'
+    
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.size} bytes)"
+
+
+class PageCheckpoint(models.Model):
+    """
+    Page stored by a processing run that has not finished yet; a retried run
+    keeps it instead of rendering it again (see tasks._load_checkpoints)
+    """
+    project = models.ForeignKey(Project, on_delete=models.CASCADE, related_name='page_checkpoints')
+    fingerprint = models.CharField(max_length=64)
+    pdf_part = models.PositiveSmallIntegerField(default=0)
+    # The stored piece (ProjectPage.as_piece) and the number of parts of its PDF page
+    piece = models.JSONField(default=dict)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        db_table = 'page_checkpoints'
+        unique_together = ['project', 'fingerprint', 'pdf_part']
+    
+    def __str__(self):
+        return f"{self.project_id} - {self.fingerprint[:12]}/{self.pdf_part}"
+    
+    def as_page(self):
+        """Unsaved ProjectPage of the checkpointed piece, for its storage_names()"""
+        return ProjectPage(
+            project_id=self.project_id,
+            image_file=self.piece['name'],
+            renditions=self.piece.get('renditions') or {},
+            optimized_image=self.piece.get('optimized'),
+            tiles=self.piece.get('tiles')
+        )
@@ -0,0 +1,97 @@
+"""
+PDF pre-flight scan: cheap pdfinfo checks before any render time is spent
+"""
+import os
+import tempfile
+from django.conf import settings
+
+from .rendering import RenderError, get_page_sizes, plan_flipbook_pages, run_limited
+
+
+class PreflightError(Exception):
+    """The PDF cannot or should not be rendered; the message is shown to the customer"""
+
+
+def _pdfinfo(pdf_path):
+    try:
+        stdout = run_limited(['pdfinfo', pdf_path], settings.PDF_PREFLIGHT_TIMEOUT)
+    except RenderError as e:
+        if e.reason == 'timeout':
+            raise PreflightError("PDF could not be analysed in time.")
+        if 'password' in str(e).lower():
+            raise PreflightError("PDF is password protected.")
+        raise PreflightError("PDF file is damaged or not a PDF.")
+    return dict(
+        (key.strip(), value.strip())
+        for key, _, value in (line.partition(':') for line in stdout.splitlines())
+        if value
+    )
+
+
+def preflight_pdf(pdf_path):
+    """
+    Scan a PDF with pdfinfo and reject files that would fail or take unreasonably long to render.
+
+    Returns {'pdf_pages', 'flipbook_pages', 'encrypted', 'pdf_version',
+    'page_sizes', 'render_megapixels', 'file_bytes'}; page_sizes are
+    [width, height] in points per PDF page and render_megapixels is the
+    estimated render cost (pixels of all flipbook pages at their planned
+    resolution).
+    Raises PreflightError.
+    """
+    info = _pdfinfo(pdf_path)
+    try:
+        pdf_pages = int(info.get('Pages', ''))
+    except ValueError:
+        raise PreflightError("PDF file is damaged or not a PDF.")
+    if pdf_pages < 1:
+        raise PreflightError("PDF has no pages.")
+    if pdf_pages > settings.PDF_MAX_PAGES:
+        raise PreflightError(f"PDF has {pdf_pages} pages, at most {settings.PDF_MAX_PAGES} are supported.")
+
+    try:
+        page_sizes = get_page_sizes(pdf_path, 1, pdf_pages)
+    except Exception:
+        raise PreflightError("PDF file is damaged or not a PDF.")
+    for number, (width, height) in sorted(page_sizes.items()):
+        if width <= 0 or height <= 0:
+            raise PreflightError(f"Page {number} of the PDF has no size.")
+        if max(width, height) > settings.PDF_MAX_PAGE_SIZE_PTS:
+            raise PreflightError(f"Page {number} of the PDF is too large ({width:.0f} x {height:.0f} pt).")
+
+    pieces = plan_flipbook_pages(page_sizes)
+    megapixels = sum(piece['width'] * piece['height'] for piece in pieces) / 1000000
+    if megapixels > settings.PDF_MAX_RENDER_MEGAPIXELS:
+        raise PreflightError("PDF is too large to be converted (too many or too large pages).")
+
+    return {
+        'pdf_pages': pdf_pages,
+        'flipbook_pages': len(pieces),
+        'encrypted': info.get('Encrypted', 'no').startswith('yes'),
+        'pdf_version': info.get('PDF version', ''),
+        'page_sizes': [list(page_sizes[number]) for number in sorted(page_sizes)],
+        'render_megapixels': round(megapixels, 1),
+        'file_bytes': os.path.getsize(pdf_path),
+    }
+
+
+def preflight_upload(uploaded_file):
+    """Run preflight_pdf on an uploaded file (written to a temporary file if it is only in memory)"""
+    if hasattr(uploaded_file, 'temporary_file_path'):
+        return preflight_pdf(uploaded_file.temporary_file_path())
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            for chunk in uploaded_file.chunks():
+                f.write(chunk)
+        return preflight_pdf(path)
+    finally:
+        os.unlink(path)
+        uploaded_file.seek(0)
+
+
+def apply_preflight(project, result):
+    """Record a pre-flight result on the project (not saved)"""
+    project.pdf_info = result
+    project.render_cost = result['render_megapixels']
+    project.total_pages = result['flipbook_pages']
@@ -0,0 +1,76 @@
+"""
+Processing progress of a project (stage, pages rendered, pages uploaded)
+
+Counters are kept in memory and written to the project row at most every
+PDF_PROGRESS_UPDATE_PAGES pages or PDF_PROGRESS_UPDATE_SECONDS seconds.
+Writes add deltas with F() expressions, so the chunk tasks of a
+distributed render all count into the same row.
+"""
+import logging
+import threading
+import time
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Stages in processing order
+STAGE_QUEUED = 'queued'  # Waiting for a render slot (see scheduling.py)
+STAGE_DOWNLOADING = 'downloading'
+STAGE_ANALYSING = 'analysing'
+STAGE_RENDERING = 'rendering'  # Rendering and uploading overlap
+STAGE_SAVING = 'saving'
+STAGE_DONE = 'done'
+
+
+def set_stage(project_id, stage, reset=False):
+    """Record a new stage right away; `reset` zeroes the page counters (start of processing)"""
+    from .models import Project
+
+    fields = {'progress_stage': stage, 'progress_updated_at': timezone.now()}
+    if reset:
+        fields.update(pages_rendered=0, pages_uploaded=0)
+    Project.objects.filter(pk=project_id).update(**fields)
+
+
+class ProgressTracker:
+    """Thread-safe page counters of one project, flushed to the database throttled"""
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.lock = threading.Lock()
+        self.pending = {'pages_rendered': 0, 'pages_uploaded': 0}
+        self.last_flush = time.monotonic()
+
+    def rendered(self, count=1):
+        self._add('pages_rendered', count)
+
+    def uploaded(self, count=1):
+        self._add('pages_uploaded', count)
+
+    def _add(self, field, count):
+        with self.lock:
+            self.pending[field] += count
+            due = (
+                sum(self.pending.values()) >= settings.PDF_PROGRESS_UPDATE_PAGES or
+                time.monotonic() - self.last_flush >= settings.PDF_PROGRESS_UPDATE_SECONDS
+            )
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write the pending counts (also call once at the end)"""
+        from .models import Project
+
+        with self.lock:
+            changes = {field: F(field) + count for field, count in self.pending.items() if count}
+            self.pending = dict.fromkeys(self.pending, 0)
+            self.last_flush = time.monotonic()
+        if not changes:
+            return
+        try:
+            Project.objects.filter(pk=self.project_id).update(progress_updated_at=timezone.now(), **changes)
+        except Exception as e:
+            # Progress is informational, never fail processing because of it
+            logger.warning(f"Could not update progress of project {self.project_id}: {e}")
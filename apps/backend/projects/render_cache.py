@@ -0,0 +1,175 @@
+"""
+Cache of finished render results, keyed by the source PDF hash and the render settings
+
+When the exact same PDF is uploaded again (a new project from the same
+file, or re-uploading after deleting a project by mistake), its pages are
+linked or copied from the project that rendered it before instead of
+running pdftoppm again.
+"""
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from .blobs import is_blob_name
+from .fingerprints import render_settings_signature
+from .tiles import iter_tile_paths
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEYS = ('hits', 'misses')
+
+
+def upload_sha256(uploaded_file):
+    """SHA-256 of an uploaded file, read in chunks"""
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def render_cache_key(pdf_sha256):
+    return hashlib.sha256(f'{pdf_sha256}:{render_settings_signature()}'.encode()).hexdigest()
+
+
+def _count(name):
+    """Increment a hit/miss counter (shared by all processes through the Django cache)"""
+    key = f'render_cache:{name}'
+    try:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+    except Exception as e:
+        logger.warning(f"Could not update render cache counter {name}: {e}")
+
+
+def render_cache_stats():
+    """{'hits', 'misses', 'entries'} of the render cache"""
+    from .models import RenderCacheEntry
+
+    stats = {'entries': RenderCacheEntry.objects.count()}
+    for name in COUNTER_KEYS:
+        try:
+            stats[name] = cache.get(f'render_cache:{name}', 0)
+        except Exception:
+            stats[name] = None
+    return stats
+
+
+def _copy_page(project, page, copies):
+    """
+    Return a cached page with its storage objects moved into `project`.
+
+    The (source, target) pairs to copy are appended to `copies`.
+    """
+    from .models import ProjectPage, project_page_upload_path
+
+    def target(name):
+        # Content-addressed blobs are shared, only the reference count changes (in _finish_project)
+        if is_blob_name(name):
+            return name
+        new_name = project_page_upload_path(ProjectPage(project=project), name.split('/pages/', 1)[1])
+        copies.append((name, new_name))
+        return new_name
+
+    page = dict(page)
+    page['name'] = target(page['name'])
+    page['renditions'] = {
+        key: dict(rendition, name=target(rendition['name'])) for key, rendition in page['renditions'].items()
+    }
+    if page['optimized']:
+        page['optimized'] = dict(page['optimized'], name=target(page['optimized']['name']))
+    if page['tiles']:
+        new_base = project_page_upload_path(ProjectPage(project=project), page['tiles']['base'].split('/pages/', 1)[1])
+        copies.extend(zip(iter_tile_paths(page['tiles']), iter_tile_paths(page['tiles'], base=new_base)))
+        page['tiles'] = dict(page['tiles'], base=new_base)
+    return page
+
+
+def pages_from_render_cache(project):
+    """
+    Look up a finished render of the project's PDF and copy its pages into the project.
+
+    Returns the page list for _finish_project, or None on a cache miss (or
+    if copying failed, e.g. because the source objects are gone; the entry
+    is dropped then).
+    """
+    from .models import RenderCacheEntry
+    from .uploads import copy_file
+
+    if not settings.RENDER_CACHE_ENABLED or not project.pdf_sha256:
+        return None
+    entry = (
+        RenderCacheEntry.objects.filter(key=render_cache_key(project.pdf_sha256))
+        .exclude(project=project)
+        .order_by('-last_used_at')
+        .first()
+    )
+    if not entry:
+        _count('misses')
+        return None
+
+    copies = []
+    pages = [_copy_page(project, page, copies) for page in entry.pages]
+    try:
+        with ThreadPoolExecutor(max_workers=settings.PAGE_UPLOAD_WORKERS) as executor:
+            list(executor.map(lambda pair: copy_file(*pair), copies))
+    except Exception as e:
+        logger.warning(f"Render cache entry {entry.id} for project {project.id} is unusable, rendering again: {e}")
+        entry.delete()
+        _count('misses')
+        return None
+
+    RenderCacheEntry.objects.filter(pk=entry.pk).update(hits=F('hits') + 1, last_used_at=timezone.now())
+    _count('hits')
+    logger.info(
+        f"Project {project.id}: took {len(pages)} pages from the render cache "
+        f"(project {entry.project_id}, {len(copies)} objects copied)"
+    )
+    return pages
+
+
+def forget_render_result(project):
+    """
+    Drop the render cache entries of a project that is about to be processed again.
+
+    Its pages are replaced (and the old objects deleted) by the new run, or
+    left half replaced if that run fails, so they must not be handed out meanwhile.
+    """
+    from .models import RenderCacheEntry
+
+    RenderCacheEntry.objects.filter(project=project).delete()
+
+
+def store_render_result(project, page_rows):
+    """
+    Remember the finished pages of a project as the render result of its PDF.
+
+    Earlier entries of the project are replaced (their objects may have been
+    deleted), and the least recently used entries beyond
+    RENDER_CACHE_MAX_ENTRIES are evicted.
+    """
+    from .models import RenderCacheEntry
+
+    if not settings.RENDER_CACHE_ENABLED or not project.pdf_sha256:
+        return
+    RenderCacheEntry.objects.filter(project=project).delete()
+    if any(page.render_error for page in page_rows):
+        # Placeholders must not be handed out; rendering may succeed next time
+        return
+    RenderCacheEntry.objects.create(
+        project=project,
+        key=render_cache_key(project.pdf_sha256),
+        pages=[page.as_piece() for page in page_rows]
+    )
+    evicted = RenderCacheEntry.objects.filter(
+        pk__in=RenderCacheEntry.objects.order_by('-last_used_at').values_list('pk', flat=True)[
+            settings.RENDER_CACHE_MAX_ENTRIES:
+        ]
+    )
+    if evicted.exists():
+        # Entries only reference the objects of their project, evicting them deletes no files
+        evicted.delete()
@@ -0,0 +1,222 @@
+"""
+Renderer backends that rasterize PDF pages (selected with PDF_RENDERER)
+
+Every backend writes the same files: a page range as
+<output_prefix>-<page>.<ext> (pdftoppm naming, see collect_rendered_pages)
+and a crop as <output_prefix>.<ext>, so the rest of the pipeline does not
+care which engine produced them. Use the benchmark_renderers management
+command to compare the installed backends on your own documents.
+"""
+import resource
+import shutil
+import subprocess
+import threading
+from django.conf import settings
+
+from .cancellation import check, register_process, unregister_process
+
+# Command line flag and file extension per image format
+RENDER_FORMATS = {
+    'jpeg': ('-jpeg', 'jpg'),
+    'png': ('-png', 'png'),
+}
+
+
+class RenderError(Exception):
+    """A renderer process failed, ran out of time or exceeded its memory limit"""
+
+    def __init__(self, message, reason='failed'):
+        super().__init__(message)
+        self.reason = reason  # 'failed', 'timeout' or 'memory'
+
+
+def run_limited(args, timeout, subject=''):
+    """
+    Run a poppler command with a wall-clock timeout and an address space limit.
+
+    The limit (PDF_RENDER_MEMORY_LIMIT_MB) is set on the child right after it
+    starts with prlimit; unlike preexec_fn that is safe from the render
+    threads. Returns stdout, raises RenderError naming `subject` (e.g. "page 37"),
+    or cancellation.Cancelled if the process was killed by a cancellation.
+    """
+    command = args[0]
+    subject = f' on {subject}' if subject else ''
+    memory_limit = settings.PDF_RENDER_MEMORY_LIMIT_MB * 1024 * 1024
+    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    register_process(process)
+    try:
+        if memory_limit:
+            try:
+                resource.prlimit(process.pid, resource.RLIMIT_AS, (memory_limit, memory_limit))
+            except (OSError, ValueError):
+                pass  # Already exited
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise RenderError(f"{command} timed out after {timeout:.0f}s{subject}", reason='timeout')
+    finally:
+        unregister_process(process)
+
+    # Killed because the project's processing was cancelled (see cancellation.py)
+    check()
+    if process.returncode != 0:
+        out_of_memory = 'memory' in stderr.lower() or 'bad_alloc' in stderr
+        if memory_limit and (out_of_memory or process.returncode < 0):
+            raise RenderError(
+                f"{command} exceeded the memory limit of {settings.PDF_RENDER_MEMORY_LIMIT_MB} MB{subject}",
+                reason='memory'
+            )
+        raise RenderError(f"{command} failed{subject}: {stderr.strip()[:200]}")
+    return stdout
+
+
+def _page_subject(first_page, last_page):
+    return f'page {first_page}' if first_page == last_page else f'pages {first_page}-{last_page}'
+
+
+class Renderer:
+    """Interface of a renderer backend"""
+    name = ''
+    in_process = False  # Renders inside the worker process (no timeout or memory limit applies)
+
+    def is_available(self):
+        raise NotImplementedError
+
+    def render_range(self, pdf_path, output_prefix, first_page, last_page, dpi, image_format='jpeg'):
+        """Rasterize pages first_page..last_page into <output_prefix>-<page>.<ext>"""
+        raise NotImplementedError
+
+    def render_crop(self, pdf_path, output_prefix, pdf_page_number, crop, dpi, image_format='jpeg'):
+        """Rasterize the pixel rectangle crop=(x, y, width, height) of one page and return the image path"""
+        raise NotImplementedError
+
+
+class PopplerRenderer(Renderer):
+    """pdftoppm (Splash) or pdftocairo (Cairo); both take the same options and name their output the same way"""
+
+    def __init__(self, command):
+        self.name = command
+        self.command = command
+
+    def is_available(self):
+        return shutil.which(self.command) is not None
+
+    def render_range(self, pdf_path, output_prefix, first_page, last_page, dpi, image_format='jpeg'):
+        run_limited(
+            [
+                self.command, RENDER_FORMATS[image_format][0], '-r', str(dpi),
+                '-f', str(first_page), '-l', str(last_page),
+                pdf_path, output_prefix
+            ],
+            settings.PDF_RENDER_TIMEOUT * (last_page - first_page + 1),
+            subject=_page_subject(first_page, last_page)
+        )
+
+    def render_crop(self, pdf_path, output_prefix, pdf_page_number, crop, dpi, image_format='jpeg'):
+        flag, extension = RENDER_FORMATS[image_format]
+        x, y, width, height = crop
+        run_limited(
+            [
+                self.command, flag, '-r', str(dpi), '-singlefile',
+                '-f', str(pdf_page_number), '-l', str(pdf_page_number),
+                '-x', str(x), '-y', str(y), '-W', str(width), '-H', str(height),
+                pdf_path, output_prefix
+            ],
+            settings.PDF_RENDER_TIMEOUT,
+            subject=f'page {pdf_page_number}'
+        )
+        return f'{output_prefix}.{extension}'
+
+
+class PdfiumRenderer(Renderer):
+    """
+    In-process rendering with PDFium (optional pypdfium2 package).
+
+    Saves the process start and file parsing per chunk, but PDFium is not
+    thread-safe, so the render threads of one worker take turns, and
+    PDF_RENDER_TIMEOUT / PDF_RENDER_MEMORY_LIMIT_MB do not apply.
+    """
+    name = 'pdfium'
+    in_process = True
+    _lock = threading.Lock()
+
+    def is_available(self):
+        try:
+            import pypdfium2  # noqa: F401
+        except ImportError:
+            return False
+        return True
+
+    def _save(self, image, path, image_format):
+        if image_format == 'png':
+            image.save(path, 'PNG')
+        else:
+            image.save(path, 'JPEG', quality=settings.PAGE_JPEG_QUALITY)
+
+    def _render(self, pdf_path, pages, dpi, crop=None):
+        """Yield (page_number, PIL image) for each page, cropped to the pixel rectangle `crop`"""
+        import pypdfium2
+
+        scale = dpi / 72
+        with self._lock:
+            try:
+                document = pypdfium2.PdfDocument(pdf_path)
+            except pypdfium2.PdfiumError as e:
+                raise RenderError(f"pdfium could not open the PDF: {e}")
+            try:
+                for number in pages:
+                    page = document[number - 1]
+                    try:
+                        if crop:
+                            x, y, width, height = crop
+                            page_width, page_height = page.get_size()
+                            # Points to cut off each border: left, bottom, right, top
+                            cut = (
+                                x / scale, page_height - (y + height) / scale,
+                                page_width - (x + width) / scale, y / scale
+                            )
+                            image = page.render(scale=scale, crop=cut).to_pil()
+                            if image.size != (width, height):
+                                # Rounding of the cut borders, match the planned size exactly
+                                image = image.resize((width, height))
+                        else:
+                            image = page.render(scale=scale).to_pil()
+                    except pypdfium2.PdfiumError as e:
+                        raise RenderError(f"pdfium failed on page {number}: {e}")
+                    finally:
+                        page.close()
+                    yield number, image.convert('RGB')
+            finally:
+                document.close()
+
+    def render_range(self, pdf_path, output_prefix, first_page, last_page, dpi, image_format='jpeg'):
+        extension = RENDER_FORMATS[image_format][1]
+        for number, image in self._render(pdf_path, range(first_page, last_page + 1), dpi):
+            self._save(image, f'{output_prefix}-{number}.{extension}', image_format)
+
+    def render_crop(self, pdf_path, output_prefix, pdf_page_number, crop, dpi, image_format='jpeg'):
+        path = f'{output_prefix}.{RENDER_FORMATS[image_format][1]}'
+        for _, image in self._render(pdf_path, [pdf_page_number], dpi, crop=crop):
+            self._save(image, path, image_format)
+        return path
+
+
+RENDERERS = {
+    renderer.name: renderer
+    for renderer in (PopplerRenderer('pdftoppm'), PopplerRenderer('pdftocairo'), PdfiumRenderer())
+}
+
+
+def get_renderer(name=None):
+    """The renderer named `name` or PDF_RENDERER"""
+    name = name or settings.PDF_RENDERER
+    try:
+        return RENDERERS[name]
+    except KeyError:
+        raise ValueError(f"Unknown PDF_RENDERER {name!r}, choose one of {', '.join(RENDERERS)}")
+
+
+def available_renderers():
+    return [renderer for renderer in RENDERERS.values() if renderer.is_available()]
@@ -0,0 +1,402 @@
+"""
+PDF rasterization helpers: page planning, render jobs and the pipeline around the renderer backends
+"""
+import logging
+import math
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from PIL import Image
+
+from .cancellation import check
+from .renderers import RENDER_FORMATS, RenderError, get_renderer, run_limited
+
+logger = logging.getLogger(__name__)
+
+
+def get_pdf_page_count(pdf_path):
+    """Read the page count of a PDF with pdfinfo"""
+    stdout = run_limited(['pdfinfo', pdf_path], settings.PDF_PREFLIGHT_TIMEOUT)
+
+    match = re.search(r'^Pages:\s+(\d+)', stdout, re.MULTILINE)
+    if not match:
+        raise Exception("pdfinfo did not report a page count")
+    return int(match.group(1))
+
+
+def get_render_workers():
+    """Number of renderer processes to run in parallel (0 = all cores)"""
+    workers = settings.PDF_RENDER_WORKERS
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def split_page_ranges(first_page, last_page, workers, max_chunk_pages):
+    """
+    Split first_page..last_page into consecutive (first, last) ranges.
+
+    Ranges are small enough that every worker gets at least one of them,
+    but never larger than max_chunk_pages so slow pages balance out.
+    """
+    page_count = last_page - first_page + 1
+    if page_count <= 0:
+        return []
+    chunk_pages = -(-page_count // max(workers, 1))  # ceil division
+    chunk_pages = max(1, min(chunk_pages, max_chunk_pages))
+    return [
+        (first, min(first + chunk_pages - 1, last_page))
+        for first in range(first_page, last_page + 1, chunk_pages)
+    ]
+
+
+def get_page_sizes(pdf_path, first_page, last_page):
+    """
+    Read page sizes in points with pdfinfo, as {pdf_page_number: (width, height)}.
+
+    Uses the MediaBox (what pdftoppm renders by default) and applies the page
+    rotation, so the sizes match the orientation of the rendered image.
+    """
+    stdout = run_limited(
+        ['pdfinfo', '-box', '-f', str(first_page), '-l', str(last_page), pdf_path],
+        settings.PDF_PREFLIGHT_TIMEOUT
+    )
+
+    rotations = {
+        int(page): int(rotation)
+        for page, rotation in re.findall(r'^Page\s+(\d+)\s+rot:\s+(-?\d+)', stdout, re.MULTILINE)
+    }
+    sizes = {}
+    box_pattern = r'^Page\s+(\d+)\s+MediaBox:\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)\s+([-\d.]+)'
+    for page, x1, y1, x2, y2 in re.findall(box_pattern, stdout, re.MULTILINE):
+        page = int(page)
+        width, height = abs(float(x2) - float(x1)), abs(float(y2) - float(y1))
+        if rotations.get(page, 0) % 180 == 90:
+            width, height = height, width
+        sizes[page] = (width, height)
+
+    if len(sizes) != last_page - first_page + 1:
+        raise Exception(f"pdfinfo did not report sizes for pages {first_page}-{last_page}")
+    return sizes
+
+
+def page_pixel_size(width_pts, height_pts, dpi):
+    """Pixel size pdftoppm produces for a page of the given size (it rounds up)"""
+    return math.ceil(width_pts * dpi / 72), math.ceil(height_pts * dpi / 72)
+
+
+def page_render_dpi(width_pts, height_pts, parts=1):
+    """
+    Resolution for one page, so that each of its flipbook pages fits the pixel budget.
+
+    PDF_RENDER_TARGET_WIDTH (pixels per flipbook page) and
+    PDF_RENDER_TARGET_PIXELS (pixel area per flipbook page) each give a
+    resolution; the lower one is used, clamped to PDF_RENDER_MIN_DPI and
+    PDF_RENDER_MAX_DPI. Without a budget every page uses PDF_RENDER_DPI.
+    A split spread has two flipbook pages of half the page width each.
+    """
+    piece_width_pts = width_pts / parts
+    candidates = []
+    if settings.PDF_RENDER_TARGET_WIDTH and piece_width_pts > 0:
+        candidates.append(settings.PDF_RENDER_TARGET_WIDTH * 72 / piece_width_pts)
+    if settings.PDF_RENDER_TARGET_PIXELS and piece_width_pts > 0 and height_pts > 0:
+        candidates.append(math.sqrt(settings.PDF_RENDER_TARGET_PIXELS / (piece_width_pts * height_pts)) * 72)
+    if not candidates:
+        return settings.PDF_RENDER_DPI
+    dpi = min(max(min(candidates), settings.PDF_RENDER_MIN_DPI), settings.PDF_RENDER_MAX_DPI)
+    return round(dpi, 2)
+
+
+def plan_flipbook_pages(page_sizes, dpi=None):
+    """
+    Decide how the PDF pages map to flipbook pages before anything is rendered.
+
+    Strategy:
+    1. First page (cover) is always treated as one page, even if landscape
+    2. Pages 2+ that are landscape (width is 20% larger than height) are split
+       into 2 pages (left and right half), each rendered directly as a crop
+
+    Every page is rendered at `dpi`, or if it is None at its own resolution
+    from page_render_dpi, so oversized pages are rendered to fit the pixel
+    budget instead of huge.
+
+    Returns pieces [{'pdf_page', 'part', 'parts', 'width', 'height', 'crop', 'page_size', 'dpi'}, ...]
+    in reading order; `crop` is (x, y, width, height) in pixels or None and
+    `page_size` the page size in points.
+    """
+    pieces = []
+    for pdf_page_number in sorted(page_sizes):
+        page_size = page_sizes[pdf_page_number]
+        width_pts, height_pts = page_size
+        is_cover = (pdf_page_number == 1)
+        # Aspect ratio does not depend on the resolution
+        is_landscape = height_pts > 0 and width_pts / height_pts > 1.2
+        split = is_landscape and not is_cover
+
+        page_dpi = dpi or page_render_dpi(width_pts, height_pts, parts=2 if split else 1)
+        width, height = page_pixel_size(*page_size, page_dpi)
+
+        if not split:
+            pieces.append({
+                'pdf_page': pdf_page_number, 'part': 0, 'parts': 1,
+                'width': width, 'height': height, 'crop': None, 'page_size': page_size, 'dpi': page_dpi
+            })
+            continue
+
+        left_width = width // 2
+        pieces.append({
+            'pdf_page': pdf_page_number, 'part': 0, 'parts': 2,
+            'width': left_width, 'height': height, 'crop': (0, 0, left_width, height),
+            'page_size': page_size, 'dpi': page_dpi
+        })
+        pieces.append({
+            'pdf_page': pdf_page_number, 'part': 1, 'parts': 2,
+            'width': width - left_width, 'height': height, 'crop': (left_width, 0, width - left_width, height),
+            'page_size': page_size, 'dpi': page_dpi
+        })
+    return pieces
+
+
+def get_render_format():
+    """Render losslessly when the page format selection needs a clean source to encode from"""
+    return 'png' if settings.PAGE_FORMATS else 'jpeg'
+
+
+def render_page_range(pdf_path, output_prefix, first_page, last_page, dpi, image_format='jpeg'):
+    """Rasterize one page range with the PDF_RENDERER backend, PDF_RENDER_TIMEOUT per page"""
+    get_renderer().render_range(pdf_path, output_prefix, first_page, last_page, dpi, image_format)
+
+
+def render_page_crop(pdf_path, output_prefix, pdf_page_number, crop, dpi, image_format='jpeg'):
+    """Rasterize a rectangle (x, y, width, height) of one page, written to output_prefix.jpg/.png"""
+    return get_renderer().render_crop(pdf_path, output_prefix, pdf_page_number, crop, dpi, image_format)
+
+
+def render_piece(pdf_path, output_prefix, piece, dpi, image_format='jpeg'):
+    """
+    Render a single planned piece (whole page or spread half) at another resolution.
+
+    The crop of a spread half is recomputed for the new resolution the same
+    way plan_flipbook_pages does it. Returns (path, width, height).
+    """
+    width, height = page_pixel_size(*piece['page_size'], dpi)
+    if piece['parts'] == 2:
+        left_width = width // 2
+        crop = (0, 0, left_width, height) if piece['part'] == 0 else (left_width, 0, width - left_width, height)
+    else:
+        crop = (0, 0, width, height)
+    return render_page_crop(pdf_path, output_prefix, piece['pdf_page'], crop, dpi, image_format), crop[2], crop[3]
+
+
+def render_renditions(pdf_path, piece, renditions):
+    """
+    Create the configured renditions of a rendered piece next to its image.
+
+    `renditions` maps a name to a target width in pixels. Renditions smaller
+    than the rendered image are downscaled from it. Larger ones (e.g. for
+    hi-DPI screens) are rendered again at the matching resolution with
+    PAGE_RENDITIONS_HIRES, and left out otherwise (as are those of the
+    image's own width): clients use the page image instead.
+
+    Returns {name: {'path', 'width', 'height'}}.
+    """
+    base_path, _ = os.path.splitext(piece['path'])
+    results = {}
+    with Image.open(piece['path']) as img:
+        img.load()
+        for name, target_width in renditions.items():
+            output_prefix = f'{base_path}-{name}'
+            if target_width < piece['width']:
+                target_height = max(1, round(piece['height'] * target_width / piece['width']))
+                img.resize((target_width, target_height), Image.LANCZOS).save(
+                    f'{output_prefix}.jpg', 'JPEG', quality=settings.PAGE_RENDITION_QUALITY
+                )
+                results[name] = {'path': f'{output_prefix}.jpg', 'width': target_width, 'height': target_height}
+            elif target_width > piece['width'] and settings.PAGE_RENDITIONS_HIRES:
+                rendition_dpi = piece['dpi'] * target_width / piece['width']
+                path, width, height = render_piece(pdf_path, output_prefix, piece, rendition_dpi)
+                results[name] = {'path': path, 'width': width, 'height': height}
+    return results
+
+
+def collect_rendered_pages(output_dir, prefix='pdf-page', first_page=1, last_page=None, extension='jpg'):
+    """
+    Find pdftoppm output images and return them as [(pdf_page_number, path), ...]
+
+    pdftoppm names files like pdf-page-001.jpg; the page number is parsed
+    instead of relying on the zero padding, so ranges rendered separately
+    always merge back in document order.
+    """
+    pattern = re.compile(rf'^{re.escape(prefix)}-(\d+)\.{extension}$')
+    pages = []
+    for filename in os.listdir(output_dir):
+        match = pattern.match(filename)
+        if match:
+            page_number = int(match.group(1))
+            if page_number >= first_page and (last_page is None or page_number <= last_page):
+                pages.append((page_number, os.path.join(output_dir, filename)))
+    return sorted(pages)
+
+
+def _build_render_jobs(pieces, chunk_pages, lead_pages=0):
+    """
+    Group pieces into pdftoppm invocations.
+
+    Runs of consecutive whole pages with the same resolution share one
+    -f/-l range (at most chunk_pages long); every cropped half is a job of
+    its own, and so is each of the first `lead_pages` pieces, so the cover
+    does not wait for the rest of its range.
+    """
+    jobs = []
+    for index, piece in enumerate(pieces):
+        if piece['crop'] or index < lead_pages:
+            jobs.append({'crop': piece['crop'], 'pieces': [piece]})
+            continue
+        last_job = jobs[-1] if jobs else None
+        if (
+            last_job and not last_job['crop'] and index > lead_pages and
+            len(last_job['pieces']) < chunk_pages and
+            last_job['pieces'][-1]['pdf_page'] == piece['pdf_page'] - 1 and
+            last_job['pieces'][-1]['dpi'] == piece['dpi']
+        ):
+            last_job['pieces'].append(piece)
+        else:
+            jobs.append({'crop': None, 'pieces': [piece]})
+    return jobs
+
+
+def render_placeholder(output_prefix, piece, image_format='jpeg'):
+    """Blank image of a piece's planned size, stands in for a page that could not be rendered"""
+    extension = RENDER_FORMATS[image_format][1]
+    path = f'{output_prefix}.{extension}'
+    Image.new('RGB', (piece['width'], piece['height']), 'white').save(
+        path, 'PNG' if image_format == 'png' else 'JPEG'
+    )
+    return path
+
+
+def _run_render_job(pdf_path, output_dir, job, image_format):
+    """
+    Render one job and return (path, render_error) for each of its pieces.
+
+    With PDF_RENDER_PAGE_FALLBACK a failing range is retried page by page,
+    and a page that still fails is replaced by a blank placeholder and
+    reported through render_error instead of failing the whole document.
+    """
+    # Between jobs for in-process renderers, which cannot be killed
+    check()
+    try:
+        return [(path, '') for path in _render_job(pdf_path, output_dir, job, image_format)]
+    except RenderError as e:
+        if not settings.PDF_RENDER_PAGE_FALLBACK:
+            raise
+        if len(job['pieces']) > 1:
+            logger.warning(f"Rendering failed ({e}), retrying page by page")
+            return [
+                result
+                for piece in job['pieces']
+                for result in _run_render_job(pdf_path, output_dir, {'crop': None, 'pieces': [piece]}, image_format)
+            ]
+        piece = job['pieces'][0]
+        logger.warning(f"Page {piece['pdf_page']} replaced by a placeholder: {e}")
+        output_prefix = os.path.join(output_dir, f"pdf-page-{piece['pdf_page']:04d}-{piece['part'] + 1}-placeholder")
+        return [(render_placeholder(output_prefix, piece, image_format), str(e))]
+
+
+def _render_job(pdf_path, output_dir, job, image_format):
+    """Render one job and return the image path for each of its pieces"""
+    dpi = job['pieces'][0]['dpi']
+    if job['crop']:
+        piece = job['pieces'][0]
+        output_prefix = os.path.join(output_dir, f"pdf-page-{piece['pdf_page']:04d}-{piece['part'] + 1}")
+        return [render_page_crop(pdf_path, output_prefix, piece['pdf_page'], job['crop'], dpi, image_format)]
+
+    first_page = job['pieces'][0]['pdf_page']
+    last_page = job['pieces'][-1]['pdf_page']
+    render_page_range(pdf_path, os.path.join(output_dir, 'pdf-page'), first_page, last_page, dpi, image_format)
+    paths = dict(collect_rendered_pages(
+        output_dir, first_page=first_page, last_page=last_page, extension=RENDER_FORMATS[image_format][1]
+    ))
+    if len(paths) != len(job['pieces']):
+        raise Exception(f"{get_renderer().name} did not produce all pages {first_page}-{last_page}")
+    return [paths[piece['pdf_page']] for piece in job['pieces']]
+
+
+def iter_rendered_pieces(pdf_path, output_dir, dpi=None, workers=None, first_page=1, last_page=None,
+                         max_chunk_pages=None, image_format=None, pdf_pages=None, lead_pages=0):
+    """
+    Rasterize a PDF (or a page range of it) into flipbook pages and yield them as soon as they are ready.
+
+    Page sizes are read up front, so landscape spreads are rendered as two
+    cropped halves straight away (no decode/crop/re-encode afterwards), and
+    each page gets its own resolution unless `dpi` is given (see
+    plan_flipbook_pages).
+    Render jobs run concurrently, at most `workers` pdftoppm processes at a
+    time. Threads only wait on the child processes, so this also works
+    inside daemonic Celery pool workers (which cannot start a
+    multiprocessing pool of their own).
+
+    Jobs are consumed in document order and only a bounded number of them
+    is rendered ahead of the consumer, so a slow consumer (e.g. uploads)
+    throttles rendering instead of filling the disk.
+
+    Pages are written as JPEG, or as lossless PNG when page format selection
+    is enabled (see get_render_format). If `pdf_pages` is given, only those
+    PDF page numbers of the range are rendered. The first `lead_pages`
+    pieces are rendered one per job (see _build_render_jobs).
+
+    Yields piece dicts (see plan_flipbook_pages) with an added 'path', in
+    reading order; pieces replaced by a placeholder also have 'render_error'.
+    """
+    workers = workers or get_render_workers()
+    image_format = image_format or get_render_format()
+    if last_page is None:
+        last_page = get_pdf_page_count(pdf_path)
+
+    pieces = plan_flipbook_pages(get_page_sizes(pdf_path, first_page, last_page), dpi)
+    if pdf_pages is not None:
+        pdf_pages = set(pdf_pages)
+        pieces = [piece for piece in pieces if piece['pdf_page'] in pdf_pages]
+    whole_pages = sum(1 for piece in pieces if not piece['crop'])
+    chunk_pages = -(-whole_pages // workers) if whole_pages else 1  # ceil division
+    chunk_pages = max(1, min(chunk_pages, max_chunk_pages or settings.PDF_RENDER_CHUNK_PAGES))
+
+    jobs = iter(_build_render_jobs(pieces, chunk_pages, lead_pages))
+    executor = ThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+
+    def submit_next():
+        job = next(jobs, None)
+        if job:
+            pending.append((job, executor.submit(_run_render_job, pdf_path, output_dir, job, image_format)))
+
+    try:
+        # Keep every worker busy plus one job of lookahead each
+        for _ in range(workers * 2):
+            submit_next()
+
+        while pending:
+            job, future = pending.popleft()
+            results = future.result()
+            submit_next()
+            for piece, (path, render_error) in zip(job['pieces'], results):
+                if render_error:
+                    yield dict(piece, path=path, render_error=render_error)
+                else:
+                    yield dict(piece, path=path)
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def rasterize_pdf(pdf_path, output_dir, dpi=None, workers=None, first_page=1, last_page=None, pdf_pages=None):
+    """
+    Rasterize a PDF (or a page range of it) completely before returning.
+
+    Returns the rendered pieces (see iter_rendered_pieces) in reading order.
+    """
+    return list(iter_rendered_pieces(
+        pdf_path, output_dir, dpi=dpi, workers=workers, first_page=first_page, last_page=last_page,
+        pdf_pages=pdf_pages
+    ))
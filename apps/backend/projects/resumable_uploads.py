@@ -0,0 +1,188 @@
+"""
+Resumable chunked PDF uploads through the API (for local storage and unreliable connections)
+
+The client opens a session with the file size and sends the file in chunks,
+each one at the offset the server reported. Chunks are appended to a file in
+UPLOAD_SESSION_DIR and hashed while they are written, so memory use does not
+depend on the file size, and the bytes of an interrupted chunk are kept.
+complete_session() hands the assembled file to Project.pdf_file without
+copying it (local storage moves it into place).
+"""
+import hashlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+
+from .preflight import preflight_pdf
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 64 * 1024
+PDF_HEADER = b'%PDF-'  # Must appear within the first 1024 bytes, like pdfinfo expects
+
+# Running SHA-256 per session in this process: (bytes hashed, hash object). Chunks of one upload can
+# reach different app server processes; a process catches up on the bytes it did not see from disk.
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+MAX_HASHERS = 100
+
+
+class UploadSessionError(Exception):
+    """The chunk or upload is rejected; the message is shown to the customer"""
+
+
+class OffsetMismatch(UploadSessionError):
+    """The chunk does not start where the upload stands; the client continues at `offset`"""
+
+    def __init__(self, offset):
+        super().__init__(f"Upload continues at byte {offset}.")
+        self.offset = offset
+
+
+class AssembledFile(File):
+    """The assembled upload; storages that support it move the file instead of copying it"""
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+def session_path(session):
+    return os.path.join(settings.UPLOAD_SESSION_DIR, f'{session.id}.part')
+
+
+def _take_hasher(session_id):
+    with _hashers_lock:
+        return _hashers.pop(session_id, (0, hashlib.sha256()))
+
+
+def _keep_hasher(session_id, hashed, digest):
+    with _hashers_lock:
+        _hashers[session_id] = (hashed, digest)
+        while len(_hashers) > MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def _catch_up(path, hashed, digest, until):
+    """Feed bytes hashed..until of the file to `digest` (the ones written by other processes)"""
+    if hashed > until:
+        hashed, digest = 0, hashlib.sha256()
+    with open(path, 'rb') as f:
+        f.seek(hashed)
+        remaining = until - hashed
+        while remaining:
+            block = f.read(min(BLOCK_SIZE, remaining))
+            if not block:
+                raise UploadSessionError("Upload data is missing, please start the upload again.")
+            digest.update(block)
+            remaining -= len(block)
+    return digest
+
+
+def start_session(user, filename, size, title='', description='', project=None):
+    """Open an upload session for a new project or (with `project`) a replacement PDF"""
+    from .direct_uploads import DirectUploadError, clean_filename, validate_upload
+    from .models import UploadSession
+
+    try:
+        # The name becomes the PDF's storage name when the session is completed
+        filename = clean_filename(filename)
+        validate_upload(filename, size)
+    except DirectUploadError as e:
+        raise UploadSessionError(str(e))
+    session = UploadSession.objects.create(
+        user=user, project=project, title=title, description=description, filename=filename, size=size
+    )
+    os.makedirs(settings.UPLOAD_SESSION_DIR, exist_ok=True)
+    open(session_path(session), 'wb').close()
+    return session
+
+
+def append_chunk(session, offset, stream, length):
+    """
+    Write `length` bytes read from `stream` at `offset` and return the new offset.
+
+    If the client disconnects, the bytes received up to then are kept and the
+    client continues from the returned (or later queried) offset. The first
+    chunk must start with a PDF header. Raises UploadSessionError.
+    """
+    from .models import UploadSession
+
+    if length > settings.UPLOAD_CHUNK_MAX_MB * 1024 * 1024:
+        raise UploadSessionError(f"Chunk too large, at most {settings.UPLOAD_CHUNK_MAX_MB}MB per request.")
+    with transaction.atomic():
+        # One chunk at a time per session
+        session = UploadSession.objects.select_for_update().get(pk=session.pk)
+        if offset != session.received:
+            raise OffsetMismatch(session.received)
+        if offset + length > session.size:
+            raise UploadSessionError("Chunk exceeds the announced file size.")
+
+        path = session_path(session)
+        hashed, digest = _take_hasher(session.id)
+        digest = _catch_up(path, hashed, digest, offset)
+        received = offset
+        with open(path, 'r+b') as f:
+            # Drop bytes beyond the recorded offset (left by a crashed request)
+            f.seek(offset)
+            f.truncate()
+            remaining = length
+            try:
+                while remaining:
+                    block = stream.read(min(BLOCK_SIZE, remaining))
+                    if not block:
+                        break
+                    if received == 0 and PDF_HEADER not in block[:1024]:
+                        raise UploadSessionError("File must be a PDF.")
+                    f.write(block)
+                    digest.update(block)
+                    received += len(block)
+                    remaining -= len(block)
+            except OSError as e:
+                logger.info(f"Upload session {session.id}: chunk interrupted after {received - offset} bytes: {e}")
+        session.received = received
+        session.save(update_fields=['received', 'updated_at'])
+    _keep_hasher(session.id, received, digest)
+    return received
+
+
+def complete_session(session):
+    """
+    Check the assembled PDF and return (file, sha256, pre-flight result) for Project.pdf_file.
+
+    Close the file once the project is saved, then discard_session().
+    Raises UploadSessionError, or PreflightError for a PDF that cannot be rendered.
+    """
+    if session.received != session.size:
+        raise UploadSessionError(f"Upload incomplete ({session.received} of {session.size} bytes).")
+    path = session_path(session)
+    hashed, digest = _take_hasher(session.id)
+    digest = _catch_up(path, hashed, digest, session.size)
+    preflight = preflight_pdf(path)
+    return AssembledFile(open(path, 'rb'), name=session.filename), digest.hexdigest(), preflight
+
+
+def discard_session(session):
+    """Delete a session and whatever is left of its file"""
+    _take_hasher(session.id)
+    try:
+        os.unlink(session_path(session))
+    except FileNotFoundError:
+        pass  # Moved into storage
+    session.delete()
+
+
+def expire_sessions():
+    """Delete sessions without a chunk for UPLOAD_SESSION_EXPIRY_HOURS, returns their number"""
+    from .models import UploadSession
+
+    cutoff = timezone.now() - timedelta(hours=settings.UPLOAD_SESSION_EXPIRY_HOURS)
+    expired = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in expired:
+        discard_session(session)
+    return len(expired)
@@ -0,0 +1,240 @@
+"""
+Render scheduling: cost lanes and a per-user cap on concurrent renders
+
+Projects are not sent to Celery straight away. schedule_render() puts a
+project in a lane by its estimated cost, and dispatch_renders() sends it to
+the lane's queue once its owner has fewer than RENDER_MAX_PER_USER renders
+in flight. A customer uploading dozens of catalogues therefore only ever
+occupies a few queue entries, and small documents go to their own queue
+(with its own worker) instead of waiting behind large ones.
+
+recover_stuck_renders() dispatches renders again whose worker died; the
+new run continues from the pages the old one checkpointed. cancel_render()
+takes a project out of the queue and stops its running render.
+"""
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .cancellation import Cancelled, clear_cancel, request_cancel
+from .progress import STAGE_QUEUED
+from .render_cache import forget_render_result
+
+logger = logging.getLogger(__name__)
+
+LANE_FAST = 'fast'
+LANE_STANDARD = 'standard'
+
+# Celery queue per lane (see CELERY_TASK_ROUTES and the worker services in docker-compose.yml)
+LANE_QUEUES = {
+    LANE_FAST: 'render_fast',
+    LANE_STANDARD: 'render',
+}
+
+
+def render_lane(project):
+    """Lane of a project by its pre-flight page count and file size"""
+    if project.pdf_info is None:
+        # Uploaded directly to storage, the worker scans it: cost unknown
+        return LANE_STANDARD
+    info = project.pdf_info
+    pages = info.get('flipbook_pages', project.total_pages)
+    size_mb = info.get('file_bytes', 0) / 1048576
+    if pages <= settings.RENDER_FAST_LANE_MAX_PAGES and size_mb <= settings.RENDER_FAST_LANE_MAX_MB:
+        return LANE_FAST
+    return LANE_STANDARD
+
+
+def _active_statuses():
+    from .models import Project
+
+    return [Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL]
+
+
+def schedule_render(project):
+    """Queue a project for (re)processing and dispatch it if its owner has a free render slot"""
+    from .models import Project
+
+    now = timezone.now()
+    clear_cancel(project.id)
+    forget_render_result(project)
+    Project.objects.filter(pk=project.pk).update(
+        render_lane=render_lane(project),
+        render_queued_at=now,
+        render_dispatched_at=None,
+        processing_attempts=0,
+        render_chunks_waiting=0,
+        progress_stage=STAGE_QUEUED,
+        progress_updated_at=now
+    )
+    dispatch_renders(user_id=project.user_id)
+
+
+def cancel_render(project):
+    """
+    Cancel a project's processing: it leaves the queue, a running render is stopped (see cancellation.py)
+    and cleans up its partial output, and the owner's next waiting project starts
+    """
+    from .models import Project
+
+    request_cancel(project.id)
+    Project.objects.filter(pk=project.pk).update(
+        status=Project.Status.ERROR,
+        error_message=str(Cancelled()),
+        render_queued_at=None,
+        render_dispatched_at=None,
+        progress_stage='',
+        progress_updated_at=timezone.now()
+    )
+    dispatch_renders(user_id=project.user_id)
+
+
+def dispatch_renders(user_id=None):
+    """
+    Send waiting projects to their lane's queue while their owners are below RENDER_MAX_PER_USER.
+
+    Called when a project is scheduled and when a render finishes (for that
+    user), and periodically for all users. Users with fewer renders in
+    flight go first; a user's own projects are dispatched oldest first.
+    Returns the number of dispatched projects.
+    """
+    from .models import Project
+
+    waiting = Project.objects.filter(render_queued_at__isnull=False, render_dispatched_at__isnull=True)
+    if user_id is not None:
+        waiting = waiting.filter(user_id=user_id)
+    users = list(
+        waiting.values('user_id')
+        .annotate(oldest=Min('render_queued_at'))
+        .order_by('oldest')
+        .values_list('user_id', flat=True)
+    )
+    running = dict(
+        Project.objects.filter(
+            user_id__in=users, render_dispatched_at__isnull=False, status__in=_active_statuses()
+        )
+        .values('user_id')
+        .annotate(count=Count('id'))
+        .values_list('user_id', 'count')
+    )
+    dispatched = 0
+    for user in sorted(users, key=lambda user: running.get(user, 0)):
+        dispatched += _dispatch_user(user)
+    return dispatched
+
+
+def _dispatch_user(user_id):
+    from accounts.models import User
+    from .models import Project
+    from .tasks import process_pdf_task
+
+    limit = settings.RENDER_MAX_PER_USER
+    with transaction.atomic():
+        # Serializes dispatching per user, so concurrent callers cannot exceed the cap
+        User.objects.select_for_update().filter(pk=user_id).first()
+        waiting = Project.objects.filter(
+            user_id=user_id, render_queued_at__isnull=False, render_dispatched_at__isnull=True
+        ).order_by('render_queued_at')
+        if limit > 0:
+            running = Project.objects.filter(
+                user_id=user_id, render_dispatched_at__isnull=False, status__in=_active_statuses()
+            ).count()
+            waiting = waiting[:max(limit - running, 0)]
+        projects = list(waiting.values_list('id', 'render_lane'))
+        now = timezone.now()
+        for project_id, lane in projects:
+            Project.objects.filter(pk=project_id).update(render_dispatched_at=now)
+            queue = LANE_QUEUES.get(lane, LANE_QUEUES[LANE_STANDARD])
+            # The dispatch time lets the task recognise a stale redelivery (see recover_stuck_renders)
+            transaction.on_commit(
+                lambda project_id=project_id, queue=queue: process_pdf_task.apply_async(
+                    (project_id,), {'dispatched_at': now.isoformat()}, queue=queue
+                )
+            )
+    return len(projects)
+
+
+def recover_stuck_renders():
+    """
+    Dispatch renders again that made no progress for PDF_STUCK_AFTER_MINUTES.
+
+    The worker running them died (crash, OOM kill, redeploy) and the broker
+    would only redeliver the task after the visibility timeout. Running
+    renders report progress every few seconds (see progress.py), so only dead
+    ones go this long without; distributed renders whose chunk tasks still
+    wait for a worker are left alone. The new run keeps the checkpointed pages of
+    the old one; after PDF_MAX_PROCESSING_ATTEMPTS runs the project fails
+    instead. Returns the number of re-queued projects.
+    """
+    from .models import Project
+
+    now = timezone.now()
+    deadline = now - timedelta(minutes=settings.PDF_STUCK_AFTER_MINUTES)
+    stuck = Project.objects.filter(
+        status__in=[Project.Status.PROCESSING, Project.Status.PARTIAL],
+        render_dispatched_at__isnull=False,
+        render_chunks_waiting=0,
+        progress_updated_at__lt=deadline
+    )
+    recovered = 0
+    for project in stuck:
+        # Conditional, so a render that just finished or reported progress is left alone
+        still_stuck = Project.objects.filter(
+            pk=project.pk, status=project.status, render_chunks_waiting=0, progress_updated_at__lt=deadline
+        )
+        if project.processing_attempts >= settings.PDF_MAX_PROCESSING_ATTEMPTS:
+            if still_stuck.update(
+                status=Project.Status.ERROR,
+                error_message=f"Processing was interrupted {project.processing_attempts} times, giving up.",
+                progress_updated_at=now
+            ):
+                logger.warning(f"Project {project.id}: processing failed after {project.processing_attempts} attempts")
+                dispatch_renders(user_id=project.user_id)
+            continue
+        if still_stuck.update(
+            render_queued_at=now, render_dispatched_at=None, progress_stage=STAGE_QUEUED, progress_updated_at=now
+        ):
+            logger.warning(
+                f"Project {project.id}: no progress since {project.progress_updated_at}, "
+                f"re-queued (attempt {project.processing_attempts + 1})"
+            )
+            dispatch_renders(user_id=project.user_id)
+            recovered += 1
+    return recovered
+
+
+def render_queue_stats():
+    """
+    Queue state per lane: projects waiting for a slot, renders in flight, the age of the oldest
+    waiting project, and the average and maximum wait (scheduled to started) of renders started
+    within the last hour. Times are in seconds.
+    """
+    from .models import Project
+
+    now = timezone.now()
+    stats = {}
+    for lane in LANE_QUEUES:
+        projects = Project.objects.filter(render_lane=lane, render_queued_at__isnull=False)
+        counts = projects.aggregate(
+            waiting=Count('id', filter=Q(render_dispatched_at__isnull=True)),
+            running=Count('id', filter=Q(render_dispatched_at__isnull=False, status__in=_active_statuses())),
+            oldest_queued_at=Min('render_queued_at', filter=Q(render_dispatched_at__isnull=True))
+        )
+        waits = [
+            (started - queued).total_seconds()
+            for queued, started in projects.filter(processing_started_at__gte=now - timedelta(hours=1))
+            .filter(processing_started_at__gte=F('render_queued_at'))
+            .values_list('render_queued_at', 'processing_started_at')
+        ]
+        oldest = counts.pop('oldest_queued_at')
+        stats[lane] = dict(
+            counts,
+            oldest_waiting_seconds=round((now - oldest).total_seconds()) if oldest else 0,
+            avg_wait_seconds=round(sum(waits) / len(waits), 1) if waits else None,
+            max_wait_seconds=round(max(waits), 1) if waits else None,
+            started_last_hour=len(waits)
+        )
+    return stats
@@ -1,13 +1,69 @@
+from django.conf import settings
 from rest_framework import serializers
 from .models import Project, ProjectPage
 
 
 class ProjectPageSerializer(serializers.ModelSerializer):
     image_url = serializers.SerializerMethodField()
+    renditions = serializers.SerializerMethodField()
+    optimized_image = serializers.SerializerMethodField()
+    tiles = serializers.SerializerMethodField()
     
     class Meta:
         model = ProjectPage
-        fields = ('page_number', 'image_url', 'width', 'height')
+        fields = ('page_number', 'image_url', 'width', 'height', 'renditions', 'optimized_image', 'tiles', 'render_error')
+    
+    def get_tiles(self, obj):
+        """Deep-zoom pyramid of the page; url is a template with {level}, {col} and {row} placeholders"""
+        if not obj.tiles:
+            return None
+        from django.urls import reverse
+        url = reverse('project-detail', kwargs={'slug': obj.project.slug})
+        url = f"{url}tiles/{obj.page_number}/" + '{level}/{col}_{row}/'
+        request = self.context.get('request')
+        if request:
+            url = request.build_absolute_uri(url)
+        tiles = {key: value for key, value in obj.tiles.items() if key != 'base'}
+        tiles['url'] = url
+        return tiles
+    
+    def get_optimized_image(self, obj):
+        """Smaller encoding (e.g. WebP) of the page if format selection chose one, image_url is the JPEG fallback"""
+        if not obj.optimized_image:
+            return None
+        try:
+            url = obj.image_file.storage.url(obj.optimized_image['name'])
+            request = self.context.get('request')
+            if request and not (url.startswith('http://') or url.startswith('https://')):
+                url = request.build_absolute_uri(url)
+        except Exception as e:
+            import logging
+            logger = logging.getLogger(__name__)
+            logger.error(f"Failed to generate optimized image URL for page {obj.page_number}: {e}")
+            return None
+        return {'url': url, 'format': obj.optimized_image['format']}
+    
+    def get_renditions(self, obj):
+        """Additional sizes of the page, so clients can pick the smallest one that fits"""
+        renditions = {}
+        storage = obj.image_file.storage
+        request = self.context.get('request')
+        for key, rendition in (obj.renditions or {}).items():
+            try:
+                url = storage.url(rendition['name'])
+                if request and not (url.startswith('http://') or url.startswith('https://')):
+                    url = request.build_absolute_uri(url)
+            except Exception as e:
+                import logging
+                logger = logging.getLogger(__name__)
+                logger.error(f"Failed to generate {key} rendition URL for page {obj.page_number}: {e}")
+                continue
+            renditions[key] = {
+                'url': url,
+                'width': rendition['width'],
+                'height': rendition['height']
+            }
+        return renditions
     
     def get_image_url(self, obj):
         if obj.image_file:
@@ -68,15 +124,17 @@ class ProjectSerializer(serializers.ModelSerializer):
         model = Project
         fields = (
             'id', 'title', 'slug', 'description', 'status', 'error_message',
-            'total_pages', 'pdf_url', 'pages', 'pages_json', 'can_download', 'can_publish',
+            'total_pages', 'pdf_info', 'render_cost', 'pdf_url', 'pages', 'pages_json', 'can_download', 'can_publish',
             'download_enabled', 'is_published', 'published_slug', 'published_logo',
             'preview_url', 'public_url',
-            'created_at', 'updated_at', 'processing_started_at', 'processing_completed_at'
+            'created_at', 'updated_at', 'processing_started_at', 'processing_completed_at',
+            'progress_stage', 'pages_rendered', 'pages_uploaded'
         )
         read_only_fields = (
-            'id', 'slug', 'status', 'error_message', 'total_pages', 'pages_json',
+            'id', 'slug', 'status', 'error_message', 'total_pages', 'pdf_info', 'render_cost', 'pages_json',
             'can_download', 'can_publish', 'created_at', 'updated_at',
-            'processing_started_at', 'processing_completed_at'
+            'processing_started_at', 'processing_completed_at',
+            'progress_stage', 'pages_rendered', 'pages_uploaded'
         )
     
     def validate_published_slug(self, value):
@@ -124,7 +182,7 @@ class ProjectSerializer(serializers.ModelSerializer):
         return None
     
     def get_preview_url(self, obj):
-        if obj.status == Project.Status.READY:
+        if obj.status in (Project.Status.READY, Project.Status.PARTIAL):
             return f"/app/projects/{obj.slug}/preview"
         return None
     
@@ -135,6 +193,18 @@ class ProjectSerializer(serializers.ModelSerializer):
         return None
 
 
+class ProjectStatusSerializer(serializers.ModelSerializer):
+    """Processing state only, for polling (no pages, no storage URLs)"""
+    
+    class Meta:
+        model = Project
+        fields = (
+            'slug', 'status', 'error_message', 'total_pages', 'progress_stage', 'pages_rendered',
+            'pages_uploaded', 'progress_updated_at', 'processing_started_at', 'processing_completed_at'
+        )
+        read_only_fields = fields
+
+
 class ProjectCreateSerializer(serializers.ModelSerializer):
     slug = serializers.CharField(read_only=True)  # Include slug in response
     
@@ -144,10 +214,16 @@ class ProjectCreateSerializer(serializers.ModelSerializer):
     
     def validate_pdf_file(self, value):
         """Validate PDF file"""
-        if value.size > 100 * 1024 * 1024:  # 100MB limit
-            raise serializers.ValidationError("PDF file too large. Maximum size is 100MB.")
+        if value.size > settings.PDF_MAX_UPLOAD_MB * 1024 * 1024:
+            raise serializers.ValidationError(f"PDF file too large. Maximum size is {settings.PDF_MAX_UPLOAD_MB}MB.")
         if not value.name.lower().endswith('.pdf'):
             raise serializers.ValidationError("File must be a PDF.")
+        # Look inside before accepting it, so broken or huge PDFs never reach a worker
+        from .preflight import preflight_upload, PreflightError
+        try:
+            self.preflight = preflight_upload(value)
+        except PreflightError as e:
+            raise serializers.ValidationError(str(e))
         return value
     
     def validate_title(self, value):
@@ -166,8 +242,14 @@ class ProjectCreateSerializer(serializers.ModelSerializer):
         
         # Store user_id on instance for project_upload_path fallback
         # This ensures the upload path can be generated even if Django calls it before full save
+        # Hash of the PDF, key of the render cache
+        from .render_cache import upload_sha256
+        validated_data['pdf_sha256'] = upload_sha256(validated_data['pdf_file'])
+        
         instance = Project(**validated_data)
         instance._user_id = user.id
+        from .preflight import apply_preflight
+        apply_preflight(instance, self.preflight)
         
         # Now save the instance (this will trigger project_upload_path and slug generation in save() method)
         instance.save()
@@ -176,3 +258,41 @@ class ProjectCreateSerializer(serializers.ModelSerializer):
         instance.refresh_from_db()
         return instance
 
+
+
+class DirectUploadFileSerializer(serializers.Serializer):
+    """Name and size of a PDF to upload directly to storage (see direct_uploads.py)"""
+    filename = serializers.CharField(max_length=200)
+    size = serializers.IntegerField(min_value=1)
+    
+    def validate_filename(self, value):
+        """Keep the base name only, it becomes part of the storage key"""
+        from .direct_uploads import DirectUploadError, clean_filename
+        try:
+            return clean_filename(value)
+        except DirectUploadError as e:
+            raise serializers.ValidationError(str(e))
+
+
+class DirectUploadStartSerializer(DirectUploadFileSerializer):
+    """Direct upload of the PDF of a new project"""
+    title = serializers.CharField()
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    
+    def validate_title(self, value):
+        return ProjectCreateSerializer().validate_title(value)
+
+
+class UploadSessionStartSerializer(DirectUploadFileSerializer):
+    """Resumable upload of the PDF of a new project (title) or of an existing one (project slug)"""
+    title = serializers.CharField(required=False)
+    description = serializers.CharField(required=False, allow_blank=True, default='')
+    project = serializers.CharField(required=False)
+    
+    def validate_title(self, value):
+        return ProjectCreateSerializer().validate_title(value)
+
+
+class DirectUploadCompleteSerializer(serializers.Serializer):
+    """Parts reported by the client after uploading them"""
+    parts = serializers.ListField(child=serializers.DictField(), allow_empty=False)
@@ -0,0 +1,252 @@
+"""
+Worker-local cache of source PDFs
+
+Tasks get the project PDF with fetch_source_pdf(), which returns a private
+path (a hard link to the cache entry, delete it when done), so eviction
+never removes a file that is being rendered. Entries are keyed by the PDF's
+SHA-256 when it is known, otherwise by storage key and ETag, and evicted
+least recently used first above PDF_SOURCE_CACHE_MB; reprocessing a
+recently seen PDF does not touch the network. Misses on S3 are fetched with
+parallel ranged GETs written straight to disk.
+"""
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .uploads import get_s3_client, with_retries
+
+logger = logging.getLogger(__name__)
+
+BLOCK_SIZE = 1024 * 1024
+STALE_LINK_SECONDS = 24 * 3600  # Links left behind by killed tasks
+
+
+def _cache_dir():
+    return settings.PDF_SOURCE_CACHE_DIR
+
+
+def _work_dir():
+    return os.path.join(_cache_dir(), 'work')
+
+
+def _entry_path(key):
+    return os.path.join(_cache_dir(), f'{key}.pdf')
+
+
+def _lock_path(key):
+    return os.path.join(_cache_dir(), f'{key}.lock')
+
+
+@contextmanager
+def _locked(key):
+    """Serialize fetching one entry across the worker processes of this host"""
+    path = _lock_path(key)
+    while True:
+        lock = open(path, 'a')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            current = os.fstat(lock.fileno()).st_ino == os.stat(path).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        # Eviction removed the file while we waited (see _remove_lock); others lock the new one
+        lock.close()
+    try:
+        yield
+    finally:
+        fcntl.flock(lock, fcntl.LOCK_UN)
+        lock.close()
+
+
+def _remove_lock(key):
+    """Delete the lock file of an evicted or re-keyed entry, unless a process holds or waits for it"""
+    try:
+        fd = os.open(_lock_path(key), os.O_RDWR)
+    except FileNotFoundError:
+        return
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return  # In use, the entry is about to be fetched again
+    try:
+        # Under the lock: processes that opened the file meanwhile notice the new inode in _locked
+        os.unlink(_lock_path(key))
+    finally:
+        os.close(fd)
+
+
+def _object_info(name):
+    """(size, version) of a stored PDF: the ETag on S3, the modification time locally"""
+    if settings.USE_S3:
+        head = get_s3_client().head_object(Bucket=settings.AWS_STORAGE_BUCKET_NAME.strip(), Key=name)
+        return head['ContentLength'], head['ETag']
+    stat = os.stat(default_storage.path(name))
+    return stat.st_size, str(stat.st_mtime_ns)
+
+
+def _fetch_ranged(name, path, size, etag):
+    """Download an S3 object with parallel ranged GETs, each written at its offset"""
+    client = get_s3_client()
+    bucket = settings.AWS_STORAGE_BUCKET_NAME.strip()
+    part_size = max(settings.PDF_SOURCE_FETCH_PART_MB, 1) * 1024 * 1024
+    ranges = [(start, min(start + part_size, size) - 1) for start in range(0, size, part_size)]
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+
+        def fetch(byte_range):
+            start, end = byte_range
+            # IfMatch: fail instead of mixing two versions if the object is replaced meanwhile
+            body = client.get_object(Bucket=bucket, Key=name, Range=f'bytes={start}-{end}', IfMatch=etag)['Body']
+            offset = start
+            for block in body.iter_chunks(BLOCK_SIZE):
+                os.pwrite(fd, block, offset)
+                offset += len(block)
+            if offset != end + 1:
+                raise IOError(f"Short read of {name} bytes {start}-{end}")
+
+        def fetch_with_retries(byte_range):
+            # A failed range is fetched again on its own, the others are kept
+            return with_retries(lambda: fetch(byte_range), f"Fetch of {name} bytes {byte_range[0]}-{byte_range[1]}")
+
+        workers = max(min(settings.PDF_SOURCE_FETCH_WORKERS, len(ranges)), 1)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(fetch_with_retries, ranges))
+    finally:
+        os.close(fd)
+
+
+def _fetch(name, path, size, version):
+    started = time.monotonic()
+    if settings.USE_S3:
+        _fetch_ranged(name, path, size, version)
+    else:
+        with default_storage.open(name, 'rb') as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target, BLOCK_SIZE)
+    seconds = time.monotonic() - started
+    logger.info(f"Fetched source PDF {name}: {size / 1048576:.1f} MB in {seconds:.1f}s")
+
+
+def _download(name, size=None, version=None):
+    """Uncached download into a temporary file"""
+    if size is None:
+        size, version = _object_info(name)
+    fd, path = tempfile.mkstemp(suffix='.pdf')
+    os.close(fd)
+    try:
+        _fetch(name, path, size, version)
+    except Exception:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _link(entry, key):
+    path = os.path.join(_work_dir(), f'{key}-{uuid.uuid4().hex}.pdf')
+    os.link(entry, path)
+    return path
+
+
+def fetch_source_pdf(project):
+    """
+    Path of a private copy of the project's PDF; the caller deletes it when done.
+
+    With PDF_SOURCE_CACHE_MB = 0 (or a PDF larger than the cache) the PDF is
+    downloaded into a temporary file every time.
+    """
+    name = project.pdf_file.name
+    size = version = None
+    if project.pdf_sha256:
+        key = project.pdf_sha256
+    else:
+        size, version = _object_info(name)
+        key = hashlib.sha256(f'{name}:{version}'.encode()).hexdigest()
+    if not settings.PDF_SOURCE_CACHE_MB:
+        return _download(name, size, version)
+
+    os.makedirs(_work_dir(), exist_ok=True)
+    entry = _entry_path(key)
+    with _locked(key):
+        if os.path.exists(entry):
+            os.utime(entry)  # Most recently used
+            logger.info(f"Source PDF of project {project.id} served from the worker cache")
+            return _link(entry, key)
+
+        if size is None:
+            size, version = _object_info(name)
+        if size > settings.PDF_SOURCE_CACHE_MB * 1024 * 1024:
+            return _download(name, size, version)
+        partial_path = f'{entry}.part'
+        try:
+            _fetch(name, partial_path, size, version)
+            os.rename(partial_path, entry)
+        finally:
+            if os.path.exists(partial_path):
+                os.unlink(partial_path)
+        path = _link(entry, key)
+    _evict(keep=entry)
+    return path
+
+
+def remember_sha256(path, pdf_sha256):
+    """
+    Re-key the cache entry of a PDF fetched by storage key and ETag to its content hash, once that
+    is known, so later fetches (which go by pdf_sha256) find it
+    """
+    if not settings.PDF_SOURCE_CACHE_MB or os.path.dirname(path) != _work_dir():
+        return
+    key = os.path.basename(path).rsplit('-', 1)[0]
+    if key == pdf_sha256:
+        return
+    with _locked(key):
+        try:
+            if os.path.exists(_entry_path(pdf_sha256)):
+                os.unlink(_entry_path(key))
+            else:
+                os.rename(_entry_path(key), _entry_path(pdf_sha256))
+        except FileNotFoundError:
+            pass  # Evicted meanwhile
+    # Nothing is cached under the old key any more
+    _remove_lock(key)
+
+
+def _evict(keep=None):
+    """Delete least recently used entries until the cache fits PDF_SOURCE_CACHE_MB"""
+    limit = settings.PDF_SOURCE_CACHE_MB * 1024 * 1024
+    entries = []
+    for entry in os.scandir(_cache_dir()):
+        if entry.is_file() and entry.name.endswith('.pdf'):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        _remove_lock(os.path.basename(path)[:-len('.pdf')])
+        total -= size
+
+    cutoff = time.time() - STALE_LINK_SECONDS
+    for entry in os.scandir(_work_dir()):
+        try:
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        except FileNotFoundError:
+            pass
@@ -3,233 +3,1054 @@ Celery tasks for PDF processing
 """
 import os
 import json
-import subprocess
+import queue
+import shutil
 import tempfile
-from celery import shared_task
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from celery import shared_task, chord
 from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 from django.core.files.base import ContentFile
-from PIL import Image
-from .models import Project, ProjectPage
+from .models import Project, ProjectPage, PageCheckpoint, project_page_upload_path, rendition_filename
+from .rendering import (
+    RenderError, rasterize_pdf, iter_rendered_pieces, render_piece, render_renditions, split_page_ranges
+)
+from .uploads import upload_file, with_retries
+from .formats import FORMATS, encode_page, format_filename
+from .tiles import TILE_FORMATS, build_tile_pyramid, tile_base, iter_tile_paths
+from .fingerprints import document_page_keys, page_fingerprints
+from .blobs import store_blob, update_blob_refs, is_blob_name, collect_unused_blobs, file_sha256
+from .render_cache import pages_from_render_cache, store_render_result
+from .preflight import preflight_pdf, apply_preflight
+from .scheduling import dispatch_renders, recover_stuck_renders
+from .direct_uploads import expire_uploads
+from .source_cache import fetch_source_pdf, remember_sha256
+from .cancellation import Cancelled, cancellable, cancel_requested, check, is_cancelled
+from .resumable_uploads import expire_sessions
+from .progress import (
+    ProgressTracker, set_stage, STAGE_ANALYSING, STAGE_DONE, STAGE_DOWNLOADING, STAGE_RENDERING, STAGE_SAVING
+)
 
+logger = logging.getLogger(__name__)
 
-@shared_task
-def process_pdf_task(project_id):
-    """Process PDF into images"""
+
+def _remove_file(path):
+    if os.path.exists(path):
+        try:
+            os.unlink(path)
+        except:
+            pass
+
+
+def _upload_page_image(project, filename, path, content_type='image/jpeg'):
+    """
+    Upload a page image to media storage and return (stored_name, uploaded_bytes)
+
+    With PAGE_STORAGE_DEDUP the image is stored content-addressed (see
+    blobs.py) and not uploaded at all if the same bytes are stored already.
+    """
+    if settings.PAGE_STORAGE_DEDUP:
+        return store_blob(path, filename, content_type=content_type)
+    name = project_page_upload_path(ProjectPage(project=project), filename)
+    return upload_file(name, path, content_type=content_type)
+
+
+def _store_tiles(project, pdf_path, piece):
+    """
+    Render a page at PAGE_TILES_DPI and upload its deep-zoom tile pyramid.
+
+    Returns (descriptor, uploaded_bytes); descriptor['base'] is the storage
+    path the tiles live under (see tiles.iter_tile_paths).
+    """
+    tiles_dir = tempfile.mkdtemp(dir=os.path.dirname(piece['path']))
+    try:
+        image_path, _, _ = render_piece(
+            pdf_path, os.path.join(tiles_dir, 'page'), piece, settings.PAGE_TILES_DPI, image_format='png'
+        )
+        descriptor, tiles = build_tile_pyramid(
+            image_path, tiles_dir,
+            tile_size=settings.PAGE_TILE_SIZE,
+            overlap=settings.PAGE_TILE_OVERLAP,
+            tile_format=settings.PAGE_TILE_FORMAT,
+            quality=settings.PAGE_RENDITION_QUALITY
+        )
+        # Tiles are addressed by position below the base, so they are never content-addressed
+        descriptor['base'] = project_page_upload_path(ProjectPage(project=project), tile_base(piece['filename']))
+        content_type = TILE_FORMATS[descriptor['format']][1]
+        uploaded_bytes = 0
+        for relative_path, path in tiles:
+            _, size = upload_file(f"{descriptor['base']}/{relative_path}", path, content_type=content_type)
+            uploaded_bytes += size
+    finally:
+        shutil.rmtree(tiles_dir, ignore_errors=True)
+    return descriptor, uploaded_bytes
+
+
+def _store_piece(project, pdf_path, piece):
+    """
+    Create and upload everything stored for one flipbook page: the page
+    image itself, its renditions, if format selection found a smaller
+    encoding than JPEG that encoding, and optionally a deep-zoom tile pyramid.
+
+    Placeholders of pages that could not be rendered (see
+    rendering._run_render_job) get no renditions or tiles, both would need
+    the page rendered again.
+
+    Returns ({'pdf_page', 'part', 'name', 'width', 'height', 'renditions', 'optimized', 'tiles',
+    'render_error'}, uploaded_bytes).
+    """
+    render_error = piece.get('render_error', '')
+    renditions = {}
+    if settings.PAGE_RENDITIONS and not render_error:
+        try:
+            renditions = render_renditions(pdf_path, piece, settings.PAGE_RENDITIONS)
+        except RenderError as e:
+            # Clients fall back to the page image itself
+            logger.warning(f"Project {project.id}: no renditions for PDF page {piece['pdf_page']}: {e}")
+    optimized = None
+    try:
+        if not piece['path'].endswith('.jpg'):
+            # Lossless render: encode the JPEG fallback and pick the best format
+            source_path = piece['path']
+            piece['path'], optimized = encode_page(source_path)
+            _remove_file(source_path)
+        
+        name, uploaded_bytes = _upload_page_image(project, piece['filename'], piece['path'])
+        stored_renditions = {}
+        for key, rendition in renditions.items():
+            rendition_name, size = _upload_page_image(
+                project, rendition_filename(piece['filename'], key), rendition['path']
+            )
+            uploaded_bytes += size
+            stored_renditions[key] = {
+                'name': rendition_name,
+                'width': rendition['width'],
+                'height': rendition['height']
+            }
+        
+        stored_optimized = None
+        if optimized:
+            optimized_name, size = _upload_page_image(
+                project, format_filename(piece['filename'], optimized['format']), optimized['path'],
+                content_type=FORMATS[optimized['format']]['mime']
+            )
+            uploaded_bytes += size
+            stored_optimized = {'name': optimized_name, 'format': optimized['format'], 'bytes': size}
+        
+        stored_tiles = None
+        if settings.PAGE_TILES_ENABLED and not render_error:
+            try:
+                stored_tiles, size = _store_tiles(project, pdf_path, piece)
+                uploaded_bytes += size
+            except RenderError as e:
+                logger.warning(f"Project {project.id}: no tiles for PDF page {piece['pdf_page']}: {e}")
+    finally:
+        for rendition in renditions.values():
+            _remove_file(rendition['path'])
+        if optimized:
+            _remove_file(optimized['path'])
+
+    return {
+        'pdf_page': piece['pdf_page'],
+        'part': piece['part'],
+        'name': name,
+        'width': piece['width'],
+        'height': piece['height'],
+        'renditions': stored_renditions,
+        'optimized': stored_optimized,
+        'tiles': stored_tiles,
+        'render_error': render_error
+    }, uploaded_bytes
+
+
+def _process_rendered_pages(
+    project, pdf_path, rendered_pieces, filename_for, on_progress=None, on_stored=None, tracker=None
+):
+    """
+    Upload rendered flipbook pages as a two-stage pipeline.
+
+    The calling thread consumes `rendered_pieces` (a list or a streaming
+    iterator from the renderer) and hands them to a pool of upload threads
+    through a bounded queue, which also create the renditions of each page
+    (see _store_piece). Uploading therefore overlaps with rendering, and once the queue is full the renderer is throttled, so only
+    a few pages are ever on disk at the same time.
+
+    `filename_for(pdf_page_number, part, part_count, index)` names each piece;
+    `index` is the zero-based flipbook position. No ProjectPage rows are
+    written here, see _finish_project; `on_progress` is called by the
+    upload threads, one at a time, with the pages finished so far (each
+    with its 'index'), e.g. to store the leading pages early (see
+    _partial_publisher). `on_stored(result, piece)` is called by the upload
+    thread right after each piece is stored (see _checkpointer). Rendered
+    and uploaded pages are counted on `tracker` (a progress.ProgressTracker),
+    if given.
+
+    If any upload fails (after the retries of uploads.with_retries) the
+    remaining work is dropped and the first error is raised; pages stored
+    until then are kept by a retry if they were checkpointed. If the
+    project's processing is cancelled (see cancellation.py) the pages
+    stored so far are deleted again and Cancelled is raised.
+
+    Returns ([{'pdf_page', 'part', 'name', 'width', 'height', 'renditions', 'optimized', 'tiles'}, ...]
+    in flipbook order, {'bytes', 'seconds'} upload statistics).
+    """
+    upload_queue = queue.Queue(maxsize=settings.PDF_PIPELINE_QUEUE_DEPTH)
+    results = []
+    errors = []
+    uploaded_bytes = [0]
+    stats_lock = threading.Lock()
+    progress_lock = threading.Lock()
+
+    def upload_stage():
+        while True:
+            item = upload_queue.get()
+            if item is None:
+                # Database connections are per thread
+                connections.close_all()
+                return
+            index, piece = item
+            try:
+                # Keep draining the queue after a failure so the producer never blocks
+                if errors or is_cancelled():
+                    continue
+                result, size = _store_piece(project, pdf_path, piece)
+                if on_stored:
+                    on_stored(result, piece)
+                with stats_lock:
+                    uploaded_bytes[0] += size
+                    results.append(dict(result, index=index))
+                if tracker:
+                    tracker.uploaded()
+                if on_progress:
+                    with progress_lock:
+                        with stats_lock:
+                            finished = list(results)
+                        on_progress(finished)
+            except Exception as e:
+                errors.append(Exception(f"Upload of page {index + 1} failed: {e}"))
+            finally:
+                _remove_file(piece['path'])
+
+    started = time.monotonic()
+    uploaders = [
+        threading.Thread(target=upload_stage, daemon=True)
+        for _ in range(max(1, settings.PAGE_UPLOAD_WORKERS))
+    ]
+    for uploader in uploaders:
+        uploader.start()
+
+    index = 0
+    try:
+        try:
+            for piece in rendered_pieces:
+                if errors:
+                    break
+                check()
+                piece['filename'] = filename_for(piece['pdf_page'], piece['part'], piece['parts'], index)
+                upload_queue.put((index, piece))
+                index += 1
+                if tracker:
+                    tracker.rendered()
+        finally:
+            if hasattr(rendered_pieces, 'close'):
+                # Stop the renderer threads (after a failed upload, an error or a cancellation)
+                # before the caller removes their output directory
+                rendered_pieces.close()
+            for _ in uploaders:
+                upload_queue.put(None)
+            for uploader in uploaders:
+                uploader.join()
+            if tracker:
+                tracker.flush()
+        check()
+    except Cancelled:
+        _discard_pieces(project, results)
+        raise
+
+    if errors:
+        raise errors[0]
+
+    stats = {'bytes': uploaded_bytes[0], 'seconds': time.monotonic() - started}
+    logger.info(
+        f"Project {project.id}: uploaded {len(results)} page images "
+        f"({stats['bytes'] / 1048576:.1f} MB) in {stats['seconds']:.1f}s, "
+        f"{_throughput(stats):.1f} MB/s with {len(uploaders)} upload workers"
+    )
+
+    results.sort(key=lambda result: result.pop('index'))
+    return results, stats
+
+
+def _throughput(stats):
+    """Upload throughput in MB/s"""
+    return stats['bytes'] / 1048576 / stats['seconds'] if stats['seconds'] > 0 else 0
+
+
+def _finish_project(project, pages):
+    """
+    Write all ProjectPage rows and pages_json and mark the project as ready.
+
+    `pages` is a list of {'name', 'width', 'height', 'renditions', 'optimized', 'tiles',
+    'fingerprint', 'part'} in flipbook order; the
+    flipbook page number is the position in that list. Rows are inserted with
+    a single bulk_create in the same transaction as the project update, so a
+    project has either all of its pages or none (rows left over from an
+    earlier failed attempt are replaced).
+
+    Storage objects of replaced rows (and of checkpoints, see _checkpointer)
+    that no new row uses any more are deleted afterwards, and a published
+    flipbook is republished.
+    """
+    # Last chance for a cancellation, afterwards the pages are in place
+    if is_cancelled():
+        _discard_pieces(project, pages)
+        raise Cancelled()
+    started = time.monotonic()
+    old_pages = list(ProjectPage.objects.filter(project=project))
+    checkpointed_pages = [checkpoint.as_page() for checkpoint in PageCheckpoint.objects.filter(project=project)]
+    # Published copies are named by page number, so they stay valid where the same piece keeps its number
+    published = {
+        page.page_number: (page.fingerprint, page.pdf_part)
+        for page in old_pages if page.published_fingerprint and page.published_fingerprint == page.fingerprint
+    }
+    page_rows, pages_data = _build_page_rows(project, pages, published)
+
+    # Pages replaced by placeholders are reported, unless nothing could be rendered at all
+    failed_pages = [page for page in pages if page.get('render_error')]
+    if failed_pages and len(failed_pages) == len(pages):
+        raise Exception(f"No page could be rendered: {failed_pages[0]['render_error']}")
+    project.error_message = '\n'.join(
+        f"PDF page {page['pdf_page']}: {page['render_error']}" if 'pdf_page' in page else page['render_error']
+        for page in failed_pages
+    )
+    
+    # Total pages is the flipbook page count (may be more than PDF pages if landscape pages were split)
+    total_pages = len(pages)
+    project.total_pages = total_pages
+    project.pages_json = {
+        'total_pages': total_pages,
+        'pages': pages_data
+    }
+    project.status = Project.Status.READY
+    project.processing_completed_at = timezone.now()
+    project.progress_stage = STAGE_DONE
+    project.pages_rendered = project.pages_uploaded = total_pages
+    project.progress_updated_at = project.processing_completed_at
+
+    finished_fields = (
+        'error_message', 'total_pages', 'pages_json', 'status', 'processing_completed_at',
+        'progress_stage', 'pages_rendered', 'pages_uploaded', 'progress_updated_at'
+    )
+    try:
+        with transaction.atomic():
+            # Not save(): that would insert a project deleted meanwhile again, or revive a cancelled one
+            if not Project.objects.filter(
+                pk=project.pk, status__in=[Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL]
+            ).update(updated_at=timezone.now(), **{field: getattr(project, field) for field in finished_fields}):
+                raise Cancelled()
+            ProjectPage.objects.filter(project=project).delete()
+            ProjectPage.objects.bulk_create(page_rows, batch_size=500)
+            update_blob_refs(
+                [name for page in old_pages for name in page.storage_names()],
+                [name for page in page_rows for name in page.storage_names()]
+            )
+            PageCheckpoint.objects.filter(project=project).delete()
+            store_render_result(project, page_rows)
+    except Cancelled:
+        _discard_pieces(project, pages)
+        raise
+
+    logger.info(f"Project {project.id}: stored {total_pages} page rows in {(time.monotonic() - started) * 1000:.0f}ms")
+    
+    _delete_unused_page_objects(old_pages + checkpointed_pages, page_rows)
+    if project.is_published:
+        publish_flipbook_task.delay(project.id)
+    _release_render_slot(project.user_id)
+    return total_pages
+
+
+def _release_render_slot(user_id):
+    """A render of this user ended: start their next waiting project (see scheduling.py)"""
+    try:
+        dispatch_renders(user_id=user_id)
+    except Exception as e:
+        # dispatch_renders_task picks it up
+        logger.warning(f"Could not dispatch waiting renders of user {user_id}: {e}")
+
+
+def _build_page_rows(project, pages, published=None):
+    """
+    Build the (unsaved) ProjectPage rows and pages_json entries for `pages` in flipbook order.
+
+    `published` maps page numbers to the (fingerprint, part) whose published
+    copy is still current (see _finish_project).
+    """
+    published = published or {}
+    page_rows = []
+    pages_data = []
+    for flipbook_page_number, page in enumerate(pages, start=1):
+        renditions = page.get('renditions', {})
+        optimized = page.get('optimized')
+        tiles = page.get('tiles')
+        fingerprint = page.get('fingerprint', '')
+        part = page.get('part', 0)
+        render_error = page.get('render_error', '')
+        is_published = fingerprint and published.get(flipbook_page_number) == (fingerprint, part)
+        page_rows.append(ProjectPage(
+            project=project,
+            page_number=flipbook_page_number,
+            image_file=page['name'],
+            width=page['width'],
+            height=page['height'],
+            renditions=renditions,
+            optimized_image=optimized,
+            tiles=tiles,
+            fingerprint=fingerprint,
+            pdf_part=part,
+            published_fingerprint=fingerprint if is_published else '',
+            render_error=render_error[:255]
+        ))
+        page_file = f'page-{flipbook_page_number:03d}.jpg'
+        page_data = {
+            'page_number': flipbook_page_number,
+            'file': page_file,
+            'width': page['width'],
+            'height': page['height'],
+            # Format chosen for this page; 'file' always stays a JPEG fallback
+            'format': optimized['format'] if optimized else 'jpeg',
+            'renditions': {
+                key: {
+                    'file': rendition_filename(page_file, key),
+                    'width': rendition['width'],
+                    'height': rendition['height']
+                }
+                for key, rendition in renditions.items()
+            }
+        }
+        if optimized:
+            page_data['optimized_file'] = format_filename(page_file, optimized['format'])
+        if tiles:
+            # Deep-zoom pyramid: tiles at {path}/{level}/{col}_{row}.{format}
+            page_data['tiles'] = dict(
+                {key: value for key, value in tiles.items() if key != 'base'},
+                path=tile_base(page_file)
+            )
+        pages_data.append(page_data)
+    return page_rows, pages_data
+
+
+def _wants_partial(project):
+    """
+    Whether to make the leading pages viewable before the whole document is processed.
+
+    Only for a first render of a document longer than PDF_PARTIAL_PAGES;
+    when a PDF is replaced, the previous pages stay in place until the new
+    ones are complete.
+    """
+    return (
+        settings.PDF_PARTIAL_PAGES > 0 and
+        project.total_pages > settings.PDF_PARTIAL_PAGES and
+        not ProjectPage.objects.filter(project=project).exists()
+    )
+
+
+def _store_partial_pages(project, pages, stored_count):
+    """
+    Store the first finished pages of a project that is still processing and mark it partially ready.
+
+    `pages` are the leading pages in flipbook order (see _finish_project);
+    rows for pages[stored_count:] are added and pages_json is replaced by
+    the pages available so far ('expected_pages' is the pre-flight page
+    count). _finish_project replaces everything with the complete set.
+    Returns False if the project is no longer processing (e.g. another
+    chunk failed), nothing is stored then.
+    """
+    page_rows, pages_data = _build_page_rows(project, pages)
+    new_rows = page_rows[stored_count:]
+    pages_json = {
+        'total_pages': len(pages),
+        'expected_pages': project.total_pages,
+        'pages': pages_data
+    }
+    with transaction.atomic():
+        updated = Project.objects.filter(
+            pk=project.pk, status__in=[Project.Status.PROCESSING, Project.Status.PARTIAL]
+        ).update(status=Project.Status.PARTIAL, pages_json=pages_json)
+        if not updated:
+            return False
+        ProjectPage.objects.bulk_create(new_rows, batch_size=500)
+        update_blob_refs([], [name for page in new_rows for name in page.storage_names()])
+    logger.info(f"Project {project.id}: {len(pages)} of {project.total_pages} pages available")
+    return True
+
+
+def _partial_publisher(project, fingerprints=None):
+    """
+    Return an on_progress callback for _process_rendered_pages that makes pages viewable as they finish.
+
+    Once the first PDF_PARTIAL_PAGES pages (the cover and first spreads) are
+    uploaded, the project becomes partially ready; after that the available
+    pages grow every PDF_PARTIAL_UPDATE_PAGES pages. Only an uninterrupted
+    run from the first page is stored, so page numbers never change, which
+    requires every page of the document to be rendered in this run (no reuse).
+    """
+    stored = [0]
+
+    def on_progress(finished):
+        if stored[0] < 0:
+            return
+        by_index = {page['index']: page for page in finished}
+        count = stored[0]
+        while count in by_index:
+            count += 1
+        step = settings.PDF_PARTIAL_UPDATE_PAGES if stored[0] else settings.PDF_PARTIAL_PAGES
+        if count - stored[0] < max(step, 1):
+            return
+        pages = _merge_reused_pages([by_index[index] for index in range(count)], {}, fingerprints or {})
+        try:
+            stored[0] = count if _store_partial_pages(project, pages, stored[0]) else -1
+        except Exception as e:
+            # The complete set is stored at the end anyway
+            logger.warning(f"Project {project.id}: could not store partial pages: {e}")
+    return on_progress
+
+
+def _delete_unused_page_objects(old_pages, new_pages):
+    """
+    Delete storage objects of replaced pages that were neither reused nor overwritten
+
+    Shared blobs are left to collect_page_blobs_task, other projects may still use them.
+    """
+    in_use = {name for page in new_pages for name in page.storage_names()}
+    unused = {
+        name for page in old_pages for name in page.storage_names() if not is_blob_name(name)
+    } - in_use
+    if not unused:
+        return
+    storage = old_pages[0].image_file.storage
+    for name in unused:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            logger.warning(f"Could not delete unused page object {name}: {e}")
+    logger.info(f"Deleted {len(unused)} unused page objects")
+
+
+def _discard_pieces(project, pieces):
+    """Delete the storage objects of stored pieces that no page row uses (the output of a cancelled run)"""
+    page_rows, _ = _build_page_rows(project, pieces)
+    _delete_unused_page_objects(page_rows, list(ProjectPage.objects.filter(project_id=project.id)))
+
+
+def _clean_up_cancelled(project_id, pages_dir=None):
+    """
+    Remove what cancelled processing left behind (checkpointed pages, local page files) and free the render slot.
+
+    Pages already shown (partial projects) stay. A project that still exists
+    is marked as cancelled; usually cancel_render or its deletion did that already.
+    """
+    checkpoints = list(PageCheckpoint.objects.filter(project_id=project_id))
+    PageCheckpoint.objects.filter(project_id=project_id).delete()
+    _delete_unused_page_objects(
+        [checkpoint.as_page() for checkpoint in checkpoints],
+        list(ProjectPage.objects.filter(project_id=project_id))
+    )
+    if pages_dir:
+        shutil.rmtree(pages_dir, ignore_errors=True)
+    project = Project.objects.filter(pk=project_id).first()
+    if project is None:
+        logger.info(f"Project {project_id}: processing stopped, the project was deleted")
+        return
+    Project.objects.filter(
+        pk=project_id, status__in=[Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL]
+    ).update(status=Project.Status.ERROR, error_message=str(Cancelled()))
+    logger.info(f"Project {project_id}: processing cancelled")
+    _release_render_slot(project.user_id)
+
+
+def _plan_reuse(project, pdf_path, pdf_page_count):
+    """
+    Fingerprint the pages of the PDF and find those whose rendered pages are stored already.
+
+    Returns (fingerprints, reused): fingerprints maps PDF page numbers to
+    fingerprints, reused maps PDF page numbers to the stored pieces
+    (ProjectPage.as_piece, ordered by part) that can be kept as they are.
+    Every render stores content fingerprints, so a first replacement already
+    reuses the unchanged pages of the first render. Pages that cannot be
+    fingerprinted (the PDF does not parse, or pypdf counts fewer pages than
+    pdfinfo) fall back to document_page_keys.
+    """
+    keys = document_page_keys(project.pdf_sha256, pdf_page_count)
+    content_fingerprints = page_fingerprints(pdf_path)
+    fingerprints = {number: content_fingerprints.get(number, key) for number, key in keys.items()}
+    stored_pages = ProjectPage.objects.filter(project=project).exclude(fingerprint='').order_by('page_number')
+    stored = {}
+    for page in stored_pages:
+        stored.setdefault(page.fingerprint, {}).setdefault(page.pdf_part, page.as_piece())
+    reused = {
+        pdf_page: [stored[fingerprint][part] for part in sorted(stored[fingerprint])]
+        for pdf_page, fingerprint in fingerprints.items() if fingerprint in stored
+    }
+    if reused:
+        logger.info(f"Project {project.id}: reusing {len(reused)} of {len(fingerprints)} unchanged PDF pages")
+    return fingerprints, reused
+
+
+def _merge_reused_pages(pieces, reused, fingerprints):
+    """Combine freshly rendered pieces and reused pages in flipbook order, tagged with their fingerprints"""
+    # Placeholders get no fingerprint, so the next reprocessing tries to render them again
+    pages = [
+        dict(piece, fingerprint='' if piece.get('render_error') else fingerprints.get(piece['pdf_page'], ''))
+        for piece in pieces
+    ]
+    for pdf_page, stored_pieces in reused.items():
+        pages.extend(dict(piece, pdf_page=pdf_page) for piece in stored_pieces)
+    return sorted(pages, key=lambda page: (page['pdf_page'], page['part']))
+
+
+def _fingerprint_filename(fingerprints):
+    """
+    Name rendered pieces after their content.
+
+    The pages of the previous PDF stay in use until _finish_project replaces
+    them (and for good if the run fails), and they may carry the index or
+    PDF page based name a new page would get; content based names never
+    overwrite a page that is still served.
+    """
+    def filename_for(pdf_page_number, part, part_count, index):
+        suffix = f'-{part + 1}' if part_count > 1 else ''
+        return f'page-{fingerprints[pdf_page_number][:16]}{suffix}.jpg'
+    return filename_for
+
+
+def _checkpointer(project, fingerprints):
+    """
+    Return an on_stored callback for _process_rendered_pages that records every stored piece as a PageCheckpoint.
+
+    A run that dies halfway (worker crash, redeploy, storage outage) leaves
+    its stored pages recorded, and the retried run keeps them instead of
+    rendering them again (see _load_checkpoints). Placeholders are not
+    recorded, a retry tries to render them again.
+    """
+    def on_stored(result, piece):
+        fingerprint = fingerprints.get(result['pdf_page'])
+        if not fingerprint or result.get('render_error'):
+            return
+        stored = {key: value for key, value in result.items() if key not in ('pdf_page', 'render_error')}
+        try:
+            # Pages with identical content share one checkpoint
+            PageCheckpoint.objects.bulk_create([PageCheckpoint(
+                project=project, fingerprint=fingerprint, pdf_part=result['part'],
+                piece=dict(stored, fingerprint=fingerprint, parts=piece['parts'])
+            )], ignore_conflicts=True)
+        except Exception as e:
+            # Only costs rendering the page again after a crash
+            logger.warning(f"Project {project.id}: could not checkpoint PDF page {result['pdf_page']}: {e}")
+    return on_stored
+
+
+def _load_checkpoints(project, fingerprints, pdf_pages):
+    """
+    Find the pages among `pdf_pages` that an interrupted earlier run stored completely.
+
+    A page counts if all its parts are checkpointed with its current
+    fingerprint and their images are still in storage. Returns
+    {pdf_page: [pieces by part]} like the reused pages of _plan_reuse.
+    """
+    stored = {}
+    for checkpoint in PageCheckpoint.objects.filter(project=project):
+        stored.setdefault(checkpoint.fingerprint, {})[checkpoint.pdf_part] = checkpoint.piece
+    candidates = {}
+    for pdf_page in pdf_pages:
+        parts = stored.get(fingerprints.get(pdf_page))
+        if parts and all(piece.get('parts') == len(parts) for piece in parts.values()):
+            candidates[pdf_page] = [parts[part] for part in sorted(parts)]
+    if not candidates:
+        return {}
+
+    storage = ProjectPage._meta.get_field('image_file').storage
+    names = sorted({piece['name'] for pieces in candidates.values() for piece in pieces})
+    with ThreadPoolExecutor(max_workers=max(1, settings.PAGE_UPLOAD_WORKERS)) as executor:
+        present = dict(zip(names, executor.map(storage.exists, names)))
+    checkpointed = {
+        pdf_page: [{key: value for key, value in piece.items() if key != 'parts'} for piece in pieces]
+        for pdf_page, pieces in candidates.items() if all(present[piece['name']] for piece in pieces)
+    }
+    if checkpointed:
+        logger.info(f"Project {project.id}: keeping {len(checkpointed)} PDF pages stored by an interrupted run")
+    return checkpointed
+
+
+def _mark_project_failed(project_id, error):
+    try:
+        project = Project.objects.get(id=project_id)
+        project.status = Project.Status.ERROR
+        project.error_message = str(error)
+        project.save()
+        _release_render_slot(project.user_id)
+    except:
+        pass
+
+
+def _is_current_run(project, dispatched_at):
+    """
+    Whether a task sent for the dispatch `dispatched_at` belongs to the project's current render
+
+    Not if the project was dispatched again since (see scheduling.recover_stuck_renders),
+    finished, failed or cancelled. Tasks sent without a dispatch time only need an active project.
+    """
+    return (
+        project.status in (Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL) and
+        (not dispatched_at or project.render_dispatched_at == parse_datetime(dispatched_at))
+    )
+
+
+@shared_task(acks_late=True)
+@cancellable
+def process_pdf_task(project_id, dispatched_at=None):
+    """
+    Process PDF into images
+
+    `dispatched_at` is the project's render_dispatched_at when the task was
+    sent; a message redelivered by the broker after the project was
+    dispatched again (see scheduling.recover_stuck_renders) or finished is dropped.
+    Stops within a second when the project is cancelled or deleted.
+    """
     try:
         project = Project.objects.get(id=project_id)
-        project.status = Project.Status.PROCESSING
+        if dispatched_at and not _is_current_run(project, dispatched_at):
+            return f"Project {project_id}: stale render task dropped"
+        # A retry of a partially ready project keeps showing its first pages
+        if project.status != Project.Status.PARTIAL:
+            project.status = Project.Status.PROCESSING
+        project.processing_attempts += 1
+        project.render_chunks_waiting = 0
         project.processing_started_at = timezone.now()
+        project.progress_stage = STAGE_DOWNLOADING
+        project.pages_rendered = project.pages_uploaded = 0
+        project.progress_updated_at = project.processing_started_at
         project.save()
+        if project.render_queued_at:
+            logger.info(
+                f"Project {project.id}: started after waiting "
+                f"{(project.processing_started_at - project.render_queued_at).total_seconds():.0f}s "
+                f"in the {project.render_lane or 'standard'} lane"
+            )
+        
+        # The same PDF was rendered with the same settings before: copy its pages
+        cached_pages = pages_from_render_cache(project)
+        if cached_pages:
+            total_pages = _finish_project(project, cached_pages)
+            return f"Processed {total_pages} pages for project {project.id} (from render cache)"
         
         # Create pages directory
         pages_dir = project.pages_directory
         os.makedirs(pages_dir, exist_ok=True)
         
         # Convert PDF to images using pdftoppm
-        # Always use S3-compatible method (read from storage)
-        pdf_content = project.pdf_file.read()
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pdf') as tmp_pdf:
-            tmp_pdf.write(pdf_content)
-            pdf_path = tmp_pdf.name
-        
-        output_prefix = os.path.join(pages_dir, 'pdf-page')
-        
-        # Run pdftoppm
-        result = subprocess.run(
-            ['pdftoppm', '-jpeg', '-r', '150', pdf_path, output_prefix],
-            capture_output=True,
-            text=True
-        )
-        
-        # Clean up temp PDF file
-        if os.path.exists(pdf_path):
-            try:
-                os.unlink(pdf_path)
-            except:
-                pass
-        
-        if result.returncode != 0:
-            raise Exception(f"pdftoppm failed: {result.stderr}")
-        
-        # Find generated images (from pdftoppm)
-        # pdftoppm creates files like: pdf-page-001.jpg, pdf-page-002.jpg, etc.
-        page_files = sorted([f for f in os.listdir(pages_dir) if f.startswith('pdf-page') and f.endswith('.jpg')])
-        
-        # If no files with 'pdf-page' prefix, try 'page' prefix (fallback)
-        if not page_files:
-            page_files = sorted([f for f in os.listdir(pages_dir) if f.startswith('page') and f.endswith('.jpg')])
-        pdf_page_count = len(page_files)
-        
-        if pdf_page_count == 0:
-            raise Exception("No pages generated")
-        
-        # Analyze pages to detect landscape orientation and split if needed
-        # Strategy:
-        # 1. First page (cover) is always treated as one page, even if landscape
-        # 2. Pages 2+ that are landscape (width > height) are split into 2 pages (left and right)
-        
-        pages_data = []
-        flipbook_page_number = 1
-        
-        for pdf_page_idx, page_file in enumerate(page_files, start=1):
-            page_path = os.path.join(pages_dir, page_file)
+        pdf_path = fetch_source_pdf(project)
+        try:
+            set_stage(project.id, STAGE_ANALYSING)
+            if project.pdf_info is None:
+                # Not scanned at upload time (uploaded directly to storage, or before pre-flight existed)
+                apply_preflight(project, preflight_pdf(pdf_path))
+                project.save(update_fields=['pdf_info', 'render_cost', 'total_pages'])
             
-            # Get image dimensions
-            with Image.open(page_path) as img:
-                width, height = img.size
-                aspect_ratio = width / height if height > 0 else 1
+            if not project.pdf_sha256:
+                # Not hashed at upload time (same cases); hash it now and try the render cache again
+                project.pdf_sha256 = file_sha256(pdf_path)
+                project.save(update_fields=['pdf_sha256'])
+                remember_sha256(pdf_path, project.pdf_sha256)
+                cached_pages = pages_from_render_cache(project)
+                if cached_pages:
+                    shutil.rmtree(pages_dir, ignore_errors=True)
+                    total_pages = _finish_project(project, cached_pages)
+                    return f"Processed {total_pages} pages for project {project.id} (from render cache)"
             
-            is_cover = (pdf_page_idx == 1)
-            is_landscape = aspect_ratio > 1.2  # Threshold: width is 20% larger than height
+            pdf_page_count = project.pdf_info['pdf_pages']
             
-            if is_cover:
-                # Cover is always one page, even if landscape
-                # Upload as single page (always use S3-compatible storage)
-                with open(page_path, 'rb') as f:
-                    file_content = f.read()
-                    project_page = ProjectPage(
-                        project=project,
-                        page_number=flipbook_page_number,
-                        width=width,
-                        height=height
-                    )
-                    project_page.image_file.save(f'page-{flipbook_page_number:03d}.jpg', ContentFile(file_content), save=False)
-                    project_page.save()
-                
-                pages_data.append({
-                    'page_number': flipbook_page_number,
-                    'file': f'page-{flipbook_page_number:03d}.jpg',
-                    'width': width,
-                    'height': height
-                })
-                flipbook_page_number += 1
-                
-            elif is_landscape:
-                # Landscape pages (except cover) are split into 2 pages
-                # Left half and right half
-                with Image.open(page_path) as img:
-                    # Split into left and right halves
-                    left_half = img.crop((0, 0, width // 2, height))
-                    right_half = img.crop((width // 2, 0, width, height))
-                    
-                    # Save left half
-                    left_filename = f'page-{flipbook_page_number:03d}.jpg'
-                    left_path = os.path.join(pages_dir, left_filename)
-                    left_half.save(left_path, 'JPEG', quality=95)
-                    
-                    # Save right half
-                    right_filename = f'page-{flipbook_page_number + 1:03d}.jpg'
-                    right_path = os.path.join(pages_dir, right_filename)
-                    right_half.save(right_path, 'JPEG', quality=95)
-                
-                # Upload left half (always use S3-compatible storage)
-                left_width = width // 2
-                left_height = height
-                with open(left_path, 'rb') as f:
-                    file_content = f.read()
-                    project_page = ProjectPage(
-                        project=project,
-                        page_number=flipbook_page_number,
-                        width=left_width,
-                        height=left_height
-                    )
-                    project_page.image_file.save(left_filename, ContentFile(file_content), save=False)
-                    project_page.save()
-                
-                pages_data.append({
-                    'page_number': flipbook_page_number,
-                    'file': left_filename,
-                    'width': left_width,
-                    'height': left_height
-                })
-                flipbook_page_number += 1
-                
-                # Upload right half (always use S3-compatible storage)
-                right_width = width - (width // 2)
-                right_height = height
-                with open(right_path, 'rb') as f:
-                    file_content = f.read()
-                    project_page = ProjectPage(
-                        project=project,
-                        page_number=flipbook_page_number,
-                        width=right_width,
-                        height=right_height
-                    )
-                    project_page.image_file.save(right_filename, ContentFile(file_content), save=False)
-                    project_page.save()
-                
-                pages_data.append({
-                    'page_number': flipbook_page_number,
-                    'file': right_filename,
-                    'width': right_width,
-                    'height': right_height
-                })
-                flipbook_page_number += 1
-                
+            # When the PDF was replaced, pages whose content did not change are kept as they are,
+            # and so are pages a crashed earlier run of this render stored already
+            fingerprints, reused = _plan_reuse(project, pdf_path, pdf_page_count)
+            reused.update(_load_checkpoints(
+                project, fingerprints, [number for number in range(1, pdf_page_count + 1) if number not in reused]
+            ))
+            pdf_pages = [number for number in range(1, pdf_page_count + 1) if number not in reused]
+            filename_for = _fingerprint_filename(fingerprints)
+            
+            # Reused pages count as done from the start
+            set_stage(project.id, STAGE_RENDERING)
+            tracker = ProgressTracker(project.id)
+            reused_pieces = sum(len(stored) for stored in reused.values())
+            tracker.rendered(reused_pieces)
+            tracker.uploaded(reused_pieces)
+            tracker.flush()
+            
+            # Long documents show their cover and first spreads while the rest is rendered
+            partial = not reused and _wants_partial(project)
+            lead_pages = settings.PDF_PARTIAL_PAGES if partial else 0
+            
+            # Large documents can be fanned out over the whole worker cluster
+            chunk_pages = settings.PDF_DISTRIBUTED_CHUNK_PAGES
+            if chunk_pages and len(pdf_pages) > chunk_pages:
+                chunks = []
+                for first, last in split_page_ranges(1, pdf_page_count, 1, chunk_pages):
+                    chunk_pdf_pages = [number for number in pdf_pages if first <= number <= last]
+                    if not chunk_pdf_pages:
+                        continue
+                    chunk_fingerprints = {number: fingerprints[number] for number in chunk_pdf_pages}
+                    chunks.append(render_pdf_chunk_task.s(
+                        project.id, first, last, chunk_pdf_pages, chunk_fingerprints, partial=partial and first == 1,
+                        dispatched_at=dispatched_at
+                    ))
+                # Until every chunk has started, a render without progress is waiting for workers, not stuck
+                Project.objects.filter(pk=project.pk).update(
+                    render_chunks_waiting=len(chunks), progress_updated_at=timezone.now()
+                )
+                chord(chunks)(
+                    finalize_pdf_task.s(project.id, reused, fingerprints, dispatched_at=dispatched_at)
+                    .on_error(pdf_chunk_failed_task.s(project.id, dispatched_at))
+                )
+                return f"Dispatched {len(chunks)} render chunks for project {project.id}"
+            
+            # Render page ranges in parallel (one pdftoppm process per range)
+            # pdftoppm creates files like: pdf-page-001.jpg, pdf-page-002.jpg, etc.
+            if settings.PDF_RENDER_PIPELINE:
+                # Stream pages into analysis/upload while later ranges are still rendering
+                rendered_pieces = iter_rendered_pieces(
+                    pdf_path, pages_dir, last_page=pdf_page_count,
+                    max_chunk_pages=settings.PDF_PIPELINE_CHUNK_PAGES, pdf_pages=pdf_pages, lead_pages=lead_pages
+                )
             else:
-                # Portrait page - use as is (always use S3-compatible storage)
-                with open(page_path, 'rb') as f:
-                    file_content = f.read()
-                    project_page = ProjectPage(
-                        project=project,
-                        page_number=flipbook_page_number,
-                        width=width,
-                        height=height
-                    )
-                    project_page.image_file.save(f'page-{flipbook_page_number:03d}.jpg', ContentFile(file_content), save=False)
-                    project_page.save()
-                
-                pages_data.append({
-                    'page_number': flipbook_page_number,
-                    'file': f'page-{flipbook_page_number:03d}.jpg',
-                    'width': width,
-                    'height': height
-                })
-                flipbook_page_number += 1
+                rendered_pieces = rasterize_pdf(pdf_path, pages_dir, last_page=pdf_page_count, pdf_pages=pdf_pages)
+            
+            # Upload each flipbook page (always use S3-compatible storage)
+            pages, upload_stats = _process_rendered_pages(
+                project, pdf_path, rendered_pieces, filename_for=filename_for,
+                on_progress=_partial_publisher(project, fingerprints) if partial else None,
+                on_stored=_checkpointer(project, fingerprints), tracker=tracker
+            )
+            pages = _merge_reused_pages(pages, reused, fingerprints)
+        finally:
+            # Clean up temp PDF file
+            _remove_file(pdf_path)
         
-        # Total pages is now the flipbook page count (may be more than PDF pages if landscape pages were split)
-        total_pages = flipbook_page_number - 1
+        if not pages:
+            raise Exception("No pages generated")
         
-        # Clean up original PDF page files (they've been renamed or split)
-        for page_file in page_files:
-            original_path = os.path.join(pages_dir, page_file)
-            if os.path.exists(original_path):
-                # Delete original PDF page files (pdftoppm output)
-                # These have been processed and renamed/split in the loop above
-                try:
-                    os.remove(original_path)
-                except:
-                    pass
+        set_stage(project.id, STAGE_SAVING)
+        total_pages = _finish_project(project, pages)
         
-        # Update project
-        project.total_pages = total_pages
-        project.pages_json = {
-            'total_pages': total_pages,
-            'pages': pages_data
-        }
-        project.status = Project.Status.READY
-        project.processing_completed_at = timezone.now()
-        project.save()
+        # Clean up local page files (pdftoppm output and split halves)
+        shutil.rmtree(pages_dir, ignore_errors=True)
         
-        return f"Processed {total_pages} pages for project {project.id}"
+        return (
+            f"Processed {total_pages} pages for project {project.id} "
+            f"(upload: {_throughput(upload_stats):.1f} MB/s)"
+        )
     
     except Project.DoesNotExist:
         return f"Project {project_id} not found"
+    except Cancelled:
+        _clean_up_cancelled(project_id, project.pages_directory)
+        return f"Processing of project {project_id} cancelled"
     except Exception as e:
-        try:
-            project = Project.objects.get(id=project_id)
-            project.status = Project.Status.ERROR
-            project.error_message = str(e)
-            project.save()
-        except:
-            pass
+        _mark_project_failed(project_id, e)
         raise
 
 
+def _chunk_piece_filename(pdf_page_number, part, part_count, index):
+    suffix = f'-{part + 1}' if part_count > 1 else ''
+    return f'pdf-page-{pdf_page_number:04d}{suffix}.jpg'
+
+
+@shared_task(acks_late=True)
+@cancellable
+def render_pdf_chunk_task(project_id, first_page, last_page, pdf_pages=None, fingerprints=None, partial=False,
+                          dispatched_at=None):
+    """
+    Render, split and upload one page range of a project's PDF.
+
+    Flipbook page numbers are not known here (a landscape page earlier in the
+    document shifts everything after it), so pieces are uploaded under names
+    derived from their `fingerprints` (see _fingerprint_filename) and
+    numbered by finalize_pdf_task. Stored pieces are checkpointed; a
+    redelivered chunk only renders the pages of `pdf_pages` that are not
+    checkpointed yet.
+    The first chunk of a long document is rendered with `partial`: its
+    pages are numbered from 1 anyway, so they are made viewable as they
+    finish (see _partial_publisher).
+    Chunks of a render that was dispatched again or ended meanwhile render nothing.
+    """
+    project = Project.objects.get(id=project_id)
+    if not _is_current_run(project, dispatched_at):
+        logger.info(f"Project {project_id}: stale render chunk {first_page}-{last_page} dropped")
+        return []
+    Project.objects.filter(pk=project_id, render_chunks_waiting__gt=0).update(
+        render_chunks_waiting=F('render_chunks_waiting') - 1, progress_updated_at=timezone.now()
+    )
+    
+    # JSON task arguments turn the page number keys into strings
+    fingerprints = {int(number): value for number, value in (fingerprints or {}).items()}
+    filename_for = _fingerprint_filename(fingerprints) if fingerprints else _chunk_piece_filename
+    
+    pdf_pages = pdf_pages or list(range(first_page, last_page + 1))
+    checkpointed = _load_checkpoints(project, fingerprints, pdf_pages) if fingerprints else {}
+    checkpointed_pieces = [
+        dict(piece, pdf_page=pdf_page) for pdf_page, pieces in checkpointed.items() for piece in pieces
+    ]
+    pdf_pages = [number for number in pdf_pages if number not in checkpointed]
+    if not pdf_pages:
+        return checkpointed_pieces
+    # Partial pages must be an uninterrupted run from the first page
+    partial = partial and not checkpointed
+    
+    pages_dir = os.path.join(project.pages_directory, f'chunk-{first_page:04d}-{last_page:04d}')
+    os.makedirs(pages_dir, exist_ok=True)
+    pdf_path = fetch_source_pdf(project)
+    try:
+        if partial:
+            rendered_pieces = iter_rendered_pieces(
+                pdf_path, pages_dir, first_page=first_page, last_page=last_page, pdf_pages=pdf_pages,
+                max_chunk_pages=settings.PDF_PIPELINE_CHUNK_PAGES, lead_pages=settings.PDF_PARTIAL_PAGES
+            )
+        else:
+            rendered_pieces = rasterize_pdf(
+                pdf_path, pages_dir, first_page=first_page, last_page=last_page, pdf_pages=pdf_pages
+            )
+        pieces, _ = _process_rendered_pages(
+            project, pdf_path, rendered_pieces, filename_for=filename_for,
+            on_progress=_partial_publisher(project, fingerprints) if partial else None,
+            on_stored=_checkpointer(project, fingerprints), tracker=ProgressTracker(project_id)
+        )
+    finally:
+        _remove_file(pdf_path)
+        shutil.rmtree(pages_dir, ignore_errors=True)
+    
+    return pieces + checkpointed_pieces
+
+
+@shared_task(acks_late=True)
+def finalize_pdf_task(chunk_results, project_id, reused=None, fingerprints=None, dispatched_at=None):
+    """
+    Chord callback: number the pieces of all chunks and mark the project as ready
+
+    The chord of a render that was dispatched again meanwhile is dropped; its
+    stored pieces are checkpointed, the current render keeps them. If the
+    project was cancelled, deleted or failed meanwhile, the pieces are deleted.
+    """
+    project = Project.objects.filter(id=project_id).first()
+    # Cancelled, deleted or ended otherwise: nothing will use the pieces
+    if cancel_requested(project_id) or project is None or not _is_current_run(project, None):
+        _discard_pieces(Project(id=project_id), [piece for chunk in chunk_results for piece in chunk])
+        _clean_up_cancelled(project_id)
+        return f"Processing of project {project_id} cancelled"
+    if not _is_current_run(project, dispatched_at):
+        return f"Project {project_id}: stale render chord dropped"
+    try:
+        # Resolve flipbook page numbers across chunks: order by PDF page, then left/right part
+        # (JSON task arguments turn the page number keys into strings)
+        pieces = _merge_reused_pages(
+            [piece for chunk in chunk_results for piece in chunk],
+            {int(number): stored for number, stored in (reused or {}).items()},
+            {int(number): value for number, value in (fingerprints or {}).items()}
+        )
+        if not pieces:
+            raise Exception("No pages generated")
+        
+        set_stage(project.id, STAGE_SAVING)
+        total_pages = _finish_project(project, pieces)
+        shutil.rmtree(project.pages_directory, ignore_errors=True)
+        return f"Processed {total_pages} pages for project {project.id}"
+    
+    except Cancelled:
+        _clean_up_cancelled(project_id, project.pages_directory)
+        return f"Processing of project {project_id} cancelled"
+    except Exception as e:
+        _mark_project_failed(project_id, e)
+        raise
+
+
+@shared_task
+def dispatch_renders_task():
+    """Periodic task: start waiting renders whose owners have a free slot (normally done when a render ends)"""
+    dispatched = dispatch_renders()
+    return f"Dispatched {dispatched} waiting renders"
+
+
+@shared_task
+def recover_stuck_renders_task():
+    """Periodic task: re-queue renders whose worker died (they continue from their checkpointed pages)"""
+    recovered = recover_stuck_renders()
+    return f"Re-queued {recovered} stuck renders"
+
+
+@shared_task
+def expire_direct_uploads_task():
+    """Periodic task: abort direct uploads the browser never completed"""
+    aborted = expire_uploads()
+    return f"Aborted {aborted} expired direct uploads"
+
+
+@shared_task
+def expire_upload_sessions_task():
+    """Periodic task: delete resumable uploads that were abandoned"""
+    expired = expire_sessions()
+    return f"Deleted {expired} expired upload sessions"
+
+
+@shared_task
+def collect_page_blobs_task():
+    """Periodic task: delete content-addressed page objects that no page references any more"""
+    deleted = collect_unused_blobs()
+    return f"Deleted {deleted} unused page blobs"
+
+
 @shared_task
+def pdf_chunk_failed_task(request, exc, traceback, project_id, dispatched_at=None):
+    """Chord error handler: a render chunk failed (or was cancelled), so the project cannot be completed"""
+    if cancel_requested(project_id):
+        _clean_up_cancelled(project_id)
+        return
+    project = Project.objects.filter(id=project_id).first()
+    if project is None or not _is_current_run(project, dispatched_at):
+        return  # A stale chord, the current render goes on
+    _mark_project_failed(project_id, exc)
+
+
+def _publish_file(storage, name, content):
+    """Save a published file under exactly `name`, replacing an earlier version (the storage would rename it)"""
+    def publish():
+        content.seek(0)
+        if storage.exists(name):
+            storage.delete(name)
+        return storage.save(name, content)
+    return with_retries(publish, f"Publishing {name}")
+
+
+def _delete_published_files(storage, path):
+    """Delete everything published below `path`"""
+    directories, files = storage.listdir(path)
+    for name in files:
+        storage.delete(f'{path}/{name}')
+    for directory in directories:
+        _delete_published_files(storage, f'{path}/{directory}')
+
+
+@shared_task(acks_late=True)
+@cancellable
 def publish_flipbook_task(project_id):
-    """Publish flipbook to public directory (local or S3)"""
+    """
+    Publish flipbook to public directory (local or S3)
+
+    Stops between pages when the project is deleted, and removes what it published then.
+    """
     try:
         project = Project.objects.get(id=project_id)
         
@@ -243,19 +1064,39 @@ def publish_flipbook_task(project_id):
         # Base path for published files
         base_path = f"customer-{project.user.id}-projekt-{project.published_slug}"
         
-        # Upload pages
+        # Upload pages (published copies of pages whose content did not change since the last publish are kept)
         for page in project.pages.all().order_by('page_number'):
+            check()
+            if page.fingerprint and page.published_fingerprint == page.fingerprint:
+                continue
             if page.image_file:
                 # Read image file (always use S3-compatible method)
                 image_content = page.image_file.read()
                 
                 # Upload to S3
-                s3_path = f"{base_path}/pages/page-{page.page_number:03d}.jpg"
-                storage.save(s3_path, ContentFile(image_content))
+                page_file = f"page-{page.page_number:03d}.jpg"
+                s3_path = f"{base_path}/pages/{page_file}"
+                _publish_file(storage, s3_path, ContentFile(image_content))
+                
+                # Upload renditions and the optimized encoding under the names referenced in pages.json
+                for key, rendition in page.renditions.items():
+                    with page.image_file.storage.open(rendition['name'], 'rb') as f:
+                        _publish_file(storage, f"{base_path}/pages/{rendition_filename(page_file, key)}", ContentFile(f.read()))
+                if page.optimized_image:
+                    with page.image_file.storage.open(page.optimized_image['name'], 'rb') as f:
+                        optimized_file = format_filename(page_file, page.optimized_image['format'])
+                        _publish_file(storage, f"{base_path}/pages/{optimized_file}", ContentFile(f.read()))
+                if page.tiles:
+                    published_base = f"{base_path}/pages/{tile_base(page_file)}"
+                    for name, published_name in zip(
+                        iter_tile_paths(page.tiles), iter_tile_paths(page.tiles, base=published_base)
+                    ):
+                        with page.image_file.storage.open(name, 'rb') as f:
+                            _publish_file(storage, published_name, ContentFile(f.read()))
         
         # Upload pages.json
         pages_json_content = json.dumps(project.pages_json, indent=2).encode('utf-8')
-        storage.save(f"{base_path}/pages.json", ContentFile(pages_json_content))
+        _publish_file(storage, f"{base_path}/pages.json", ContentFile(pages_json_content))
         
         # Upload logo to published storage (public) if exists
         logo_html = ''
@@ -267,7 +1108,7 @@ def publish_flipbook_task(project_id):
                 
                 # Upload to PublishedStorage (public)
                 logo_s3_path = f"{base_path}/{logo_filename}"
-                storage.save(logo_s3_path, ContentFile(logo_content))
+                _publish_file(storage, logo_s3_path, ContentFile(logo_content))
                 
                 # Get public URL for the logo
                 logo_url = storage.url(logo_s3_path)
@@ -294,7 +1135,7 @@ def publish_flipbook_task(project_id):
     <script src="app.js"></script>
 </body>
 </html>"""
-        storage.save(f"{base_path}/index.html", ContentFile(index_html.encode('utf-8')))
+        _publish_file(storage, f"{base_path}/index.html", ContentFile(index_html.encode('utf-8')))
         
         # Upload app.js and app.css from viewer source if exists
         viewer_source = os.path.join(settings.BASE_DIR.parent.parent, 'apps', 'frontend', 'public', 'viewer')
@@ -302,11 +1143,22 @@ def publish_flipbook_task(project_id):
             src = os.path.join(viewer_source, file)
             if os.path.exists(src):
                 with open(src, 'rb') as f:
-                    storage.save(f"{base_path}/{file}", ContentFile(f.read()))
+                    _publish_file(storage, f"{base_path}/{file}", ContentFile(f.read()))
+        
+        check()
+        project.pages.update(published_fingerprint=F('fingerprint'))
         
         return f"Published project {project.id} to S3: {project.published_slug}"
     
     except Project.DoesNotExist:
         return f"Project {project_id} not found"
+    except Cancelled:
+        if not Project.objects.filter(pk=project_id).exists():
+            # Deleted while publishing: remove the files written after perform_destroy cleaned up
+            try:
+                _delete_published_files(storage, base_path)
+            except Exception as e:
+                logger.warning(f"Could not delete published files of deleted project {project_id}: {e}")
+        return f"Publishing of project {project_id} cancelled"
     except Exception as e:
         raise
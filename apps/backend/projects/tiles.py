@@ -0,0 +1,94 @@
+"""
+Deep-zoom tile pyramids for page images (Deep Zoom / DZI layout)
+"""
+import math
+import os
+from PIL import Image
+
+# Tile file extension -> (PIL format name, content type)
+TILE_FORMATS = {
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+    'webp': ('WEBP', 'image/webp'),
+}
+
+
+def tile_base(filename):
+    """Directory name of the pyramid of a page image, e.g. page-001.jpg -> page-001_files"""
+    base, _ = os.path.splitext(filename)
+    return f'{base}_files'
+
+
+def pyramid_levels(width, height):
+    """
+    Level dimensions from 0 (1x1 px) to the full size, as [(level, width, height), ...]
+
+    Every level is half the size of the next one (rounded up), like Deep Zoom.
+    """
+    max_level = math.ceil(math.log2(max(width, height, 1)))
+    levels = []
+    for level in range(max_level + 1):
+        scale = 2 ** (max_level - level)
+        levels.append((level, math.ceil(width / scale), math.ceil(height / scale)))
+    return levels
+
+
+def tile_boxes(width, height, tile_size, overlap):
+    """Yield (col, row, box) for the tiles of one level; box includes the overlap"""
+    for col in range(math.ceil(width / tile_size)):
+        for row in range(math.ceil(height / tile_size)):
+            left = col * tile_size - (overlap if col else 0)
+            top = row * tile_size - (overlap if row else 0)
+            right = min((col + 1) * tile_size + overlap, width)
+            bottom = min((row + 1) * tile_size + overlap, height)
+            yield col, row, (left, top, right, bottom)
+
+
+def tile_path(base, level, col, row, tile_format):
+    """Relative path of one tile below the pyramid base, e.g. page-001_files/12/3_4.jpg"""
+    return f'{base}/{level}/{col}_{row}.{tile_format}'
+
+
+def iter_tile_paths(tiles, base=None):
+    """All tile paths of a pyramid descriptor (as stored by build_tile_pyramid)"""
+    base = base or tiles['base']
+    for level, width, height in pyramid_levels(tiles['width'], tiles['height']):
+        for col, row, _ in tile_boxes(width, height, tiles['tile_size'], tiles['overlap']):
+            yield tile_path(base, level, col, row, tiles['format'])
+
+
+def build_tile_pyramid(image_path, output_dir, tile_size, overlap, tile_format, quality):
+    """
+    Cut an image into a tile pyramid below output_dir.
+
+    Levels are built top-down by halving the previous level, so the full
+    resolution image is only decoded once.
+
+    Returns (descriptor, [(relative_path, file_path), ...]) where descriptor is
+    {'width', 'height', 'tile_size', 'overlap', 'format', 'levels'}.
+    """
+    tiles = []
+    with Image.open(image_path) as img:
+        level_image = img.convert('RGB')
+    width, height = level_image.size
+    levels = pyramid_levels(width, height)
+
+    for level, level_width, level_height in reversed(levels):
+        if level_image.size != (level_width, level_height):
+            level_image = level_image.resize((level_width, level_height), Image.LANCZOS)
+        level_dir = os.path.join(output_dir, str(level))
+        os.makedirs(level_dir, exist_ok=True)
+        for col, row, box in tile_boxes(level_width, level_height, tile_size, overlap):
+            path = os.path.join(level_dir, f'{col}_{row}.{tile_format}')
+            level_image.crop(box).save(path, TILE_FORMATS[tile_format][0], quality=quality)
+            tiles.append((f'{level}/{col}_{row}.{tile_format}', path))
+
+    descriptor = {
+        'width': width,
+        'height': height,
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'format': tile_format,
+        'levels': len(levels),
+    }
+    return descriptor, tiles
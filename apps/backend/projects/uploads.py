@@ -0,0 +1,134 @@
+"""
+Page image uploads to media storage (S3-compatible or local)
+"""
+import logging
+import os
+import random
+import threading
+import time
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+
+logger = logging.getLogger(__name__)
+
+_s3_client = None
+_s3_client_lock = threading.Lock()
+
+# S3 error codes worth another attempt besides 5xx responses
+TRANSIENT_ERROR_CODES = {'SlowDown', 'RequestTimeout', 'Throttling', 'ThrottlingException', 'InternalError'}
+
+
+def get_s3_client():
+    """
+    Return the process-wide boto3 S3 client used for page uploads.
+
+    boto3 clients are thread-safe, so all upload threads share one client and
+    its connection pool, which is sized to the number of upload workers.
+    """
+    global _s3_client
+    if _s3_client is None:
+        with _s3_client_lock:
+            if _s3_client is None:
+                import boto3
+                from botocore.config import Config
+
+                config = Config(
+                    max_pool_connections=max(settings.PAGE_UPLOAD_WORKERS, 10),
+                    retries={'max_attempts': settings.PAGE_UPLOAD_MAX_ATTEMPTS, 'mode': 'standard'},
+                    signature_version=settings.AWS_S3_SIGNATURE_VERSION,
+                    s3={'addressing_style': settings.AWS_S3_ADDRESSING_STYLE},
+                )
+                endpoint = settings.AWS_S3_ENDPOINT_URL
+                _s3_client = boto3.client(
+                    's3',
+                    aws_access_key_id=settings.AWS_ACCESS_KEY_ID,
+                    aws_secret_access_key=settings.AWS_SECRET_ACCESS_KEY,
+                    region_name=settings.AWS_S3_REGION_NAME,
+                    endpoint_url=endpoint.strip() if endpoint and endpoint.strip() else None,
+                    config=config,
+                )
+    return _s3_client
+
+
+def is_transient_error(error):
+    """Whether a storage error may go away on its own (server errors, throttling, network trouble)"""
+    from botocore.exceptions import ClientError, ConnectionError as BotoConnectionError, HTTPClientError
+
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return status >= 500 or error.response.get('Error', {}).get('Code') in TRANSIENT_ERROR_CODES
+    return isinstance(error, (BotoConnectionError, HTTPClientError, ConnectionError, TimeoutError))
+
+
+def with_retries(operation, description):
+    """
+    Run a storage operation and return its result, retrying transient errors.
+
+    botocore already retries each request a few times within seconds; this
+    covers longer hiccups (a throttled bucket, a restarting endpoint) with
+    PAGE_UPLOAD_RETRIES more attempts and exponential backoff with jitter,
+    so one object waits instead of the whole job failing.
+    """
+    for attempt in range(settings.PAGE_UPLOAD_RETRIES + 1):
+        try:
+            return operation()
+        except Exception as e:
+            if attempt >= settings.PAGE_UPLOAD_RETRIES or not is_transient_error(e):
+                raise
+            delay = settings.PAGE_UPLOAD_RETRY_DELAY * 2 ** attempt * random.uniform(0.5, 1)
+            logger.warning(f"{description} failed ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def upload_file(name, path, content_type='image/jpeg'):
+    """
+    Upload a local file to media storage under `name` and return (stored_name, size).
+
+    On S3 the body is streamed from the open file handle (no in-memory copy)
+    and failed requests are retried (see with_retries). The key is written as is;
+    page names are unique per project, so reprocessing overwrites in place.
+    """
+    size = os.path.getsize(path)
+
+    def upload():
+        with open(path, 'rb') as f:
+            if settings.USE_S3:
+                get_s3_client().put_object(
+                    Bucket=settings.AWS_STORAGE_BUCKET_NAME.strip(),
+                    Key=name,
+                    Body=f,
+                    ContentLength=size,
+                    ContentType=content_type,
+                    ACL='private',  # Same as MediaStorage.default_acl
+                    **settings.AWS_S3_OBJECT_PARAMETERS
+                )
+                return name
+            # Overwrite like S3 does instead of picking an alternative name
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            return default_storage.save(name, File(f))
+    return with_retries(upload, f"Upload of {name}"), size
+
+
+def copy_file(source_name, name):
+    """
+    Copy a media storage object to `name` and return the stored name.
+
+    On S3 the copy happens server side, nothing is downloaded.
+    """
+    def copy():
+        if settings.USE_S3:
+            bucket = settings.AWS_STORAGE_BUCKET_NAME.strip()
+            get_s3_client().copy_object(
+                Bucket=bucket,
+                Key=name,
+                CopySource={'Bucket': bucket, 'Key': source_name},
+                ACL='private',  # Same as MediaStorage.default_acl
+            )
+            return name
+        with default_storage.open(source_name, 'rb') as f:
+            if default_storage.exists(name):
+                default_storage.delete(name)
+            return default_storage.save(name, File(f))
+    return with_retries(copy, f"Copy of {source_name} to {name}")
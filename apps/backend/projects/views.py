@@ -1,9 +1,11 @@
-from rest_framework import viewsets, status, permissions
+from rest_framework import viewsets, status, permissions, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.conf import settings
-from django.http import FileResponse, Http404
+from django.http import FileResponse, Http404, HttpResponseRedirect
+from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.db import transaction
 import os
 import zipfile
 import shutil
@@ -12,9 +14,23 @@ import io
 import tempfile
 import logging
 
-from .models import Project, ProjectPage
-from .serializers import ProjectSerializer, ProjectCreateSerializer
-from .tasks import process_pdf_task
+from .models import Project, ProjectPage, UploadSession, rendition_filename
+from .formats import format_filename
+from .tiles import tile_base, iter_tile_paths, pyramid_levels, tile_path
+from .blobs import update_blob_refs, is_blob_name
+from .render_cache import upload_sha256
+from .preflight import PreflightError, apply_preflight
+from .serializers import (
+    ProjectSerializer, ProjectCreateSerializer, ProjectStatusSerializer,
+    DirectUploadFileSerializer, DirectUploadStartSerializer, DirectUploadCompleteSerializer,
+    UploadSessionStartSerializer
+)
+from . import direct_uploads
+from .direct_uploads import DirectUploadError
+from . import resumable_uploads
+from .resumable_uploads import OffsetMismatch, UploadSessionError
+from .scheduling import schedule_render, cancel_render
+from .cancellation import request_cancel
 
 logger = logging.getLogger(__name__)
 
@@ -38,17 +54,24 @@ class ProjectViewSet(viewsets.ModelViewSet):
     
     def perform_create(self, serializer):
         project = serializer.save()
-        # Start async processing
-        process_pdf_task.delay(project.id)
+        # Start async processing (queued while the user has RENDER_MAX_PER_USER renders running)
+        schedule_render(project)
     
     def perform_destroy(self, instance):
         """Delete project and all associated files"""
         logger.info(f"Deleting project {instance.slug} (ID: {instance.id})")
         
+        # Stop running processing or publishing; the worker deletes what it stores after this point
+        request_cancel(instance.id)
+        
         # Delete all associated files from S3
         try:
             from .storage import MediaStorage, PublishedStorage
             
+            # Abort an unfinished direct upload (S3 deletes its parts)
+            if instance.upload_id:
+                direct_uploads.abort_upload(instance)
+            
             # Delete PDF file
             if instance.pdf_file:
                 try:
@@ -69,16 +92,18 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 except Exception as e:
                     logger.warning(f"Failed to delete published logo: {e}")
             
-            # Delete all page images
-            for page in instance.pages.all():
-                if page.image_file:
-                    try:
-                        media_storage = MediaStorage()
-                        if page.image_file.name:
-                            media_storage.delete(page.image_file.name)
-                            logger.info(f"Deleted page image: {page.image_file.name}")
-                    except Exception as e:
-                        logger.warning(f"Failed to delete page image {page.page_number}: {e}")
+            # Delete all page images (including renditions and pages checkpointed by an unfinished run);
+            # shared blobs only lose a reference and are deleted by collect_page_blobs_task once no project uses them
+            pages = list(instance.pages.all()) + [checkpoint.as_page() for checkpoint in instance.page_checkpoints.all()]
+            for name in {name for page in pages for name in page.storage_names()}:
+                if is_blob_name(name):
+                    continue
+                try:
+                    media_storage = MediaStorage()
+                    media_storage.delete(name)
+                    logger.info(f"Deleted page image: {name}")
+                except Exception as e:
+                    logger.warning(f"Failed to delete page image {name}: {e}")
             
             # Delete published files if project is published
             if instance.is_published and instance.published_slug:
@@ -99,7 +124,17 @@ class ProjectViewSet(viewsets.ModelViewSet):
                         
                         # Add page images
                         for page in instance.pages.all():
-                            files_to_delete.append(f"{base_path}/pages/page-{page.page_number:03d}.jpg")
+                            page_file = f"page-{page.page_number:03d}.jpg"
+                            files_to_delete.append(f"{base_path}/pages/{page_file}")
+                            for key in page.renditions:
+                                files_to_delete.append(f"{base_path}/pages/{rendition_filename(page_file, key)}")
+                            if page.optimized_image:
+                                optimized_file = format_filename(page_file, page.optimized_image['format'])
+                                files_to_delete.append(f"{base_path}/pages/{optimized_file}")
+                            if page.tiles:
+                                files_to_delete.extend(iter_tile_paths(
+                                    page.tiles, base=f"{base_path}/pages/{tile_base(page_file)}"
+                                ))
                         
                         # Add logo if exists
                         if instance.published_logo:
@@ -123,9 +158,43 @@ class ProjectViewSet(viewsets.ModelViewSet):
             # Continue with deletion even if file deletion fails
         
         # Delete the project (this will cascade delete ProjectPage objects via CASCADE)
-        instance.delete()
+        with transaction.atomic():
+            update_blob_refs([name for page in instance.pages.all() for name in page.storage_names()], [])
+            instance.delete()
         logger.info(f"Project {instance.slug} deleted successfully")
     
+    @action(detail=True, methods=['get'], url_path='status')
+    def processing_status(self, request, slug=None):
+        """Processing progress (stage, pages rendered/uploaded); reads one project row, cheap to poll"""
+        project = get_object_or_404(
+            self.get_queryset().only(*ProjectStatusSerializer.Meta.fields), slug=slug
+        )
+        return Response(ProjectStatusSerializer(project).data)
+    
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, slug=None):
+        """Cancel the processing of a project; a running render stops within a second"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if project.upload_id or project.status not in (
+            Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL
+        ):
+            return Response(
+                {'error': 'Project is not being processed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        cancel_render(project)
+        project.refresh_from_db()
+        serializer = self.get_serializer(project, context={'request': request})
+        return Response(serializer.data)
+    
     @action(detail=True, methods=['get'])
     def preview(self, request, slug=None):
         """Preview flipbook (only for owner)"""
@@ -137,7 +206,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        if project.status != Project.Status.READY:
+        if project.status not in (Project.Status.READY, Project.Status.PARTIAL):
             return Response(
                 {'error': 'Project not ready'},
                 status=status.HTTP_400_BAD_REQUEST
@@ -147,6 +216,305 @@ class ProjectViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(project, context={'request': request})
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], url_path=r'tiles/(?P<page_number>\d+)/(?P<level>\d+)/(?P<col>\d+)_(?P<row>\d+)')
+    def tiles(self, request, slug=None, page_number=None, level=None, col=None, row=None):
+        """Redirect to one deep-zoom tile of a page (only for owner)"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        page = project.pages.filter(page_number=int(page_number)).first()
+        if not page or not page.tiles:
+            raise Http404("Page has no tiles")
+        
+        level, col, row = int(level), int(col), int(row)
+        levels = pyramid_levels(page.tiles['width'], page.tiles['height'])
+        if level >= len(levels):
+            raise Http404("Tile not found")
+        _, level_width, level_height = levels[level]
+        tile_size = page.tiles['tile_size']
+        if col * tile_size >= level_width or row * tile_size >= level_height:
+            raise Http404("Tile not found")
+        
+        name = tile_path(page.tiles['base'], level, col, row, page.tiles['format'])
+        url = page.image_file.storage.url(name)
+        if not (url.startswith('http://') or url.startswith('https://')):
+            url = request.build_absolute_uri(url)
+        return HttpResponseRedirect(url)
+    
+    @action(detail=True, methods=['post'])
+    def replace_pdf(self, request, slug=None):
+        """Replace the PDF of a project; only pages whose content changed are rendered again"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if project.status in (Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL):
+            return Response(
+                {'error': 'Project is still being processed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        pdf_file = request.FILES.get('pdf_file')
+        if not pdf_file:
+            return Response(
+                {'error': 'pdf_file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        create_serializer = ProjectCreateSerializer()
+        try:
+            create_serializer.validate_pdf_file(pdf_file)
+        except serializers.ValidationError as e:
+            return Response(
+                {'error': e.detail[0]},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        self._replace_pdf_file(project, pdf_file, upload_sha256(pdf_file), create_serializer.preflight)
+        
+        # Existing pages stay in place until processing has finished
+        schedule_render(project)
+        
+        serializer = self.get_serializer(project, context={'request': request})
+        return Response(serializer.data)
+    
+    def _replace_pdf_file(self, project, pdf_file, pdf_sha256, preflight):
+        """Store a checked PDF as the project's PDF and delete the old one"""
+        old_pdf_name = project.pdf_file.name
+        project.pdf_file = pdf_file
+        project.pdf_sha256 = pdf_sha256
+        apply_preflight(project, preflight)
+        project.status = Project.Status.UPLOADING
+        project.error_message = ''
+        project.save()
+        
+        if old_pdf_name and old_pdf_name != project.pdf_file.name:
+            try:
+                project.pdf_file.storage.delete(old_pdf_name)
+            except Exception as e:
+                logger.warning(f"Could not delete replaced PDF {old_pdf_name}: {e}")
+    
+    def _direct_upload_unavailable(self):
+        return Response(
+            {'error': 'Direct uploads are not available, upload the PDF with the form', 'code': 'direct_upload_unavailable'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    @action(detail=False, methods=['post'], url_path='upload/start')
+    def start_upload(self, request):
+        """
+        Create a project and return presigned URLs to upload its PDF straight to storage.
+        
+        The client PUTs the parts to the returned URLs and then calls upload/complete/
+        with the ETag of each part; processing starts from there.
+        """
+        if not direct_uploads.direct_uploads_enabled():
+            return self._direct_upload_unavailable()
+        serializer = DirectUploadStartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        project = Project(
+            user=request.user, title=data['title'], description=data['description'],
+            status=Project.Status.UPLOADING
+        )
+        try:
+            with transaction.atomic():
+                project.save()
+                upload = direct_uploads.start_upload(project, data['filename'], data['size'])
+        except DirectUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(dict(upload, slug=project.slug), status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['post'], url_path='upload/replace')
+    def start_replace_upload(self, request, slug=None):
+        """Like replace_pdf, but the new PDF is uploaded straight to storage (finish with upload/complete/)"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if project.status in (Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL):
+            return Response(
+                {'error': 'Project is still being processed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not direct_uploads.direct_uploads_enabled():
+            return self._direct_upload_unavailable()
+        serializer = DirectUploadFileSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        try:
+            upload = direct_uploads.start_upload(project, data['filename'], data['size'])
+        except DirectUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(dict(upload, slug=project.slug))
+    
+    @action(detail=True, methods=['post'], url_path='upload/complete')
+    def complete_upload(self, request, slug=None):
+        """Assemble the directly uploaded PDF and start processing it"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        serializer = DirectUploadCompleteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            direct_uploads.complete_upload(project, serializer.validated_data['parts'])
+        except DirectUploadError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Content checks (pre-flight) and hashing happen in the worker
+        schedule_render(project)
+        
+        serializer = self.get_serializer(project, context={'request': request})
+        return Response(serializer.data)
+    
+    @action(detail=True, methods=['post'], url_path='upload/abort')
+    def abort_upload(self, request, slug=None):
+        """Abort a direct upload; a project created for it (without a PDF yet) is deleted"""
+        project = self.get_object()
+        
+        if project.user != request.user and not request.user.is_admin:
+            return Response(
+                {'error': 'Permission denied'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        
+        if project.upload_id:
+            direct_uploads.abort_upload(project)
+        if not project.pdf_file.name:
+            project.delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    @action(detail=False, methods=['post'], url_path='uploads/start')
+    def start_upload_session(self, request):
+        """
+        Open a resumable upload for a new project (title, description) or a replacement PDF (project).
+        
+        The client sends the file in chunks with PATCH uploads/<id>/ (raw bytes, Upload-Offset
+        header), asks for the current offset with GET uploads/<id>/ after an interruption and
+        finishes with POST uploads/<id>/complete/.
+        """
+        serializer = UploadSessionStartSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        
+        project = None
+        if data.get('project'):
+            project = get_object_or_404(self.get_queryset(), slug=data['project'])
+            if project.user != request.user and not request.user.is_admin:
+                return Response(
+                    {'error': 'Permission denied'},
+                    status=status.HTTP_403_FORBIDDEN
+                )
+            if project.status in (Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL):
+                return Response(
+                    {'error': 'Project is still being processed'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        elif not data.get('title'):
+            return Response(
+                {'title': ['This field is required.']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            session = resumable_uploads.start_session(
+                request.user, data['filename'], data['size'], title=data.get('title', ''),
+                description=data['description'], project=project
+            )
+        except UploadSessionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            {'id': session.id, 'offset': 0, 'size': session.size, 'chunk_size': settings.UPLOAD_CHUNK_MAX_MB * 1024 * 1024},
+            status=status.HTTP_201_CREATED
+        )
+    
+    @action(detail=False, methods=['get', 'patch', 'delete'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]{36})')
+    def upload_session(self, request, upload_id=None):
+        """Offset of a resumable upload (GET), append a chunk (PATCH) or cancel it (DELETE)"""
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        
+        if request.method == 'DELETE':
+            resumable_uploads.discard_session(session)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        
+        if request.method == 'PATCH':
+            try:
+                offset = int(request.META['HTTP_UPLOAD_OFFSET'])
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except (KeyError, ValueError):
+                return Response(
+                    {'error': 'Upload-Offset header and Content-Length are required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            try:
+                # Read the raw body as a stream, never request.data
+                session.received = resumable_uploads.append_chunk(session, offset, request.stream, length)
+            except OffsetMismatch as e:
+                return Response({'error': str(e), 'offset': e.offset}, status=status.HTTP_409_CONFLICT)
+            except UploadSessionError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({'id': session.id, 'offset': session.received, 'size': session.size})
+    
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]{36})/complete')
+    def complete_upload_session(self, request, upload_id=None):
+        """Check the assembled PDF, create or update the project and start processing"""
+        session = get_object_or_404(UploadSession, pk=upload_id, user=request.user)
+        project = session.project
+        if project and project.status in (Project.Status.UPLOADING, Project.Status.PROCESSING, Project.Status.PARTIAL):
+            return Response(
+                {'error': 'Project is still being processed'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            pdf_file, pdf_sha256, preflight = resumable_uploads.complete_session(session)
+        except UploadSessionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except PreflightError as e:
+            # The file will not get better by uploading more of it
+            resumable_uploads.discard_session(session)
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            if project:
+                self._replace_pdf_file(project, pdf_file, pdf_sha256, preflight)
+            else:
+                project = Project(
+                    user=request.user, title=session.title, description=session.description,
+                    status=Project.Status.UPLOADING, pdf_sha256=pdf_sha256, pdf_file=pdf_file
+                )
+                project._user_id = request.user.id
+                apply_preflight(project, preflight)
+                project.save()
+        finally:
+            pdf_file.close()
+        resumable_uploads.discard_session(session)
+        
+        schedule_render(project)
+        
+        serializer = self.get_serializer(project, context={'request': request})
+        return Response(serializer.data, status=status.HTTP_200_OK if session.project_id else status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['get'])
     def download_pdf(self, request, slug=None):
         """Download original PDF file (requires payment, except from viewer)"""
@@ -180,11 +548,9 @@ class ProjectViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            # Return PDF file directly
-            # Always use S3-compatible method (read from storage)
-            pdf_content = project.pdf_file.read()
+            # Return PDF file directly, streamed from storage in blocks
             response = FileResponse(
-                io.BytesIO(pdf_content),
+                project.pdf_file.open('rb'),
                 as_attachment=True,
                 filename=f"{project.slug}.pdf"
             )
@@ -252,7 +618,12 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 # This is included for compatibility, but the HTML doesn't require it
                 if project.pages_json:
                     import json
-                    zipf.writestr('pages.json', json.dumps(project.pages_json, indent=2))
+                    # Only the JPEG page images are in the ZIP: leave out renditions, other formats and tiles
+                    exported_pages = [
+                        {key: page[key] for key in ('page_number', 'file', 'width', 'height') if key in page}
+                        for page in project.pages_json.get('pages', [])
+                    ]
+                    zipf.writestr('pages.json', json.dumps(dict(project.pages_json, pages=exported_pages), indent=2))
                     logger.info(f"Added pages.json to ZIP for project {project.slug}")
                 else:
                     logger.warning(f"No pages_json found for project {project.slug}")
@@ -637,6 +1008,8 @@ class ProjectViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_402_PAYMENT_REQUIRED
             )
         
+        old_published_slug = project.published_slug
+        
         # Handle logo upload if provided
         if 'published_logo' in request.FILES:
             project.published_logo = request.FILES['published_logo']
@@ -666,6 +1039,10 @@ class ProjectViewSet(viewsets.ModelViewSet):
             # Generate published slug if not exists and no custom slug provided
             project.published_slug = f"{project.slug}-{secrets.token_urlsafe(8)}"
         
+        # Pages are copied again when publishing to a new location
+        if project.published_slug != old_published_slug:
+            project.pages.update(published_fingerprint='')
+        
         # Generate published version
         from .tasks import publish_flipbook_task
         publish_flipbook_task.delay(project.id)
@@ -736,6 +1113,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         # S3: Republish with new slug (S3 doesn't support rename)
         if old_slug:
             from .tasks import publish_flipbook_task
+            project.pages.update(published_fingerprint='')
             publish_flipbook_task.delay(project.id)
         
         serializer = self.get_serializer(project, context={'request': request})
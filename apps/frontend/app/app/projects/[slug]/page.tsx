@@ -1,6 +1,6 @@
 'use client'
 
-import { useEffect, useState } from 'react'
+import { useEffect, useRef, useState } from 'react'
 import { useParams, useRouter } from 'next/navigation'
 import Link from 'next/link'
 import api from '@/lib/api'
@@ -15,6 +15,9 @@ interface Project {
   status: string
   error_message: string
   total_pages: number
+  progress_stage: string
+  pages_rendered: number
+  pages_uploaded: number
   can_download: boolean
   can_publish: boolean
   is_published: boolean
@@ -166,10 +169,13 @@ export default function ProjectDetailPage() {
   const [logoPreview, setLogoPreview] = useState<string | null>(null)
   const [showDeleteModal, setShowDeleteModal] = useState(false)
   const [deleting, setDeleting] = useState(false)
+  const [cancelling, setCancelling] = useState(false)
+
+  const statusRef = useRef<string | null>(null)
 
   useEffect(() => {
     loadProject()
-    const interval = setInterval(loadProject, 5000) // Poll every 5 seconds
+    const interval = setInterval(pollStatus, 5000) // Poll every 5 seconds
     return () => clearInterval(interval)
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [params.slug])
@@ -177,6 +183,7 @@ export default function ProjectDetailPage() {
   const loadProject = async () => {
     try {
       const response = await api.get(`/projects/${params.slug}/`)
+      statusRef.current = response.data.status
       setProject(response.data)
     } catch (error) {
       toast.error('Projekt nicht gefunden')
@@ -186,6 +193,20 @@ export default function ProjectDetailPage() {
     }
   }
 
+  // Polls only the processing state; the full project is reloaded when the status changes
+  const pollStatus = async () => {
+    try {
+      const response = await api.get(`/projects/${params.slug}/status/`)
+      if (response.data.status !== statusRef.current) {
+        loadProject()
+      } else {
+        setProject((current) => (current ? { ...current, ...response.data } : current))
+      }
+    } catch (error) {
+      // The next poll tries again
+    }
+  }
+
   useEffect(() => {
     loadUser()
     // eslint-disable-next-line react-hooks/exhaustive-deps
@@ -280,6 +301,33 @@ export default function ProjectDetailPage() {
     }
   }
 
+  const handleCancel = async () => {
+    if (!confirm('Verarbeitung wirklich abbrechen? Bereits konvertierte Seiten werden verworfen.')) {
+      return
+    }
+
+    setCancelling(true)
+    try {
+      await api.post(`/projects/${project!.slug}/cancel/`)
+      toast.success('Verarbeitung abgebrochen')
+      loadProject()
+    } catch (error: any) {
+      toast.error(error.response?.data?.error || 'Fehler beim Abbrechen der Verarbeitung')
+    } finally {
+      setCancelling(false)
+    }
+  }
+
+  const cancelButton = (
+    <button
+      onClick={handleCancel}
+      disabled={cancelling}
+      className="mt-3 px-4 py-2 border border-yellow-400 text-yellow-800 dark:text-yellow-200 rounded-lg hover:bg-yellow-100 dark:hover:bg-yellow-900/40 disabled:opacity-50"
+    >
+      {cancelling ? 'Wird abgebrochen...' : 'Verarbeitung abbrechen'}
+    </button>
+  )
+
   const handleDelete = async () => {
     if (!confirm('Sind Sie sicher, dass Sie dieses Projekt löschen möchten? Alle Dateien und Daten werden unwiderruflich gelöscht.')) {
       return
@@ -346,10 +394,50 @@ export default function ProjectDetailPage() {
             </div>
           )}
 
+          {project.status === 'uploading' && project.progress_stage === 'queued' && (
+            <div className="mb-6 p-4 bg-yellow-50 dark:bg-yellow-900/20 border border-yellow-200 dark:border-yellow-800 rounded-lg">
+              <div className="font-semibold text-yellow-800 dark:text-yellow-200">In der Warteschlange...</div>
+              <div className="text-sm text-yellow-600 dark:text-yellow-300">
+                Die Verarbeitung startet automatisch, sobald ein Platz frei ist.
+              </div>
+              <div>{cancelButton}</div>
+            </div>
+          )}
+
           {project.status === 'processing' && (
             <div className="mb-6 p-4 bg-yellow-50 dark:bg-yellow-900/20 border border-yellow-200 dark:border-yellow-800 rounded-lg">
               <div className="font-semibold text-yellow-800 dark:text-yellow-200">Verarbeitung läuft...</div>
+              {project.total_pages > 0 && project.pages_uploaded > 0 && (
+                <div className="my-2">
+                  <div className="h-2 bg-yellow-100 dark:bg-yellow-900/40 rounded">
+                    <div
+                      className="h-2 bg-yellow-500 rounded"
+                      style={{ width: `${Math.min(100, (project.pages_uploaded / project.total_pages) * 100)}%` }}
+                    />
+                  </div>
+                  <div className="text-sm text-yellow-600 dark:text-yellow-300 mt-1">
+                    {project.pages_uploaded} von {project.total_pages} Seiten fertig
+                  </div>
+                </div>
+              )}
               <div className="text-sm text-yellow-600 dark:text-yellow-300">Bitte warten Sie, die Seite aktualisiert sich automatisch.</div>
+              <div>{cancelButton}</div>
+            </div>
+          )}
+
+          {project.status === 'partial' && (
+            <div className="mb-6 p-4 bg-yellow-50 dark:bg-yellow-900/20 border border-yellow-200 dark:border-yellow-800 rounded-lg">
+              <div className="font-semibold text-yellow-800 dark:text-yellow-200">Verarbeitung läuft...</div>
+              <div className="text-sm text-yellow-600 dark:text-yellow-300 mb-3">
+                Die ersten Seiten sind bereits fertig, die übrigen folgen automatisch.
+              </div>
+              <Link
+                href={`/app/projects/${project.slug}/preview`}
+                className="inline-block px-4 py-2 bg-primary-600 text-white rounded-lg hover:bg-primary-700 transition-colors shadow-md"
+              >
+                Vorschau
+              </Link>
+              <div>{cancelButton}</div>
             </div>
           )}
 
@@ -9,6 +9,7 @@ import { FlipbookViewer } from '@/app/app/components/FlipbookViewer'
 interface Project {
   slug: string
   title: string
+  status: string
   can_download?: boolean
   pages: Array<{
     page_number: number
@@ -18,6 +19,7 @@ interface Project {
   }>
   pages_json: {
     total_pages: number
+    expected_pages?: number
     pages: Array<{
       page_number: number
       file: string
@@ -45,6 +47,14 @@ export default function PreviewPage() {
     // eslint-disable-next-line react-hooks/exhaustive-deps
   }, [params.slug])
 
+  // While the rest of the document is processed, pick up newly available pages
+  useEffect(() => {
+    if (project?.status !== 'partial') return
+    const interval = setInterval(loadProject, 10000)
+    return () => clearInterval(interval)
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [project?.status])
+
   const loadProject = async () => {
     try {
       setError(null)
@@ -143,6 +153,11 @@ export default function PreviewPage() {
 
   return (
     <div className="min-h-screen bg-gradient-to-br from-gray-50 to-gray-100 dark:from-gray-900 dark:to-gray-800">
+      {project.status === 'partial' && (
+        <div className="p-2 text-center text-sm bg-yellow-50 dark:bg-yellow-900/20 text-yellow-700 dark:text-yellow-300">
+          {project.pages_json.total_pages} von {project.pages_json.expected_pages || '?'} Seiten verfügbar, die übrigen werden noch verarbeitet...
+        </div>
+      )}
       <FlipbookViewer project={project} />
     </div>
   )
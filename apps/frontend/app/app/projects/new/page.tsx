@@ -4,6 +4,8 @@ import { useState } from 'react'
 import { useRouter } from 'next/navigation'
 import Link from 'next/link'
 import api from '@/lib/api'
+import { directUpload } from '@/lib/directUpload'
+import { resumableUpload } from '@/lib/resumableUpload'
 import toast from 'react-hot-toast'
 
 export default function NewProjectPage() {
@@ -12,6 +14,7 @@ export default function NewProjectPage() {
   const [description, setDescription] = useState('')
   const [file, setFile] = useState<File | null>(null)
   const [loading, setLoading] = useState(false)
+  const [uploadProgress, setUploadProgress] = useState<number | null>(null)
 
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault()
@@ -24,42 +27,22 @@ export default function NewProjectPage() {
     setLoading(true)
 
     try {
-      const formData = new FormData()
-      formData.append('title', title)
-      formData.append('description', description)
-      formData.append('pdf_file', file)
-
-      const response = await api.post('/projects/', formData, {
-        headers: {
-          'Content-Type': 'multipart/form-data',
-        },
-      })
-
-      // Ensure slug is available before redirecting
-      if (!response.data.slug) {
-        // If slug is not in response, try to get project by ID
-        if (response.data.id) {
-          // Wait a bit and fetch the project to get the slug
-          await new Promise(resolve => setTimeout(resolve, 500))
-          try {
-            const projectResponse = await api.get(`/projects/${response.data.id}/`)
-            if (projectResponse.data.slug) {
-              router.push(`/app/projects/${projectResponse.data.slug}`)
-              toast.success('Projekt erstellt! Verarbeitung läuft...')
-              return
-            }
-          } catch (fetchError) {
-            console.error('Error fetching project:', fetchError)
-          }
-        }
-        // Fallback: redirect to dashboard if slug is not available
+      // Upload straight to storage; servers without S3 storage take the file themselves
+      try {
+        const slug = await directUpload('/projects/upload/start/', { title, description }, file, setUploadProgress)
         toast.success('Projekt erstellt! Verarbeitung läuft...')
-        router.push('/app/dashboard')
+        router.push(`/app/projects/${slug}`)
         return
+      } catch (error: any) {
+        if (error.response?.data?.code !== 'direct_upload_unavailable') {
+          throw error
+        }
       }
 
+      // In resumable chunks through the API, continued after connection drops
+      const project = await resumableUpload({ title, description }, file, setUploadProgress)
       toast.success('Projekt erstellt! Verarbeitung läuft...')
-      router.push(`/app/projects/${response.data.slug}`)
+      router.push(`/app/projects/${project.slug}`)
     } catch (error: any) {
       console.error('Project creation error:', error)
       // Show detailed error message
@@ -86,6 +69,7 @@ export default function NewProjectPage() {
       }
     } finally {
       setLoading(false)
+      setUploadProgress(null)
     }
   }
 
@@ -142,7 +126,11 @@ export default function NewProjectPage() {
             disabled={loading}
             className="w-full px-4 py-2 bg-primary-600 text-white rounded-lg hover:bg-primary-700 disabled:opacity-50"
           >
-            {loading ? 'Lädt...' : 'Projekt erstellen'}
+            {loading
+              ? uploadProgress !== null
+                ? `Lädt hoch... ${Math.round(uploadProgress * 100)}%`
+                : 'Lädt...'
+              : 'Projekt erstellen'}
           </button>
         </form>
       </div>
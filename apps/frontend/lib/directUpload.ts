@@ -0,0 +1,57 @@
+import axios from 'axios'
+import api from '@/lib/api'
+
+// Parts uploaded at the same time
+const PARALLEL_PARTS = 3
+
+interface UploadInstructions {
+  slug: string
+  part_size: number
+  parts: { part_number: number; url: string }[]
+}
+
+/**
+ * Upload a PDF straight to storage with the presigned URLs from `startPath`
+ * and complete it (processing starts then). Returns the project slug.
+ * Rejects with code 'direct_upload_unavailable' when the server has no S3 storage.
+ */
+export async function directUpload(
+  startPath: string,
+  data: Record<string, string>,
+  file: File,
+  onProgress?: (fraction: number) => void
+): Promise<string> {
+  const response = await api.post(startPath, { ...data, filename: file.name, size: file.size })
+  const upload: UploadInstructions = response.data
+  const loaded: Record<number, number> = {}
+  const etags: { part_number: number; etag: string }[] = []
+
+  const uploadPart = async (part: UploadInstructions['parts'][number]) => {
+    const start = (part.part_number - 1) * upload.part_size
+    const blob = file.slice(start, Math.min(start + upload.part_size, file.size))
+    // Plain axios: the auth header of the API client must not be sent to the bucket
+    const result = await axios.put(part.url, blob, {
+      onUploadProgress: (event) => {
+        loaded[part.part_number] = event.loaded
+        onProgress?.(Object.values(loaded).reduce((sum, value) => sum + value, 0) / file.size)
+      },
+    })
+    etags.push({ part_number: part.part_number, etag: result.headers['etag'] })
+  }
+
+  try {
+    const queue = [...upload.parts]
+    await Promise.all(
+      Array.from({ length: Math.min(PARALLEL_PARTS, queue.length) }, async () => {
+        for (let part = queue.shift(); part; part = queue.shift()) {
+          await uploadPart(part)
+        }
+      })
+    )
+    await api.post(`/projects/${upload.slug}/upload/complete/`, { parts: etags })
+  } catch (error) {
+    api.post(`/projects/${upload.slug}/upload/abort/`).catch(() => {})
+    throw error
+  }
+  return upload.slug
+}
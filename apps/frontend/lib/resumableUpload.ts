@@ -0,0 +1,70 @@
+import api from '@/lib/api'
+
+// Attempts per chunk before giving up (the upload can still be resumed later)
+const MAX_ATTEMPTS = 8
+
+const storageKey = (file: File) => `flipread-upload:${file.name}:${file.size}:${file.lastModified}`
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms))
+
+/**
+ * Upload a PDF in chunks through the API and complete it (processing starts then).
+ * Interrupted chunks are continued at the offset the server reports; the session
+ * id is kept in localStorage, so a reload with the same file continues as well.
+ * Returns the completed project.
+ */
+export async function resumableUpload(
+  data: Record<string, string>,
+  file: File,
+  onProgress?: (fraction: number) => void
+): Promise<any> {
+  let session: { id: string; offset: number; chunk_size?: number } | null = null
+  const savedId = localStorage.getItem(storageKey(file))
+  if (savedId) {
+    try {
+      session = (await api.get(`/projects/uploads/${savedId}/`)).data
+    } catch {
+      localStorage.removeItem(storageKey(file))
+    }
+  }
+  if (!session) {
+    session = (await api.post('/projects/uploads/start/', { ...data, filename: file.name, size: file.size })).data
+    localStorage.setItem(storageKey(file), session!.id)
+  }
+  const { id } = session!
+  const chunkSize = session!.chunk_size || 8 * 1024 * 1024
+  let offset = session!.offset
+  let attempts = 0
+
+  while (offset < file.size) {
+    const chunk = file.slice(offset, Math.min(offset + chunkSize, file.size))
+    try {
+      const response = await api.patch(`/projects/uploads/${id}/`, chunk, {
+        headers: { 'Content-Type': 'application/offset+octet-stream', 'Upload-Offset': String(offset) },
+        onUploadProgress: (event) => onProgress?.((offset + event.loaded) / file.size),
+      })
+      offset = response.data.offset
+      attempts = 0
+    } catch (error: any) {
+      if (error.response?.status === 409) {
+        offset = error.response.data.offset
+        continue
+      }
+      if ((error.response && error.response.status < 500) || ++attempts >= MAX_ATTEMPTS) {
+        throw error
+      }
+      // Connection dropped: ask where the upload stands and continue from there
+      await sleep(Math.min(1000 * 2 ** attempts, 30000))
+      try {
+        offset = (await api.get(`/projects/uploads/${id}/`)).data.offset
+      } catch {
+        // Still offline, retry the same chunk
+      }
+    }
+  }
+  onProgress?.(1)
+
+  const response = await api.post(`/projects/uploads/${id}/complete/`)
+  localStorage.removeItem(storageKey(file))
+  return response.data
+}